@@ -0,0 +1,170 @@
+"""
+This module contains the class Analytics: aggregates of the ledger maintained incrementally, block by block, so that
+queries do not scan the chain (served by the node on /analytics/...):
+
+- the balance of every company (accounts which are not admins) and the total supply, i.e. the credits held by the
+  companies
+- per period (config.analytics_period: 'month', 'quarter' or 'year', from the date of the transactions): the credits
+  issued (grants of the admins), burned (penalties of the admins and reductions of the companies themselves) and
+  transferred between companies
+- the ranking of the holders, kept sorted so that the top N is a slice
+- per period, the flows between companies: (author, dest) -> credits transferred
+
+The effect of a transaction on the balances follows Blockchain.get_balance. The new blocks are not deduplicated
+against the chain, since Blockchain.extend_chain rejects the blocks repeating a transaction of the chain. A replaced
+chain (merge, replica) is not checked by the blockchain, so the transactions are deduplicated when the aggregates are
+recomputed from it.
+"""
+
+from bisect import bisect_left, insort
+from collections import defaultdict
+import config
+
+
+def period_of(date, period=None):
+    """
+    :param date: str in the format of utils.time_format
+    :param period: 'month', 'quarter' or 'year' (None: config.analytics_period)
+    :return: the period of the date, e.g. '2024-07', '2024-Q3' or '2024'
+    """
+    period = period or config.analytics_period
+    if period == 'year':
+        return date[:4]
+    if period == 'month':
+        return date[:7]
+    return f"{date[:4]}-Q{(int(date[5:7]) - 1) // 3 + 1}"
+
+
+class Analytics(object):
+    def __init__(self, chain=(), admins=None):
+        """
+        :param chain: the blocks already in the chain
+        :param admins: hashes of the admins (None: config.admin_list)
+        """
+        self.admins = set(config.admin_list if admins is None else admins)
+        self.reset(chain)
+
+    def reset(self, chain=()):
+        """
+        Recompute the aggregates from the blocks of a chain
+        """
+        self.height = -1
+        self.balances = {}  # company -> balance
+        self.ranking = []  # (-balance, company), sorted
+        self.supply = 0
+        self.periods = defaultdict(lambda: {'issued': 0, 'burned': 0, 'transferred': 0, 'transactions': 0})
+        self.flows = defaultdict(lambda: defaultdict(int))  # period -> (author, dest) -> credits
+        seen = set()
+        for block in chain:
+            for transaction in block.transactions:
+                transaction_hash = transaction.hash()
+                if transaction_hash not in seen:
+                    seen.add(transaction_hash)
+                    self.add_transaction(transaction)
+            self.height = block.index
+
+    def listener(self, event, data):
+        """
+        Blockchain listener: apply the new blocks, recompute after a merge
+        """
+        if event == 'block':
+            self.add_block(data)
+        elif event == 'merge':
+            self.reset(data.chain)
+
+    def _credit(self, account, amount):
+        """
+        Change the balance of a company and its rank
+        """
+        old = self.balances.get(account, 0)
+        if account in self.balances:
+            del self.ranking[bisect_left(self.ranking, (-old, account))]
+        new = old + amount
+        self.balances[account] = new
+        insort(self.ranking, (-new, account))
+        self.supply += amount
+
+    def add_block(self, block):
+        for transaction in block.transactions:
+            self.add_transaction(transaction)
+        self.height = block.index
+
+    def add_transaction(self, transaction):
+        value = int(transaction.value)
+        author, dest = transaction.author, transaction.dest
+        stats = self.periods[period_of(transaction.date)]
+        stats['transactions'] += 1
+
+        # Deltas of the balances (see Blockchain.get_balance)
+        deltas = {author: value} if author == dest else {author: -value, dest: value}
+        companies = {account: delta for account, delta in deltas.items() if account not in self.admins}
+        for account, delta in companies.items():
+            self._credit(account, delta)
+
+        change = sum(companies.values())
+        if change > 0:
+            stats['issued'] += change
+        elif change < 0:
+            stats['burned'] -= change
+        elif len(companies) == 2:
+            stats['transferred'] += value
+            self.flows[period_of(transaction.date)][(author, dest)] += value
+
+    def top_holders(self, n):
+        """
+        :return: the n companies with the highest balances, as a list of (company, balance)
+        """
+        return [(account, -balance) for balance, account in self.ranking[:n]]
+
+    def period(self, period):
+        """
+        :param period: e.g. '2024-Q3' (see period_of)
+        :return: dict with the credits issued, burned and transferred and the number of transactions of the period
+        """
+        return dict(self.periods.get(period) or {'issued': 0, 'burned': 0, 'transferred': 0, 'transactions': 0})
+
+    def period_flows(self, period, account=None):
+        """
+        :param period: e.g. '2024-Q3'
+        :param account: only the flows from or to this company (None: all)
+        :return: list of (author, dest, credits), largest first
+        """
+        flows = self.flows.get(period, {})
+        return sorted(((author, dest, credits) for (author, dest), credits in flows.items()
+                       if account is None or account in (author, dest)), key=lambda flow: -flow[2])
+
+    def summary(self):
+        return {
+            'height': self.height,
+            'supply': self.supply,
+            'companies': len(self.balances),
+            'periods': sorted(self.periods),
+        }
+
+
+def test():
+    import time
+    from benchmark import Fixture
+    fixture = Fixture(20000)
+    blockchain = fixture.blockchain
+
+    start = time.perf_counter()
+    analytics = Analytics(blockchain.chain)
+    print(f"Built from {len(blockchain)} blocks in {time.perf_counter() - start:.3f} s")
+
+    balances = blockchain.get_balances()
+    for account, balance in analytics.top_holders(5):
+        assert balances[account] == balance
+        print(account[:12], balance)
+    assert analytics.supply == sum(b for a, b in balances.items() if a not in analytics.admins)
+
+    summary = analytics.summary()
+    print(summary)
+    stats = analytics.period(summary['periods'][0])
+    assert stats['issued'] - stats['burned'] == analytics.supply
+    print(stats)
+    print(analytics.period_flows(summary['periods'][0])[:3])
+
+
+if __name__ == '__main__':
+    test()
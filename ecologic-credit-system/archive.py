@@ -0,0 +1,178 @@
+"""
+This module contains the class Archive, the file where the node moves the bodies of the blocks it prunes from its
+chain (see Blockchain.enable_pruning). The chain then keeps in memory the full blocks of the last config.prune_keep
+blocks only, and the headers (see block.BlockHeader) of the older ones.
+
+The archive is a file of json lines, one per block, appended in the order of the chain: the fields of the block and its
+transactions with their signatures. It is read sequentially, to check the validity of the pruned part of the chain or
+to answer the queries which need the old transactions (histories, date ranges).
+
+The hashes of the archived transactions stay in memory (to reject replays without reading the archive), in an
+ArchivedHashes: 32 bytes per transaction in a sorted array, instead of about 150 bytes for a hexadecimal string in a
+set.
+"""
+
+import heapq
+import json
+import config
+from block import Block
+from transaction import Transaction
+
+
+def block_to_dict(block):
+    """
+    :return: the fields of a full block and its transactions with their signatures (also sent by /blocks)
+    """
+    return {'index': block.index, 'timestamp': block.timestamp, 'previous_hash': block.previous_hash,
+            'proof': block.proof, 'transactions': [dict(t.data, signature=t.signature) for t in block.transactions]}
+
+
+def block_from_dict(data):
+    """
+    :param data: dict built by block_to_dict
+    :return: the block
+    """
+    transactions = [Transaction(t['message'], t['value'], t['dest'], t['date'], t['signature'], t['vk'], t['author'])
+                    for t in data['transactions']]
+    return Block(dict(data, transactions=transactions))
+
+
+class ArchivedHashes(object):
+    size = 32  # bytes of a digest (sha256)
+    merge_min = 4096  # minimum number of recent digests before they are merged in the sorted array
+
+    def __init__(self):
+        """
+        Set of the hashes (hexadecimal sha256) of the archived transactions. The digests are kept sorted in a bytes
+        object, searched by bisection (O(log n)). The new ones go to a small set first, merged in the sorted array when
+        it exceeds an eighth of the array (or merge_min): each digest is copied O(log n) times in total.
+        """
+        self.sorted = b''
+        self.recent = set()
+
+    def add(self, transaction_hash):
+        self.recent.add(bytes.fromhex(transaction_hash))
+        if len(self.recent) >= max(self.merge_min, len(self.sorted) // self.size // 8):
+            self._merge()
+
+    def _merge(self):
+        old = (self.sorted[i:i + self.size] for i in range(0, len(self.sorted), self.size))
+        self.sorted = b''.join(heapq.merge(old, sorted(self.recent)))
+        self.recent = set()
+
+    def __contains__(self, transaction_hash):
+        try:
+            digest = bytes.fromhex(transaction_hash)
+        except (TypeError, ValueError):
+            return False
+        if digest in self.recent:
+            return True
+        # Bisection on the packed digests
+        data, size = self.sorted, self.size
+        lo, hi = 0, len(data) // size
+        while lo < hi:
+            middle = (lo + hi) // 2
+            current = data[middle * size:(middle + 1) * size]
+            if current == digest:
+                return True
+            if current < digest:
+                lo = middle + 1
+            else:
+                hi = middle
+        return False
+
+    def __len__(self):
+        return len(self.sorted) // self.size + len(self.recent)
+
+    def clear(self):
+        self.sorted = b''
+        self.recent = set()
+
+
+class Archive(object):
+    def __init__(self, path=config.archive_path):
+        """
+        Open an empty archive: the file is truncated, the chain of a node starts from the genesis.
+        :param path: path of the file
+        """
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.size = 0  # bytes written
+        self.count = 0  # number of blocks
+        self.last_time = None  # latest date of the archived transactions (microseconds, see utils.str_to_us)
+
+    def append(self, block):
+        line = json.dumps(block_to_dict(block)) + '\n'
+        self.file.write(line)
+        self.file.flush()
+        self.size += len(line.encode())
+        self.count += 1
+        for transaction in block.transactions:
+            if self.last_time is None or transaction.timestamp_us > self.last_time:
+                self.last_time = transaction.timestamp_us
+
+    def blocks(self):
+        """
+        Read the archived blocks, in order (a block appended during the iteration is not read)
+        :return: a generator of blocks
+        """
+        end = self.size
+        with open(self.path, 'rb') as f:
+            while f.tell() < end:
+                yield block_from_dict(json.loads(f.readline()))
+
+    def clear(self):
+        self.file.seek(0)
+        self.file.truncate()
+        self.size = 0
+        self.count = 0
+        self.last_time = None
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+
+def test():
+    import os
+    import tempfile
+    import utils
+    from benchmark import Fixture
+    fixture = Fixture(5000)
+    full = fixture.blockchain
+    pruned = fixture.clone()
+    path = os.path.join(tempfile.mkdtemp(), 'test.archive')
+    pruned.enable_pruning(10, Archive(path))
+    in_memory = sum(len(block.transactions) for block in pruned.chain)
+    print(f"{len(pruned.archive)} blocks archived ({os.path.getsize(path) / 1e6:.1f} MB), "
+          f"{in_memory} transactions in memory")
+
+    for transaction in fixture.signed_transfers(3):
+        block = full.last_block.next([transaction])
+        full.extend_chain(block)
+        pruned.extend_chain(block)
+    assert pruned.first_full == pruned.last_block.index - 9
+
+    assert pruned.get_balances() == full.get_balances()
+    account = fixture.accounts[0]
+    assert pruned.get_balance(account) == full.get_balance(account)
+    assert pruned.get_transaction_history(account) == full.get_transaction_history(account)
+    start, end = utils.str_to_us("2024-01-01 00:00:01.000000"), utils.str_to_us("2024-01-01 00:00:02.000000")
+    assert ([t.hash() for t in pruned.get_transactions_between(start, end)] ==
+            [t.hash() for t in full.get_transactions_between(start, end)])
+    assert pruned.validity() and pruned.validity(archive=False) and full.validity()
+    print(pruned.chain[1], pruned.checkpoint)
+
+    hashes = ArchivedHashes()
+    hashes.merge_min = 100
+    added = [t.hash() for block in full.chain for t in block.transactions][:1000]
+    for transaction_hash in added:
+        hashes.add(transaction_hash)
+    assert all(transaction_hash in hashes for transaction_hash in added) and len(hashes) == len(set(added))
+    assert "00" * 32 not in hashes and "not a hash" not in hashes
+
+
+if __name__ == '__main__':
+    test()
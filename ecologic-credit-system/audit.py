@@ -0,0 +1,156 @@
+"""
+Audit of the ledger: every balance recomputed from the genesis with NumPy, and compared with a state kept elsewhere
+(the incremental aggregates of analytics.py, a cache of the interface, the answers of another node...).
+
+Columns converts the chain into columnar arrays, one row per transaction: author id, dest id, value (signed int) and
+block index. The balances of all the accounts are then two scatter-adds (np.add.at), and the balances at any height
+are the same on the first rows only, since the rows are in the order of the chain. The rules are those of
+Blockchain.get_balance: a self transaction adds its value to its author, and a transaction appearing twice in the chain
+is only counted the first time.
+"""
+
+import time
+import numpy as np
+
+
+class Columns(object):
+    def __init__(self, chain):
+        """
+        :param chain: list of blocks, from the genesis
+        """
+        ids = {}  # account -> id, in the order of first appearance
+        authors, dests, values, blocks = [], [], [], []
+        seen = set()
+        for block in chain:
+            for transaction in block.transactions:
+                transaction_hash = transaction.hash()
+                if transaction_hash in seen:
+                    continue
+                seen.add(transaction_hash)
+                authors.append(ids.setdefault(transaction.author, len(ids)))
+                dests.append(ids.setdefault(transaction.dest, len(ids)))
+                values.append(int(transaction.value))
+                blocks.append(block.index)
+
+        self.ids = ids
+        self.accounts = list(ids)
+        self.author = np.array(authors, dtype=np.int64)
+        self.dest = np.array(dests, dtype=np.int64)
+        self.value = np.array(values, dtype=np.int64)
+        self.block = np.array(blocks, dtype=np.int64)
+        self.height = chain[-1].index if chain else -1
+
+    def __len__(self):
+        return len(self.value)
+
+    def _rows(self, height):
+        """
+        :return: the number of transactions in the blocks up to height (included)
+        """
+        if height is None:
+            return len(self.value)
+        return int(np.searchsorted(self.block, height, side='right'))
+
+    def balance_array(self, height=None):
+        """
+        :param height: index of the last block counted (None: the whole chain)
+        :return: array of the balances, indexed by account id
+        """
+        n = self._rows(height)
+        author, dest, value = self.author[:n], self.dest[:n], self.value[:n]
+        transfer = author != dest
+        balances = np.zeros(len(self.accounts), dtype=np.int64)
+        np.add.at(balances, dest, value)
+        np.subtract.at(balances, author[transfer], value[transfer])
+        return balances
+
+    def balances(self, height=None):
+        """
+        Same as Blockchain.get_balances() at a height
+        :param height: index of the last block counted (None: the whole chain)
+        :return: dict account -> balance, for the accounts appearing in the chain up to height
+        """
+        n = self._rows(height)
+        if n == 0:
+            return {}
+        # The ids are given in the order of appearance: the accounts seen in the first n rows are the first ids
+        seen = int(max(self.author[:n].max(), self.dest[:n].max())) + 1
+        balances = self.balance_array(height)
+        return dict(zip(self.accounts[:seen], balances[:seen].tolist()))
+
+    def history(self, account):
+        """
+        :param account: hash of a verifying key
+        :return: list of (block index, balance after the block), for the blocks which changed the balance
+        """
+        i = self.ids.get(account)
+        if i is None:
+            return []
+        received = self.dest == i
+        sent = (self.author == i) & ~received
+        rows = received | sent
+        deltas = np.where(received[rows], self.value[rows], -self.value[rows])
+        balances = np.cumsum(deltas)
+        blocks = self.block[rows]
+        # Last row of each block
+        last = np.append(blocks[1:] != blocks[:-1], True)
+        return list(zip(blocks[last].tolist(), balances[last].tolist()))
+
+
+def audit(columns, cached, height=None):
+    """
+    Compare balances kept elsewhere with the balances recomputed from the chain
+    :param columns: Columns of the chain
+    :param cached: dict account -> balance (it may hold only some of the accounts)
+    :param height: index of the block at which the cached balances are valid (None: the whole chain)
+    :return: list of dict {'account', 'expected', 'cached'}, for the accounts of cached whose balance is wrong
+    """
+    expected = columns.balances(height)
+    return [{'account': account, 'expected': expected.get(account, 0), 'cached': balance}
+            for account, balance in cached.items() if expected.get(account, 0) != balance]
+
+
+def test():
+    import random
+    from benchmark import Fixture
+    fixture = Fixture(100000)
+    blockchain = fixture.blockchain
+
+    start = time.perf_counter()
+    columns = Columns(blockchain.chain)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    balances = columns.balances()
+    computed = time.perf_counter() - start
+    print(f"{len(columns)} transactions, {len(columns.accounts)} accounts: columns built in {built:.3f} s, "
+          f"balances in {computed * 1000:.2f} ms")
+
+    start = time.perf_counter()
+    reference = blockchain.get_balances()
+    print(f"Blockchain.get_balances: {time.perf_counter() - start:.3f} s")
+    assert balances == dict(reference)
+
+    sample = random.Random(0).sample(fixture.accounts, 5)
+    start = time.perf_counter()
+    for account in sample:
+        assert blockchain.get_balance(account) == balances[account]
+    per_account = (time.perf_counter() - start) / len(sample)
+    print(f"Blockchain.get_balance: {per_account:.3f} s per account, "
+          f"{per_account * len(columns.accounts):.1f} s for every account")
+
+    # Historical heights and histories
+    from blockchain import Blockchain
+    height = blockchain.last_block.index // 2
+    past = Blockchain()
+    past.chain = blockchain.chain[:height + 1]
+    assert columns.balances(height) == dict(past.get_balances())
+    history = columns.history(sample[0])
+    assert history[-1][1] == balances[sample[0]]
+    print(f"History of {sample[0][:12]}: {history[:3]}...")
+
+    cached = dict(balances, **{sample[1]: balances[sample[1]] + 1})
+    print(audit(columns, cached))
+
+
+if __name__ == '__main__':
+    test()
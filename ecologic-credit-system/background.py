@@ -0,0 +1,214 @@
+"""
+Background work for the interface (interface.py), so that the Tk main thread never waits for the node:
+
+- Worker runs the network calls in a pool of threads. The results are put in a queue which the main thread polls with
+  root.after (Tk must only be used from the main thread), and the callbacks are called there.
+- LedgerCache keeps the balances and histories already fetched, with the height of the chain at which they are valid.
+  It follows the events of the node (/events, see events.py): at each new block, the entries of the subscribed
+  accounts are moved to the new height, the balances are updated with the pushed deltas and the histories of the
+  accounts which changed are dropped. The other entries are fetched again when they are next needed.
+"""
+
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
+from client import NodeError
+
+logger = logging.getLogger(__name__)
+
+
+class Worker(object):
+    def __init__(self, workers=config.gui_workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.results = queue.Queue()
+
+    def submit(self, function, on_done, on_error=None):
+        """
+        Run function in the pool. on_done(result) or on_error(exception) is called by poll, in the main thread.
+        """
+        def run():
+            try:
+                self.results.put((on_done, function()))
+            except Exception as e:
+                if on_error is None:
+                    logger.exception("Background task failed")
+                else:
+                    self.results.put((on_error, e))
+        self.executor.submit(run)
+
+    def poll(self):
+        """
+        Call the callbacks of the finished tasks. Must be called from the main thread. The exceptions of a callback are
+        logged, so that they do not prevent the following callbacks from being called.
+        """
+        while True:
+            try:
+                callback, value = self.results.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                callback(value)
+            except Exception:
+                logger.exception("Callback %r failed", callback)
+
+    def schedule(self, root, interval=config.gui_poll_interval):
+        """
+        Poll the results every interval milliseconds with root.after
+        """
+        try:
+            self.poll()
+        finally:
+            root.after(interval, self.schedule, root, interval)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LedgerCache(object):
+    def __init__(self, client):
+        """
+        :param client: a NodeClient
+        """
+        self.client = client
+        self.lock = threading.Lock()
+        self.height = None  # Height of the chain of the node, known from the events (None: unknown)
+        self.balances = {}  # account -> (height, balance)
+        self.histories = {}  # account -> (height, history)
+        self.advanced = set()  # accounts whose balance was moved to the height of the last block
+        self.watched = set()  # accounts whose deltas are wanted
+        self.subscribed = frozenset()  # accounts of the current subscription
+        self.running = False
+
+    def watch(self, account):
+        with self.lock:
+            self.watched.add(account)
+
+    def _get(self, entries, account, path, field):
+        """
+        An entry of the cache if it is at the height of the chain, else fetched from the node (blocking: call it in a
+        Worker). The responses of the node carry the height at which they were computed.
+        """
+        self.watch(account)
+        with self.lock:
+            entry = entries.get(account)
+            if entry is not None and self.height is not None and entry[0] == self.height:
+                return entry[1]
+
+        data = self.client.conditional('POST', path, {'hash': account})
+        with self.lock:
+            entries[account] = (data['height'], data[field])
+            self.advanced.discard(account)
+        return data[field]
+
+    def balance(self, account):
+        return self._get(self.balances, account, '/balance', 'balance')
+
+    def history(self, account):
+        return self._get(self.histories, account, '/past_transactions', 'histo')
+
+    def on_event(self, event, data):
+        with self.lock:
+            if event == 'height':
+                self.height = data['index']
+            elif event == 'block':
+                previous, self.height = self.height, data['index']
+                self.advanced = set()
+                for account in self.subscribed:
+                    # Unchanged unless a delta follows (the deltas of a block follow its header)
+                    entry = self.balances.get(account)
+                    if entry is not None and entry[0] == previous:
+                        self.balances[account] = (self.height, entry[1])
+                        self.advanced.add(account)
+                    entry = self.histories.get(account)
+                    if entry is not None and entry[0] == previous:
+                        self.histories[account] = (self.height, entry[1])
+            elif event == 'balance':
+                account = data['account']
+                # A balance fetched at this height already contains the delta
+                if account in self.advanced:
+                    height, balance = self.balances[account]
+                    self.balances[account] = (height, balance + data['delta'])
+                self.histories.pop(account, None)
+            elif event == 'reset':
+                self.height = None
+                self.balances.clear()
+                self.histories.clear()
+            elif event == 'dropped':
+                # The entries stay: the height of the next subscription tells if they are still up to date
+                self.height = None
+
+    def follow(self):
+        """
+        Follow the events of the node in a daemon thread. The subscription is renewed with the watched accounts at the
+        next event after a new account is watched, and after a disconnection.
+        """
+        self.running = True
+        threading.Thread(target=self._follow, name="events", daemon=True).start()
+
+    def _follow(self):
+        while self.running:
+            with self.lock:
+                self.subscribed = frozenset(self.watched)
+            try:
+                for event, data in self.client.events(self.subscribed):
+                    self.on_event(event, data)
+                    if not self.running or self.watched != self.subscribed:
+                        break
+            except (NodeError, OSError) as e:
+                logger.warning("Event stream interrupted: %s", e)
+            except Exception:
+                logger.exception("Event stream failed")
+            self.on_event('dropped', {})
+            if self.running:
+                threading.Event().wait(config.client_backoff)
+
+    def stop(self):
+        self.running = False
+
+
+def test():
+    class FakeClient(object):
+        calls = 0
+        height = 5
+
+        def conditional(self, method, path, payload):
+            self.calls += 1
+            return {'balance': 100, 'histo': [], 'height': self.height}
+
+    client = FakeClient()
+    cache = LedgerCache(client)
+    cache.subscribed = frozenset(['a'])
+    cache.on_event('height', {'index': 5})
+    assert cache.balance('a') == 100 and cache.balance('a') == 100 and client.calls == 1
+    cache.on_event('block', {'index': 6})
+    cache.on_event('balance', {'block': 6, 'account': 'a', 'delta': -10})
+    assert cache.balance('a') == 90 and client.calls == 1
+    cache.balance('b')
+    cache.on_event('block', {'index': 7})
+    client.height = 7
+    cache.balance('b')
+    assert client.calls == 3
+
+    # Fetched at a height whose events have not arrived yet: the delta must not be applied twice
+    client.height = 8
+    cache.balances.pop('a')
+    cache.balance('a')
+    cache.on_event('block', {'index': 8})
+    cache.on_event('balance', {'block': 8, 'account': 'a', 'delta': -10})
+    assert cache.balance('a') == 100, cache.balances
+
+    worker = Worker()
+    results = []
+    worker.submit(lambda: 42, results.append)
+    worker.submit(lambda: 1 / 0, results.append, on_error=lambda e: results.append(type(e).__name__))
+    worker.submit(lambda: None, lambda value: 1 / 0)
+    worker.submit(lambda: 43, results.append)
+    worker.executor.shutdown(wait=True)
+    worker.poll()
+    print(sorted(results, key=str))
+
+
+if __name__ == '__main__':
+    test()
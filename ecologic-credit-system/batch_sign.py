@@ -0,0 +1,163 @@
+"""
+Offline batch signing of transactions, e.g. the credits granted to every company for a period.
+
+The rows are read from a CSV file (header: dest,value,message and optionally date) or a JSONL file (one object with the
+same keys per line). They are signed by a pool of processes with one key of the keystore: each process builds a Signer
+once, so the verifying key is exported and hashed once per process instead of once per transaction.
+
+The output is a json file {'transactions': [...]}, the body expected by /transactions/batch. It can be posted as is, or
+submitted with the client (NodeClient.submit_batch(load_batch(path))).
+
+No file is written if a row is invalid (value not like "+10", destination not a hash): the invalid rows are listed.
+
+Usage:
+    python batch_sign.py grants.csv batch.json --key admin
+    python batch_sign.py grants.jsonl batch.json --key admin --workers 8 --submit http://127.0.0.1:5000
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from getpass import getpass
+from multiprocessing import Pool
+from ecdsa import SigningKey
+import config
+import signatures
+from keystore import open_keystore
+from transaction import Signer, Transaction, InvalidValue, InvalidDestination
+
+_signer = None  # Signer of the worker process
+
+
+def read_rows(path):
+    """
+    :param path: a .csv or .jsonl file
+    :return: a list of dict with the keys dest, value, message and optionally date
+    """
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _init_worker(pem):
+    global _signer
+    _signer = Signer(SigningKey.from_pem(pem))
+
+
+def sign_rows(rows):
+    """
+    Sign rows in a worker process
+    :param rows: list of (row number, row)
+    :return: list of (row number, payload or None, error or None)
+    """
+    results = []
+    for number, row in rows:
+        try:
+            t = _signer.transaction(row['message'], row['value'], row.get('dest') or None, row.get('date') or None)
+        except KeyError as e:
+            results.append((number, None, f"missing {e.args[0]}"))
+        except InvalidValue:
+            results.append((number, None, f"invalid value {row['value']!r}"))
+        except InvalidDestination:
+            results.append((number, None, f"invalid destination {row['dest']!r}"))
+        else:
+            results.append((number, dict(t.data, signature=t.signature), None))
+    return results
+
+
+def sign_batch(rows, sk, workers=None, chunk=config.batch_sign_chunk):
+    """
+    Sign rows with a pool of processes
+    :param rows: list of dict (see read_rows)
+    :param sk: the signing key
+    :param workers: number of processes (None: one per CPU)
+    :param chunk: number of rows sent to a process at once
+    :return: (list of payloads in the order of the rows, list of (row number, error))
+    """
+    numbered = list(enumerate(rows, 1))
+    chunks = [numbered[i:i + chunk] for i in range(0, len(numbered), chunk)]
+    payloads, errors = [], []
+    with Pool(workers, initializer=_init_worker, initargs=(signatures.to_pem(sk),)) as pool:
+        for results in pool.imap(sign_rows, chunks):
+            for number, payload, error in results:
+                if error is None:
+                    payloads.append(payload)
+                else:
+                    errors.append((number, error))
+    return payloads, errors
+
+
+def write_batch(path, payloads):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'transactions': payloads}, f)
+    os.replace(tmp, path)
+
+
+def load_batch(path):
+    """
+    :param path: a file written by batch_sign
+    :return: the list of signed transactions
+    """
+    with open(path) as f:
+        payloads = json.load(f)['transactions']
+    return [Transaction(p['message'], p['value'], p['dest'], p['date'], p['signature'], p['vk']) for p in payloads]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sign a batch of transactions offline")
+    parser.add_argument('input', help="csv or jsonl file with the columns dest, value, message (and date)")
+    parser.add_argument('output', help="json file for /transactions/batch")
+    parser.add_argument('--key', default=config.wallet_key_name, help="name of the key in the keystore")
+    parser.add_argument('--keystore', default=config.keystore_path)
+    parser.add_argument('--workers', type=int, help="number of processes (default: one per CPU)")
+    parser.add_argument('--submit', metavar='URL', help="submit the batch to the node at this url")
+    args = parser.parse_args()
+
+    sk = open_keystore(getpass("Keystore password: "), args.keystore).get_key(args.key)
+    rows = read_rows(args.input)
+
+    start = time.time()
+    payloads, errors = sign_batch(rows, sk, args.workers)
+    if errors:
+        for number, error in errors:
+            print(f"Row {number}: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    write_batch(args.output, payloads)
+    print(f"{len(payloads)} transactions signed in {time.time() - start:.2f} s")
+
+    if args.submit:
+        from client import NodeClient
+        with NodeClient(args.submit) as client:
+            results = client.submit_batch(load_batch(args.output))
+        rejected = [(i, r['reason']) for i, r in enumerate(results, 1) if not r['accepted']]
+        for number, reason in rejected:
+            print(f"Transaction {number} rejected: {reason}", file=sys.stderr)
+        print(f"{len(results) - len(rejected)} / {len(results)} transactions accepted")
+
+
+def test():
+    import tempfile
+    from benchmark import make_keys
+    import utils
+    accounts = [utils.hash_str(sk) for sk in make_keys(5000)]
+    rows = [{'dest': dest, 'value': '+100', 'message': "Grant 2024-Q3"} for dest in accounts]
+    rows.append({'dest': 'nobody', 'value': '+100', 'message': "Invalid"})
+
+    start = time.time()
+    payloads, errors = sign_batch(rows, config.sk_restored)
+    print(f"{len(payloads)} transactions signed in {time.time() - start:.2f} s, errors: {errors}")
+
+    path = os.path.join(tempfile.mkdtemp(), 'batch.json')
+    write_batch(path, payloads)
+    transactions = load_batch(path)
+    assert all(t.verify() for t in transactions[:10])
+
+
+if __name__ == '__main__':
+    main()
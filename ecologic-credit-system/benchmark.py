@@ -0,0 +1,314 @@
+"""
+Benchmark suite for the core operations of the ledger.
+
+The fixtures are generated locally and deterministically from a seed: signing keys are derived from fixed secret
+exponents and the synthetic chains always contain the same transactions. The transactions of the synthetic chains
+carry a dummy signature (signing a million transactions would dominate the run), which is fine for the operations that
+do not verify signatures. The signature benchmarks (sign, verify, add_transaction) use really signed transactions.
+
+Each benchmark is run with timeit: the number of calls per round is calibrated with autorange, and the median and
+minimum time per call over several rounds are reported. Results can be saved to a json file and compared with a
+previous run to detect regressions.
+
+Usage:
+    python benchmark.py                                  # 1k, 100k and 1M transactions
+    python benchmark.py --sizes 1000 --output base.json
+    python benchmark.py --sizes 1000 --compare base.json --threshold 0.2
+"""
+
+import argparse
+import hashlib
+import json
+import platform
+import random
+import statistics
+import sys
+import timeit
+from ecdsa import SigningKey
+from rich.console import Console
+from rich.table import Table
+import config
+import utils
+from blockchain import Blockchain
+from transaction import Transaction
+
+try:
+    from audit import Columns  # needs NumPy, only used by the audit_balances benchmark
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
+default_sizes = [1000, 100000, 1000000]
+dummy_signature = "00" * 48
+start_date = "2024-01-01 00:00:00.000000"
+
+
+def make_keys(n, seed=0):
+    """
+    Deterministic signing keys
+    :param n: number of keys
+    :param seed: int
+    :return: a list of SigningKey
+    """
+    return [SigningKey.from_secret_exponent(1 + seed * 1000003 + i) for i in range(n)]
+
+
+class Fixture(object):
+    def __init__(self, size, seed=0):
+        """
+        A synthetic chain of size transactions, in full blocks of config.blocksize transactions, between
+        min(1000, max(10, size // 100)) accounts. The first transactions are admin grants to every account, then
+        transfers between accounts (80%), burns (10%) and admin grants (10%).
+        :param size: number of transactions in the chain
+        :param seed: int
+        """
+        self.size = size
+        self.rng = random.Random(seed)
+        nb_accounts = min(1000, max(10, size // 100))
+
+        self.keys = make_keys(nb_accounts, seed)
+        self.vks = [sk.verifying_key.to_pem().hex() for sk in self.keys]
+        self.accounts = [hashlib.sha256(vk.encode()).hexdigest() for vk in self.vks]
+        self.sk_admin = config.sk_restored
+        self.admin_vk = self.sk_admin.verifying_key.to_pem().hex()
+
+        self.blockchain = Blockchain()
+        date = utils.str_to_us(start_date)
+        transactions = []
+        for i in range(size):
+            date += 1000
+            if i < nb_accounts:
+                vk, value, dest = self.admin_vk, '+100000', self.accounts[i]
+            else:
+                kind = self.rng.random()
+                if kind < 0.8:
+                    vk, dest = self.rng.choice(self.vks), self.rng.choice(self.accounts)
+                    value = f"+{self.rng.randint(1, 10)}"
+                elif kind < 0.9:
+                    vk, value, dest = self.rng.choice(self.vks), f"-{self.rng.randint(1, 5)}", None
+                else:
+                    vk, value, dest = self.admin_vk, f"+{self.rng.randint(1, 100)}", self.rng.choice(self.accounts)
+            transactions.append(Transaction(f"Transaction {i}", value, dest, utils.us_to_str(date),
+                                            dummy_signature, vk))
+
+            if len(transactions) == config.blocksize:
+                self.extend(transactions)
+                transactions = []
+        if transactions:
+            self.extend(transactions)
+
+    def extend(self, transactions):
+        self.blockchain.extend_chain(self.blockchain.last_block.next(transactions))
+
+    def signed_transfers(self, n):
+        """
+        Really signed transfers between funded accounts, dated now
+        :param n: number of transactions
+        :return: a list of transactions
+        """
+        transactions = []
+        for i in range(n):
+            k, dest = self.rng.sample(range(len(self.keys)), 2)
+            t = Transaction(f"Signed transfer {i}", '+1', self.accounts[dest])
+            t.sign(self.keys[k])
+            transactions.append(t)
+        return transactions
+
+    def clone(self):
+        """
+        A blockchain sharing the blocks of the fixture, so that the fixture chain is not modified.
+        The time index of the clone only covers the blocks added to it.
+        """
+        blockchain = Blockchain()
+        blockchain.chain = self.blockchain.chain[:]
+        return blockchain
+
+
+def cycle(items):
+    while True:
+        for item in items:
+            yield item
+
+
+def transaction_benchmarks(fixture):
+    """
+    Benchmarks of a single transaction (independent of the size of the chain)
+    :return: a list of (name, callable)
+    """
+    sk = fixture.keys[0]
+    unsigned = cycle([Transaction(f"Unsigned {i}", '-1') for i in range(100)])
+    signed = cycle(fixture.signed_transfers(100))
+    return [
+        ('Transaction.sign', lambda: next(unsigned).sign(sk)),
+        ('Transaction.verify', lambda: next(signed).verify()),
+        ('Transaction.hash', lambda: next(signed).hash()),
+    ]
+
+
+def ledger_benchmarks(fixture):
+    """
+    Benchmarks of the ledger operations on the chain of the fixture
+    :return: a list of (name, callable)
+    """
+    blockchain = fixture.blockchain
+    pending = fixture.signed_transfers(64)
+    to_admit = cycle(pending)
+    accounts = cycle(fixture.rng.sample(fixture.accounts, len(fixture.accounts)))
+
+    def add_transaction():
+        transaction = next(to_admit)
+        if blockchain.add_transaction(transaction):
+            blockchain.remove_from_mempool(transaction)
+
+    def new_block():
+        for transaction in pending:
+            blockchain.add_to_mempool(transaction)
+        blockchain.new_block()
+        blockchain.remove_many_from_mempool(blockchain.mempool[:])
+
+    extended = fixture.clone()
+    block_transactions = pending[:config.blocksize]
+
+    def extend_chain():
+        extended.extend_chain(extended.last_block.next(block_transactions))
+        # The same transactions are added again by the next call: forget them (the clone only indexes its new blocks)
+        extended.locations.clear()
+
+    longer = fixture.clone()
+    longer.chain.append(longer.last_block.next(block_transactions))
+
+    def merge():
+        Blockchain().merge(longer)
+
+    benchmarks = [
+        ('add_transaction', add_transaction),
+        ('new_block', new_block),
+        ('get_balance', lambda: blockchain.get_balance(next(accounts))),
+        ('get_balances', blockchain.get_balances),
+        ('get_transaction_history', lambda: blockchain.get_transaction_history(next(accounts))),
+        ('validity', blockchain.validity),
+        ('extend_chain', extend_chain),
+        ('merge', merge),
+    ]
+    if has_numpy:
+        benchmarks.insert(4, ('audit_balances', Columns(blockchain.chain).balances))
+    return benchmarks
+
+
+def measure(function, repeat):
+    """
+    :param function: a callable without parameters
+    :param repeat: number of rounds
+    :return: dict with the median and minimum time per call (seconds) and the number of calls per round
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {'median': statistics.median(times), 'min': min(times), 'number': number}
+
+
+def run(sizes, repeat=5, seed=0):
+    """
+    Run the benchmarks
+    :param sizes: list of chain sizes (number of transactions)
+    :param repeat: number of rounds per benchmark
+    :param seed: int
+    :return: dict {benchmark name: {size: measures}}, size is "-" for the transaction benchmarks
+    """
+    console = Console()
+    results = {}
+    random.seed(seed)  # new_block samples the mempool with the random module
+
+    for size in sizes:
+        with console.status(f"Building a chain of {size} transactions"):
+            fixture = Fixture(size, seed)
+
+        benchmarks = ledger_benchmarks(fixture)
+        if size == sizes[0]:
+            benchmarks = transaction_benchmarks(fixture) + benchmarks
+
+        for name, function in benchmarks:
+            with console.status(f"{name} ({size})"):
+                key = '-' if name.startswith('Transaction.') else str(size)
+                results.setdefault(name, {})[key] = measure(function, repeat)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the results with a previous run
+    :param results: dict returned by run
+    :param baseline: dict returned by run
+    :param threshold: relative slowdown of the median above which a benchmark is a regression
+    :return: a list of (name, size, ratio) for the regressions
+    """
+    regressions = []
+    for name, by_size in results.items():
+        for size, measures in by_size.items():
+            previous = baseline.get(name, {}).get(size)
+            if previous:
+                ratio = measures['median'] / previous['median']
+                if ratio > 1 + threshold:
+                    regressions.append((name, size, ratio))
+    return regressions
+
+
+def log(results, baseline=None):
+    """
+    Print a nice table of the results
+    """
+    table = Table(title="Benchmarks (time per call)")
+    table.add_column("Benchmark", justify="left", style="cyan")
+    table.add_column("Size", justify="right", style="magenta")
+    table.add_column("Median", justify="right", style="green")
+    table.add_column("Min", justify="right", style="green")
+    if baseline:
+        table.add_column("vs baseline", justify="right")
+
+    for name, by_size in results.items():
+        for size, measures in by_size.items():
+            row = [name, size, f"{measures['median'] * 1e6:.1f} µs", f"{measures['min'] * 1e6:.1f} µs"]
+            if baseline:
+                previous = baseline.get(name, {}).get(size)
+                row.append(f"x{measures['median'] / previous['median']:.2f}" if previous else "")
+            table.add_row(*row)
+
+    Console().print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the core ledger operations")
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes,
+                        help="number of transactions in the synthetic chains")
+    parser.add_argument('--repeat', type=int, default=5, help="number of rounds per benchmark")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="save the results in this json file")
+    parser.add_argument('--compare', help="json file of a previous run")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative slowdown considered as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat, args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    log(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version, 'platform': platform.platform(), 'seed': args.seed,
+                       'results': results}, f, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for name, size, ratio in regressions:
+            print(f"REGRESSION: {name} ({size}) is {ratio:.2f} times slower")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
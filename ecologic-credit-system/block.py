@@ -2,8 +2,12 @@
 This module contains the class Block. A block is a list of transactions. The first block is called the genesis block.
 """
 
+import atexit
 import hashlib
 import json
+import multiprocessing
+import os
+import threading
 import config
 import utils
 from rich.console import Console
@@ -14,6 +18,31 @@ class InvalidBlock(Exception):
     pass
 
 
+_pool = None  # (number of workers, multiprocessing.Pool): created by the first mining, then reused
+_pool_lock = threading.Lock()
+
+
+def mining_pool(workers):
+    """
+    The pool of processes of Block.mine, started once (or again if the number of workers changes)
+    :param workers: number of processes
+    :return: multiprocessing.Pool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool[0] != workers:
+            if _pool is not None:
+                _pool[1].terminate()
+            _pool = (workers, multiprocessing.Pool(workers))
+        return _pool[1]
+
+
+@atexit.register
+def _close_pool():
+    if _pool is not None:
+        _pool[1].terminate()
+
+
 class Block(object):
     def __init__(self, data=None):
         """
@@ -26,6 +55,7 @@ class Block(object):
                 self.timestamp = data['timestamp']
                 self.transactions = data['transactions']
                 self.previous_hash = data['previous_hash']
+                self.proof = data.get('proof')
 
             except:
                 raise InvalidBlock()
@@ -35,6 +65,17 @@ class Block(object):
             self.timestamp = "2023-11-24 00:00:00.000000"
             self.transactions = []
             self.previous_hash = "0" * 64
+            self.proof = None
+
+    @property
+    def timestamp_us(self):
+        """
+        The timestamp of the block in microseconds since the epoch (see utils.str_to_us)
+        :return: int
+        """
+        if getattr(self, '_timestamp', None) is None or self._timestamp[0] is not self.timestamp:
+            self._timestamp = (self.timestamp, utils.str_to_us(self.timestamp))
+        return self._timestamp[1]
 
     def next(self, transactions):
         """
@@ -49,6 +90,13 @@ class Block(object):
         
         return Block(d)
     
+    @property
+    def size(self):
+        """
+        Number of transactions
+        """
+        return len(self.transactions)
+
     @property
     def data(self):
         d = {'index': self.index,
@@ -69,11 +117,16 @@ class Block(object):
         """
         Hash the current block (SHA256). The dictionary representing the block is sorted to ensure the same hash for
         two identical block. The transactions are part of the block and are not sorted.
+
+        If the block has been mined, the hash is the SHA256 of the header followed by the proof (8 bytes, big endian).
         :return: a string representing the hash of the block
         """
-        s = self.json_dumps().encode()
-        return hashlib.sha256(s).hexdigest()
-        
+        if self.proof is None:
+            s = self.json_dumps().encode()
+            return hashlib.sha256(s).hexdigest()
+        else:
+            return hashlib.sha256(self.header() + self.proof.to_bytes(8, 'big')).hexdigest()
+
 
     def __str__(self):
         """
@@ -86,36 +139,68 @@ class Block(object):
 index:                  {self.index}
 hash:                   {str_hash}
 timestamp:              {self.timestamp}
-nb of transactions:     {len(self.transactions)}"""
+nb of transactions:     {self.size}"""
     
         return string
 
-    # def valid_proof(self, difficulty=config.default_difficulty):
-    #     """
-    #     Check if the proof of work is valid. The proof of work is valid if the hash of the block starts with a number
-    #     of 0 equal to difficulty.
-
-    #     If index is 0, the proof of work is valid.
-    #     :param difficulty: the number of 0 the hash must start with
-    #     :return: True or False
-    #     """
-    #     if difficulty == 0:
-    #         return True
-    #     else:
-    #         str_hash = self.hash()
-    #         return str_hash[:difficulty] == '0' * difficulty
-
-    # def mine(self, difficulty=config.default_difficulty):
-    #     """
-    #     Mine the current block. The block is valid if the hash of the block starts with a number of 0 equal to
-    #     config.default_difficulty.
-    #     :return: the proof of work
-    #     """
-    #     proof = 0
-    #     while not self.valid_proof(difficulty):
-    #         proof += 1
-    #         self.proof = proof
-    #     return self.proof
+    def header(self):
+        """
+        Fixed-size header of the block used for the proof of work: the SHA256 digest of the sorted json
+        representation of the block (without the proof). It is computed once per mining, each attempt then only hashes
+        the header followed by the nonce.
+        :return: 32 bytes
+        """
+        return hashlib.sha256(self.json_dumps().encode()).digest()
+
+    def valid_proof(self, difficulty=config.default_difficulty):
+        """
+        Check if the proof of work is valid. The proof of work is valid if the hash of the block starts with a number
+        of 0 equal to difficulty.
+
+        If difficulty is 0, the proof of work is valid.
+        :param difficulty: the number of 0 the hash must start with
+        :return: True or False
+        """
+        if difficulty == 0:
+            return True
+        elif self.proof is None:
+            return False
+        else:
+            str_hash = self.hash()
+            return str_hash[:difficulty] == '0' * difficulty
+
+    def mine(self, difficulty=config.default_difficulty, workers=config.mining_workers):
+        """
+        Mine the current block. The block is valid if the hash of the block starts with a number of 0 equal to
+        difficulty. The nonce search is split across worker processes (see mining_pool, the pool is reused from block
+        to block), by chunks of config.mining_chunk nonces. When a chunk is expected to hold a valid nonce
+        (16 ** difficulty <= config.mining_chunk), the block is mined in the current process: the workers would cost
+        more than they save.
+        :param difficulty: the number of 0 the hash must start with
+        :param workers: the number of processes (None for the number of CPUs, 1 to mine in the current process)
+        :return: the proof of work
+        """
+        header = self.header()
+        workers = workers or os.cpu_count() or 1
+        chunk = config.mining_chunk
+
+        start = 0
+        if workers == 1 or 16 ** difficulty <= chunk:
+            proof = None
+            while proof is None:
+                proof = _search_nonce((header, difficulty, start, start + chunk))
+                start += chunk
+        else:
+            pool = mining_pool(workers)
+            proof = None
+            while proof is None:
+                ranges = [(header, difficulty, start + i * chunk, start + (i + 1) * chunk) for i in range(workers)]
+                start += workers * chunk
+                # The ranges are in order, so the smallest valid nonce of the round is kept
+                proof = next((p for p in pool.map(_search_nonce, ranges) if p is not None), None)
+
+        self.proof = proof
+        return self.proof
 
     def validity(self):
         """
@@ -128,14 +213,14 @@ nb of transactions:     {len(self.transactions)}"""
         if self.index == 0:
             return True
         else:
-            # if not self.valid_proof():
-            #     return False
-            
+            if config.proof_of_work and not self.valid_proof():
+                return False
+
             for transaction in self.transactions:
                 if not transaction.verify:
                     return False
                 
-            if not config.blocksize <= len(self.transactions) <= config.blocksize:
+            if not 0 <= len(self.transactions) <= config.blocksize:
                 return False
             
         return True
@@ -158,6 +243,46 @@ nb of transactions:     {len(self.transactions)}"""
         console.print(table)
 
 
+class BlockHeader(Block):
+    def __init__(self, block):
+        """
+        The header of a block whose transactions were moved to the archive (see Blockchain.prune): the index, the
+        timestamp, the previous hash and the proof, with the hash and the number of transactions of the full block. The
+        links of the chain can still be checked.
+        :param block: the full block
+        """
+        super().__init__({'index': block.index, 'timestamp': block.timestamp, 'transactions': [],
+                          'previous_hash': block.previous_hash, 'proof': block.proof})
+        self._hash = block.hash()
+        self._size = len(block.transactions)
+
+    @property
+    def size(self):
+        return self._size
+
+    def hash(self):
+        return self._hash
+
+
+def _search_nonce(args):
+    """
+    Search a nonce in [start, stop[ such that SHA256(header + nonce) starts with difficulty hexadecimal 0.
+    Module level function so it can be sent to worker processes.
+    :param args: tuple (header, difficulty, start, stop)
+    :return: the first valid nonce, or None
+    """
+    header, difficulty, start, stop = args
+    # The hash starts with difficulty hexadecimal 0 iff it is lower than 16 ** (64 - difficulty)
+    target = 1 << (4 * (64 - difficulty))
+    midstate = hashlib.sha256(header)
+    for nonce in range(start, stop):
+        h = midstate.copy()
+        h.update(nonce.to_bytes(8, 'big'))
+        if int.from_bytes(h.digest(), 'big') < target:
+            return nonce
+    return None
+
+
 def test():
     from ecdsa import SigningKey
     from transaction import Transaction
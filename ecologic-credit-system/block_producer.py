@@ -0,0 +1,288 @@
+"""
+This module contains the class BlockProducer. The block producer runs in a background thread of the node and seals a
+new block as soon as the mempool holds config.blocksize transactions, or when the oldest pending transaction has
+waited config.max_block_latency seconds, whichever comes first.
+
+The producer also measures the time-to-inclusion of each transaction, i.e. the time between its admission in the
+mempool and the moment the block containing it is added to the chain.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+import config
+import utils
+from block import InvalidBlock
+
+logger = logging.getLogger(__name__)
+
+
+class BlockProducer(object):
+    def __init__(self, blockchain, lock=None, max_latency=config.max_block_latency):
+        """
+        :param blockchain: the blockchain to extend
+        :param lock: the lock protecting the blockchain (shared with the request handlers)
+        :param max_latency: maximum number of seconds a transaction waits before a block is sealed
+        """
+        self.blockchain = blockchain
+        self.lock = lock if lock is not None else threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        self.seal_lock = threading.Lock()  # Only one block is built at a time
+        self.max_latency = max_latency
+
+        self.pending = OrderedDict()  # transaction hash -> admission time (monotonic)
+        self.unnotified_since = None  # time at which the producer found transactions admitted without notify
+        self.samples = deque(maxlen=config.producer_samples)  # recent time-to-inclusion values
+        self.blocks_sealed = 0
+        self.included = 0
+        self.total_latency = 0.0
+        self.max_inclusion = 0.0
+
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def notify(self, transaction):
+        """
+        Record the admission of a transaction in the mempool and wake up the producer.
+        Must be called just after a successful Blockchain.add_transaction.
+        :param transaction: the admitted transaction
+        """
+        with self.condition:
+            self.pending[transaction.hash()] = time.monotonic()
+            self.condition.notify()
+
+    def _forget_stale(self, oldest_only=False):
+        """
+        Forget the pending transactions which left the mempool without being sealed (expired, evicted, included in the
+        chain of a merge). Must be called with the lock held.
+        :param oldest_only: stop at the oldest transaction still in the mempool
+        """
+        in_mempool = self.blockchain.pending  # transaction hash -> count, maintained by the blockchain
+        if oldest_only:
+            while self.pending and next(iter(self.pending)) not in in_mempool:
+                self.pending.popitem(last=False)
+            return
+        for h in [h for h in self.pending if h not in in_mempool]:
+            del self.pending[h]
+
+    def _timeout(self):
+        """
+        Number of seconds before the max-latency timer fires, or None if there is nothing to wait for.
+        """
+        self._forget_stale(oldest_only=True)
+        if self.pending:
+            oldest = next(iter(self.pending.values()))
+            return oldest + self.max_latency - time.monotonic()
+        if len(self.blockchain.mempool) > 0:
+            # Transactions that did not go through notify (e.g. after a merge): the deadline is set once, not pushed
+            # back at each pass of the wait loop
+            if self.unnotified_since is None:
+                self.unnotified_since = time.monotonic()
+            return self.unnotified_since + self.max_latency - time.monotonic()
+        self.unnotified_since = None
+        return None
+
+    def seal(self):
+        """
+        Build a block from the mempool and add it to the chain. If config.proof_of_work is set, the block is mined
+        without holding the blockchain lock.
+        :raise InvalidBlock if the block cannot extend the chain
+        :return: the new block, or None if the mempool is empty
+        """
+        with self.seal_lock:
+            with self.lock:
+                if len(self.blockchain.mempool) == 0:
+                    return None
+                block = self.blockchain.new_block()
+                # Until the block is added, its transactions are neither in the mempool nor in the chain
+                self.blockchain.start_sealing(block.transactions)
+
+            try:
+                if config.proof_of_work:
+                    block.mine()
+            except BaseException:
+                with self.lock:
+                    self.blockchain.stop_sealing(block.transactions)
+                    for transaction in block.transactions:
+                        self.blockchain.add_to_mempool(transaction)
+                raise
+
+            with self.lock:
+                self.blockchain.stop_sealing(block.transactions)
+                try:
+                    self.blockchain.extend_chain(block)
+                except InvalidBlock:
+                    # The chain has changed meanwhile (e.g. merge): give the transactions which are not in the new chain
+                    # back to the mempool
+                    for transaction in block.transactions:
+                        if not self.blockchain.confirmed(transaction.hash()):
+                            self.blockchain.add_to_mempool(transaction)
+                    raise
+
+                now = time.monotonic()
+                self.blocks_sealed += 1
+                self.unnotified_since = None
+                for transaction in block.transactions:
+                    admitted = self.pending.pop(transaction.hash(), None)
+                    if admitted is None:
+                        continue
+                    latency = now - admitted
+                    self.included += 1
+                    self.total_latency += latency
+                    self.max_inclusion = max(self.max_inclusion, latency)
+                    self.samples.append(latency)
+
+            return block
+
+    def run(self):
+        """
+        Main loop of the producer: wait until a block is due, then seal it.
+        """
+        while not self._stopped.is_set():
+            with self.condition:
+                while not self._stopped.is_set():
+                    if len(self.blockchain.mempool) >= config.blocksize:
+                        break
+                    timeout = self._timeout()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    # Without a deadline, check the mempool again after max_latency: transactions can be added without
+                    # notify (e.g. after a merge)
+                    self.condition.wait(timeout if timeout is not None else self.max_latency)
+
+            if self._stopped.is_set():
+                return
+
+            try:
+                if self.seal() is None:
+                    # Nothing to seal: the pending transactions left the mempool meanwhile
+                    with self.lock:
+                        self._forget_stale()
+            except Exception:
+                logger.exception("Block production failed")
+                # Forget the transactions which are no longer in the mempool to avoid a busy loop
+                with self.lock:
+                    self._forget_stale()
+                self._stopped.wait(self.max_latency)
+
+    def start(self):
+        """
+        Start the producer in a daemon thread.
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self.run, name="block-producer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the producer and wait for its thread to finish.
+        """
+        self._stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """
+        Metrics on block production and time-to-inclusion (in seconds).
+        :return: dict
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+            stats = {
+                'running': self._thread is not None,
+                'blocks_sealed': self.blocks_sealed,
+                'included': self.included,
+                'pending': len(self.pending),
+                'mempool_size': len(self.blockchain.mempool),
+                'mean_inclusion': self.total_latency / self.included if self.included else None,
+                'max_inclusion': self.max_inclusion,
+                'p50_inclusion': None,
+                'p99_inclusion': None,
+            }
+            if samples:
+                stats['p50_inclusion'] = utils.percentile(samples, 50)
+                stats['p99_inclusion'] = utils.percentile(samples, 99)
+            return stats
+
+
+def test():
+    from ecdsa import SigningKey
+    from blockchain import Blockchain
+    from transaction import Transaction
+
+    blockchain = Blockchain()
+    producer = BlockProducer(blockchain, max_latency=0.5)
+    producer.start()
+
+    sk_admin = config.sk_restored
+    for i in range(config.blocksize + 1):
+        t = Transaction(f"Admin grant {i}", '+10', utils.hash_str(SigningKey.generate()))
+        t.sign(sk_admin)
+        with producer.lock:
+            if blockchain.add_transaction(t):
+                producer.notify(t)
+
+    time.sleep(1)
+    producer.stop()
+    print(blockchain)
+    print(producer.stats())
+
+
+def test_mining_race():
+    """
+    While a block is mined, a replay of one of its transactions and a double spend are rejected
+    """
+    from ecdsa import SigningKey
+    from block import Block
+    from blockchain import Blockchain
+    from transaction import Transaction
+
+    blockchain = Blockchain()
+    producer = BlockProducer(blockchain)
+    sk = SigningKey.generate()
+    author, dest = utils.hash_str(sk), utils.hash_str(SigningKey.generate())
+
+    grant = Transaction("Admin grant", '+100', author)
+    grant.sign(config.sk_restored)
+    assert blockchain.add_transaction(grant)
+    producer.seal()
+
+    spend = Transaction("Spend", '+90', dest)
+    spend.sign(sk)
+    assert blockchain.add_transaction(spend)
+    double_spend = Transaction("Double spend", '+90', dest)
+    double_spend.sign(sk)
+
+    reasons = []
+    mine = Block.mine
+
+    def mine_with_submissions(block, *args, **kwargs):
+        # Submitted by request handlers while the producer mines without the lock
+        with producer.lock:
+            reasons.append(blockchain.admit(spend))
+            reasons.append(blockchain.admit(double_spend))
+        return mine(block, *args, **kwargs)
+
+    proof_of_work = config.proof_of_work
+    config.proof_of_work, Block.mine = True, mine_with_submissions
+    try:
+        block = producer.seal()
+    finally:
+        config.proof_of_work, Block.mine = proof_of_work, mine
+
+    assert reasons == ['duplicate', 'insufficient balance'], reasons
+    assert [t.hash() for t in block.transactions] == [spend.hash()]
+    assert blockchain.get_balance(author) == 10 and not blockchain.sealing and not blockchain.sealing_spent
+    assert blockchain.admit(spend) == 'duplicate'
+    print("Replay and double spend during mining rejected:", reasons)
+
+
+if __name__ == '__main__':
+    print("Test BlockProducer")
+    test()
+    test_mining_race()
@@ -2,36 +2,183 @@
 This module contains the class Blockchain. A blockchain is a list of blocks and a mempool.
 """
 import json
+import logging
 import random
+import time
+from collections import Counter, OrderedDict, defaultdict
 import config
 import utils
-from block import Block, InvalidBlock
+from archive import ArchivedHashes
+from block import Block, BlockHeader, InvalidBlock
 from transaction import Transaction
+from time_index import TimeIndex
+import metrics
+import profiling
 
 import re
 
+logger = logging.getLogger(__name__)
+
+val_pattern = re.compile(r"^[-+][0-9]+$")
+dest_pattern = re.compile(r"^[0-9a-fA-F]{64}$")
+
+signature_verifications = metrics.Histogram('ecs_signature_verify_seconds', "Time to verify a transaction signature")
+balance_lookups = metrics.Histogram('ecs_balance_lookup_seconds', "Time to compute the balance of an account")
+admissions = metrics.Counter('ecs_admissions_total', "Transactions submitted to the mempool, by outcome",
+                             ['outcome'])
+block_builds = metrics.Histogram('ecs_block_build_seconds', "Time to build a block from the mempool")
+block_extensions = metrics.Histogram('ecs_block_extend_seconds', "Time to add a block to the chain")
+mempool_evictions = metrics.Counter('ecs_mempool_evictions_total', "Transactions removed from the mempool before being "
+                                    "included in a block, by reason", ['reason'])
+
+
+def mempool_size(transaction):
+    """
+    :return: the approximate memory used by a transaction of the mempool (bytes), for config.mempool_max_bytes
+    """
+    return len(transaction.json_dumps()) + len(transaction.signature or '')
+
+
 class Blockchain(object):
+    # Rejections which do not depend on the state of the chain: they are kept in the reject cache
+    permanent_rejections = {'incomplete', 'invalid value', 'invalid destination', 'invalid date', 'expired',
+                            'self credit', 'negative transfer', 'invalid signature'}
+
     def __init__(self):
         self.chain = [Block()]
         self.mempool = []
+        self.time_index = TimeIndex(self.chain)
+        self.locations = {}  # transaction hash -> (block index, position) of the transactions of the chain
+        self.pending = Counter()  # transaction hash -> number of transactions of the mempool with this hash
+        self.mempool_version = 0  # Incremented at each change of the mempool
+        self.mempool_bytes = 0  # see mempool_size
+        self.pending_by_author = {}  # author -> transactions of the mempool, in the order of admission
+        self.evictions = Counter()  # reason ('capacity' or 'expired') -> number of transactions removed
+        # Transactions of a block being mined (see start_sealing): no longer in the mempool, not yet in the chain
+        self.sealing = Counter()  # transaction hash -> number of transactions in flight with this hash
+        self.sealing_spent = Counter()  # author -> credits spent by the transactions in flight
+        self._index_chain()
+        self.listeners = []
+
+        # Pruning, see enable_pruning
+        self.archive = None
+        self.keep = None
+        self.first_full = 0  # index of the oldest block whose transactions are in memory
+        self.snapshot = {}  # vk_hash -> balance from the transactions of the pruned blocks
+        self.archived = ArchivedHashes()  # hashes of the transactions of the pruned blocks (not in self.locations)
+        self.checkpoint = None  # (index, hash) of the last pruned block
+
+        # Admission pipeline, see check_transaction
+        self.admission_stages = [
+            ('structural', self._check_structure),
+            ('syntax', self._check_syntax),
+            ('policy', self._check_policy),
+            ('quota', self._check_quota),
+            ('balance', self._check_balance),
+            ('signature', self._check_signature),
+        ]
+        self.stage_timings = {name: [0, 0.0] for name, _ in self.admission_stages}  # name -> [calls, total time]
+        self.rejections = Counter()  # reason -> number of rejections
+        self.rejected = OrderedDict()  # (hash, signature) -> reason, bounded by config.reject_cache_size
+        self.rejected_replays = 0
+
+    def add_listener(self, listener):
+        """
+        Register a function called after each change of the blockchain, as listener(event, data):
+            - 'transaction': a transaction was admitted in the mempool, data is the transaction
+            - 'block': a block was added to the chain, data is the block
+            - 'merge': the chain was replaced by a longer one, data is the blockchain
+        Listeners are called synchronously, with the lock of the caller held: they must be quick. Their exceptions are
+        logged and ignored.
+        :param listener: a function
+        """
+        self.listeners.append(listener)
+
+    def _notify(self, event, data):
+        for listener in self.listeners:
+            try:
+                listener(event, data)
+            except Exception:
+                logger.exception("Listener %r failed on %s", listener, event)
 
     @property
     def last_block(self):
         return self.chain[-1]
+
+    def enable_pruning(self, keep, archive):
+        """
+        Keep the transactions of the last keep blocks only in memory. The older blocks are replaced by their headers
+        (see block.BlockHeader) and their transactions are moved to the archive. The balances are then computed from a
+        snapshot of the balances at the last pruned block, and the queries which need the old transactions (histories,
+        date ranges, validity) read the archive.
+        :param keep: number of full blocks kept in memory
+        :param archive: an empty archive.Archive
+        """
+        self.keep = keep
+        self.archive = archive
+        self.prune()
+
+    def prune(self):
+        """
+        Move the transactions of the blocks older than the last self.keep blocks to the archive
+        """
+        if self.archive is None:
+            return
+        pruned = []
+        while self.last_block.index - self.first_full >= self.keep:
+            block = self.chain[self.first_full]
+            self.archive.append(block)
+            for transaction in block.transactions:
+                transaction_hash = transaction.hash()
+                if transaction_hash in self.archived:
+                    # Same rule as get_balance: a transaction is only counted once
+                    continue
+                self.archived.add(transaction_hash)
+                value = int(transaction.value)
+                if transaction.author == transaction.dest:
+                    self.snapshot[transaction.author] = self.snapshot.get(transaction.author, 0) + value
+                else:
+                    self.snapshot[transaction.author] = self.snapshot.get(transaction.author, 0) - value
+                    self.snapshot[transaction.dest] = self.snapshot.get(transaction.dest, 0) + value
+                self.locations.pop(transaction_hash, None)
+            self.chain[self.first_full] = header = BlockHeader(block)
+            self.checkpoint = (header.index, header.hash())
+            self.first_full += 1
+            pruned.append(block)
+
+        if len(pruned) == 1:
+            self.time_index.remove_block(pruned[0])
+        elif pruned:
+            self.time_index = TimeIndex(self.chain)
+        if pruned:
+            logger.info("%d blocks pruned, the transactions of the blocks before #%d are in the archive",
+                        len(pruned), self.first_full)
+
+    def blocks(self):
+        """
+        The blocks of the chain with their transactions: the pruned blocks are read from the archive
+        :return: a generator of blocks
+        """
+        if self.first_full:
+            yield from self.archive.blocks()
+        yield from self.chain[self.first_full:]
     
     def get_balance(self, vk_hash):
         """
         Returns the balance associated to the verifying key hash in parameters.
         A self transaction is considered to be a creation of value
+        The balance from the pruned blocks is in the snapshot (see enable_pruning).
         :param vk_hash:
         :return: Int
         """
-        balance = 0
-        memo = []
+        start = time.perf_counter()
+        balance = self.snapshot.get(vk_hash, 0)
+        memo = set()
         for block in self.chain:
             for transaction in block.transactions:
-                if transaction.hash() not in memo:
-                    memo.append(transaction.hash())
+                transaction_hash = transaction.hash()
+                if transaction_hash not in memo:
+                    memo.add(transaction_hash)
                     if transaction.author == vk_hash:
                         # Transaction sent by vk_hash
                         if transaction.dest == vk_hash:
@@ -43,134 +190,471 @@ class Blockchain(object):
                     elif transaction.dest == vk_hash:
                         # Transaction received by vk_hash
                         balance += int(transaction.value)  # Add the transaction value to the balance
+        balance_lookups.observe(time.perf_counter() - start)
         return balance
 
+    def get_balances(self, vk_hashes=None):
+        """
+        Returns the balances of many accounts, computed in a single pass over the chain (same rules as get_balance).
+        The balances from the pruned blocks are in the snapshot (see enable_pruning).
+        :param vk_hashes: iterable of verifying key hashes, or None for every account appearing in the chain
+        :return: dict vk_hash -> Int
+        """
+        start = time.perf_counter()
+        everyone = vk_hashes is None
+        if everyone:
+            balances = defaultdict(int, self.snapshot)
+        else:
+            balances = {vk_hash: self.snapshot.get(vk_hash, 0) for vk_hash in vk_hashes}
+        memo = set()
+        for block in self.chain:
+            for transaction in block.transactions:
+                transaction_hash = transaction.hash()
+                if transaction_hash in memo:
+                    continue
+                memo.add(transaction_hash)
+                author, dest = transaction.author, transaction.dest
+                if not everyone and author not in balances and dest not in balances:
+                    continue
+                value = int(transaction.value)
+                if author == dest:
+                    # Transaction with itself (creation of funds)
+                    balances[author] += value
+                    continue
+                if everyone or author in balances:
+                    balances[author] -= value
+                if everyone or dest in balances:
+                    balances[dest] += value
+        balance_lookups.observe(time.perf_counter() - start)
+        return dict(balances)
+
     def add_transaction(self, transaction):
         """
         Add a new transaction to the mempool. Return True if the transaction is valid and not already in the mempool.
         *We also assert that the message in the transaction is valid. and that the transaction is possible according to the suer's balance
+        See check_transaction for the admission stages.
         :param transaction:
         :return: True or False
         """
-        #* a list of hash depicting the admin users
-        admin_list = config.admin_list
+        return self.admit(transaction) is None
 
-        if transaction in self.mempool:
-            return False
-        
-        if transaction.message==None or transaction.date==None or transaction.author==None or transaction.vk==None or transaction.signature==None or transaction.dest==None or transaction.value==None:
-            return False
-        
-        if not transaction.verify():
-            return False
-        
-        if utils.str_to_time(transaction.date) > utils.str_to_time(utils.get_time()):
-            return False
-        
-        #* assert that the value and destination are valid
-        val_pattern = r"^[-+][0-9]+$"
-        if not re.match(val_pattern, transaction.value):
-            return False
-            
-        dest_pattern = r"^[0-9a-fA-F]{64}$"
-        if not re.match(dest_pattern, transaction.dest):
-            return False
-        
-        #* 
-        if not transaction.author in admin_list:
-            sender_balance = self.get_balance(transaction.author)
-            #* check that the author has enough credit to give some to another user
-            if sender_balance <= abs(int(transaction.value)):
-                return False
+    def admit(self, transaction):
+        """
+        Same as add_transaction, but return the reason of the rejection
+        :param transaction:
+        :return: None if the transaction was added to the mempool, else the reason of the rejection (str)
+        """
+        reason = self.check_transaction(transaction)
+        if reason is None and any(evicted is transaction for evicted in self.add_to_mempool(transaction)):
+            # The mempool is full of older transactions of authors with fewer pending transactions
+            reason = 'mempool full'
+            self.rejections[reason] += 1
+        admissions.inc(outcome=reason or 'accepted')
+        if reason is not None:
+            logger.debug("Transaction rejected (%s): %s", reason, transaction.message)
+            return reason
+
+        self._notify('transaction', transaction)
+        return None
+
+    def add_to_mempool(self, transaction):
+        """
+        Add a transaction to the mempool without any check (e.g. to give back the transactions of a rejected block).
+        The mempool must only be modified with add_to_mempool, remove_from_mempool and remove_many_from_mempool, which
+        maintain the index used by transaction_status and the sizes used by the limits of the mempool.
+
+        If the mempool is over config.mempool_max_transactions or config.mempool_max_bytes, transactions are evicted:
+        the oldest transaction of the author with the most transactions in the mempool first, so that a flood of
+        submissions from a few authors does not push out the others.
+        :return: the evicted transactions (possibly including transaction)
+        """
+        self.mempool.append(transaction)
+        self.pending[transaction.hash()] += 1
+        self.pending_by_author.setdefault(transaction.author, []).append(transaction)
+        self.mempool_bytes += mempool_size(transaction)
+        self.mempool_version += 1
+
+        evicted = []
+        while self.mempool and (len(self.mempool) > config.mempool_max_transactions
+                                or self.mempool_bytes > config.mempool_max_bytes):
+            author = max(self.pending_by_author, key=lambda author: len(self.pending_by_author[author]))
+            victim = min(self.pending_by_author[author], key=lambda t: t.timestamp_us)
+            self.remove_from_mempool(victim)
+            evicted.append(victim)
+        if evicted:
+            self.evictions['capacity'] += len(evicted)
+            mempool_evictions.inc(len(evicted), reason='capacity')
+            logger.debug("Mempool full: %d transactions evicted", len(evicted))
+        return evicted
+
+    def _forget(self, transaction):
+        """
+        Update the indexes of the mempool after the removal of transaction
+        """
+        h = transaction.hash()
+        self.pending[h] -= 1
+        if self.pending[h] <= 0:
+            del self.pending[h]
+        same_author = self.pending_by_author[transaction.author]
+        del same_author[next(i for i, t in enumerate(same_author) if t is transaction)]
+        if not same_author:
+            del self.pending_by_author[transaction.author]
+        self.mempool_bytes -= mempool_size(transaction)
+
+    def remove_from_mempool(self, transaction):
+        self.mempool.remove(transaction)
+        self._forget(transaction)
+        self.mempool_version += 1
+
+    def remove_many_from_mempool(self, transactions):
+        """
+        Remove transactions of the mempool in a single pass
+        :param transactions: transactions of the mempool
+        """
+        removed = {id(transaction) for transaction in transactions}
+        if not removed:
+            return
+        self.mempool = [transaction for transaction in self.mempool if id(transaction) not in removed]
+        for transaction in transactions:
+            self._forget(transaction)
+        self.mempool_version += 1
+
+    def expire(self):
+        """
+        Remove the transactions dated more than config.mempool_ttl seconds ago from the mempool
+        :return: the number of expired transactions
+        """
+        cutoff = utils.now_us() - int(config.mempool_ttl * 1_000_000)
+        expired = [transaction for transaction in self.mempool if transaction.timestamp_us < cutoff]
+        if expired:
+            self.remove_many_from_mempool(expired)
+            self.evictions['expired'] += len(expired)
+            mempool_evictions.inc(len(expired), reason='expired')
+            logger.info("%d transactions of the mempool expired", len(expired))
+        return len(expired)
+
+    @staticmethod
+    def _spent(transaction):
+        """
+        :return: the credits taken from the balance of the author by a transaction (0 if it adds credits)
+        """
+        value = int(transaction.value)
+        return max(0, -value if transaction.author == transaction.dest else value)
+
+    def start_sealing(self, transactions):
+        """
+        Record the transactions of a block built by new_block and not yet added to the chain (e.g. while it is mined),
+        so that the admission still rejects their replays and counts their spending.
+        :param transactions: the transactions of the block
+        """
+        for transaction in transactions:
+            self.sealing[transaction.hash()] += 1
+            self.sealing_spent[transaction.author] += self._spent(transaction)
+
+    def stop_sealing(self, transactions):
+        """
+        Forget the transactions recorded by start_sealing, once the block is added to the chain or given up
+        """
+        for transaction in transactions:
+            self.sealing[transaction.hash()] -= 1
+            self.sealing_spent[transaction.author] -= self._spent(transaction)
+        self.sealing += Counter()  # Drop the zero counts
+        self.sealing_spent += Counter()
+
+    def mempool_stats(self):
+        """
+        :return: dict with the size of the mempool, its limits, the number of evicted and expired transactions and the
+                 authors with the most pending transactions
+        """
+        authors = sorted(self.pending_by_author.items(), key=lambda item: -len(item[1]))[:10]
+        return {
+            'transactions': len(self.mempool),
+            'bytes': self.mempool_bytes,
+            'max_transactions': config.mempool_max_transactions,
+            'max_bytes': config.mempool_max_bytes,
+            'ttl': config.mempool_ttl,
+            'author_quota': config.mempool_author_quota,
+            'evicted': self.evictions['capacity'],
+            'expired': self.evictions['expired'],
+            'top_authors': {author: len(transactions) for author, transactions in authors},
+        }
+
+    def _index_chain(self):
+        """
+        Rebuild the location index of the transactions of the chain
+        """
+        self.locations = {}
+        for block in self.chain:
+            self._index_block(block)
+
+    def _index_block(self, block, hashes=None):
+        """
+        :param hashes: the hashes of the transactions of the block, if already computed
+        """
+        if hashes is None:
+            hashes = [transaction.hash() for transaction in block.transactions]
+        for position, transaction_hash in enumerate(hashes):
+            self.locations[transaction_hash] = (block.index, position)
+
+    def confirmed(self, transaction_hash):
+        """
+        :return: True if the transaction is in a block of the chain, pruned or not
+        """
+        return transaction_hash in self.locations or transaction_hash in self.archived
+
+    def transaction_status(self, transaction_hash):
+        """
+        Status of a transaction, found with the indexes (no scan of the chain). The transactions of the pruned blocks
+        are not indexed.
+        :param transaction_hash: see Transaction.hash
+        :return: dict with the status ('confirmed' with the block, the position and the number of confirmations, or
+                 'pending' if it is in the mempool), or None if the transaction is unknown
+        """
+        location = self.locations.get(transaction_hash)
+        if location is not None:
+            index, position = location
+            return {'status': 'confirmed', 'block': index, 'position': position,
+                    'confirmations': self.last_block.index - index + 1}
+        if transaction_hash in self.pending:
+            return {'status': 'pending'}
+        return None
+
+    def check_transaction(self, transaction):
+        """
+        Run the admission stages on a transaction, cheapest first: structural, syntax, policy, balance and finally the
+        signature (ECDSA). The first failing stage stops the admission.
+
+        Transactions rejected for a permanent reason (see permanent_rejections) are remembered in a bounded cache so
+        that a replayed transaction is dropped without running the stages again.
+        :param transaction:
+        :return: None if the transaction can be added to the mempool, else the reason of the rejection (str)
+        """
+        try:
+            key = (transaction.hash(), transaction.signature)
+        except TypeError:
+            key = None
+
+        if key is not None and key in self.rejected:
+            self.rejected.move_to_end(key)
+            reason = self.rejected[key]
+            self.rejections[reason] += 1
+            self.rejected_replays += 1
+            return reason
+
+        for name, stage in self.admission_stages:
+            start = time.perf_counter()
+            reason = stage(transaction)
+            elapsed = time.perf_counter() - start
+            timing = self.stage_timings[name]
+            timing[0] += 1
+            timing[1] += elapsed
+            profiling.record(f"admission {name}", elapsed)
+
+            if reason is not None:
+                self.rejections[reason] += 1
+                if key is not None and reason in self.permanent_rejections:
+                    self.rejected[key] = reason
+                    if len(self.rejected) > config.reject_cache_size:
+                        self.rejected.popitem(last=False)
+                return reason
+
+        return None
+
+    def _check_structure(self, transaction):
+        """
+        All the fields are present (and are strings) and the transaction is neither in the mempool, nor in a block being
+        mined, nor in the chain (a replayed transaction would be counted twice).
+        """
+        for field in (transaction.message, transaction.date, transaction.author, transaction.vk,
+                      transaction.signature, transaction.dest, transaction.value):
+            if not isinstance(field, str):
+                return 'incomplete'
+
+        transaction_hash = transaction.hash()
+        if transaction_hash in self.pending or transaction_hash in self.sealing or self.confirmed(transaction_hash):
+            return 'duplicate'
+
+        return None
+
+    def _check_syntax(self, transaction):
+        """
+        The value and the destination are well formed.
+        """
+        if not val_pattern.match(transaction.value):
+            return 'invalid value'
+
+        if not dest_pattern.match(transaction.dest):
+            return 'invalid destination'
+
+        return None
+
+    def _check_policy(self, transaction):
+        """
+        The date is valid, neither in the future nor older than config.mempool_ttl seconds and, unless the author is an
+        admin, the author neither gives himself credit nor takes credit from another user.
+        """
+        try:
+            now = utils.now_us()
+            if transaction.timestamp_us > now:
+                return 'future date'
+            if transaction.timestamp_us < now - int(config.mempool_ttl * 1_000_000):
+                return 'expired'
+        except ValueError:
+            return 'invalid date'
+
+        if transaction.author not in config.admin_list:
             #* prevent the author from giving himself credit
-            if transaction.author == transaction.dest and transaction.value[0]=="+":
-                return False
-            #* prevent teh author from stealing money to another user
-            if transaction.author != transaction.dest and transaction.value[0]=="-":
-                return False
+            if transaction.author == transaction.dest and transaction.value[0] == "+":
+                return 'self credit'
+            #* prevent the author from stealing money to another user
+            if transaction.author != transaction.dest and transaction.value[0] == "-":
+                return 'negative transfer'
 
-        
-        self.mempool.append(transaction)
-        return True
+        return None
+
+    def _check_quota(self, transaction):
+        """
+        Unless the author is an admin, the author has less than config.mempool_author_quota transactions in the mempool.
+        """
+        if (transaction.author not in config.admin_list
+                and len(self.pending_by_author.get(transaction.author, ())) >= config.mempool_author_quota):
+            return 'quota exceeded'
+
+        return None
+
+    def _check_balance(self, transaction):
+        """
+        Unless the author is an admin, the author has enough credit for the transaction, without the credits spent by
+        the transactions of a block being mined.
+        """
+        if transaction.author not in config.admin_list:
+            sender_balance = self.get_balance(transaction.author) - self.sealing_spent.get(transaction.author, 0)
+            if sender_balance <= abs(int(transaction.value)):
+                return 'insufficient balance'
+
+        return None
+
+    def _check_signature(self, transaction):
+        """
+        The signature matches the verifying key.
+        """
+        with signature_verifications.time():
+            try:
+                if transaction.verify():
+                    return None
+            except Exception:
+                pass
+        return 'invalid signature'
+
+    def admission_stats(self):
+        """
+        Statistics of the admission stages.
+        :return: dict with the number of calls and the mean time (seconds) of each stage, and the rejections by reason
+        """
+        return {
+            'stages': {name: {'calls': calls, 'mean_time': total / calls if calls else None}
+                       for name, (calls, total) in self.stage_timings.items()},
+            'rejections': dict(self.rejections),
+            'rejected_replays': self.rejected_replays,
+        }
     
     def get_transaction_history(self, vk_hash):
         """
-        Returns the transaction history for a verification key hash
+        Returns the transaction history for a verification key hash, sorted by date (the archive is read if the chain is
+        pruned)
         :param vk_hash:
         :return: list of transactions
         """
-        transactions = []
-        for block in self.chain:
+        history = []
+        for block in self.blocks():
             for transaction in block.transactions:
                 if transaction.author == vk_hash:
                     # Transaction sent by vk_hash
                     if transaction.dest == vk_hash:
                         # Transaction with theyselves (creation or suppression of credits)
-                        transactions.append([
-                            transaction.date,
-                            transaction.message,
-                            transaction.author[:6] + '...',
-                            transaction.dest[:6] + '...',
-                            transaction.value,
-                            transaction.value
-                        ])
+                        history.append((transaction, transaction.value))
                     else:
                         # Transaction to another user
-                        transactions.append([
-                            transaction.date,
-                            transaction.message,
-                            transaction.author[:6] + '...',
-                            transaction.dest[:6] + '...',
-                            transaction.value,
-                            utils.inv_sign(transaction.value)
-                        ])
+                        history.append((transaction, utils.inv_sign(transaction.value)))
                 elif transaction.dest == vk_hash:
                     # Transaction received by vk_hash
-                    transactions.append([
-                        transaction.date,
-                        transaction.message,
-                        transaction.author[:6] + '...',
-                        transaction.dest[:6] + '...',
-                        transaction.value,
-                        transaction.value
-                    ])
+                    history.append((transaction, transaction.value))
+
+        history.sort(key=lambda x: x[0].timestamp_us)
 
-        transactions.sort(key=lambda x: x[0])
+        return [[transaction.date,
+                 transaction.message,
+                 transaction.author[:6] + '...',
+                 transaction.dest[:6] + '...',
+                 transaction.value,
+                 effect] for transaction, effect in history]
 
+    def get_transactions_between(self, start, end):
+        """
+        Returns the transactions of the chain whose date is in [start, end[, sorted by date.
+        Uses the time index: a binary search followed by a range scan. The archive is read if it holds transactions
+        dated after start.
+        :param start: int, microseconds since the epoch (see utils.str_to_us)
+        :param end: int, microseconds since the epoch
+        :return: list of transactions
+        """
+        transactions = [self.chain[index].transactions[position]
+                        for index, position in self.time_index.transactions_between(start, end)]
+        if self.first_full and self.archive.last_time is not None and self.archive.last_time >= start:
+            archived = [transaction for block in self.archive.blocks() for transaction in block.transactions
+                        if start <= transaction.timestamp_us < end]
+            transactions = sorted(archived + transactions, key=lambda transaction: transaction.timestamp_us)
         return transactions
 
     def new_block(self, block=None):
         """
-        Create a new block from transactions choosen in the mempool.
+        Create a new block from transactions choosen in the mempool, after removing the expired ones.
         :param block: The previous block. If None, the last block of the chain is used.
         :return: The new block
         """
+        start = time.perf_counter()
         if not block:
             block = self.last_block
 
+        self.expire()
         transactions = random.sample(self.mempool, min(len(self.mempool), config.blocksize))
         new_block = block.next(transactions)
+        self.remove_many_from_mempool(transactions)
 
-        for transaction in transactions:
-            self.mempool.remove(transaction)
-
+        block_builds.observe(time.perf_counter() - start)
         return new_block
 
     def extend_chain(self, block):
         """
-        Add a new block to the chain if it is valid (index, previous_hash, proof).
+        Add a new block to the chain if it is valid (index, previous_hash, proof) and none of its transactions is
+        already in the chain, including the pruned blocks.
+        The proof of work is only checked if config.proof_of_work is set.
         :param block: A block
         :raise InvalidBlock if the block is invalid
         """
+        start = time.perf_counter()
+        hashes = [transaction.hash() for transaction in block.transactions]
+        replayed = len(set(hashes)) != len(hashes) or any(self.confirmed(h) for h in hashes)
+        if replayed:
+            logger.warning("Invalid block #%d: it contains transactions already in the chain", block.index)
+            raise InvalidBlock
+
         if (block.index == self.last_block.index + 1 
-            and block.previous_hash == self.last_block.hash()):
+            and block.previous_hash == self.last_block.hash()
+            and (not config.proof_of_work or block.valid_proof())):
 
             self.chain.append(block)
+            self.time_index.add_block(block)
+            self._index_block(block, hashes)
+            block_extensions.observe(time.perf_counter() - start)
+            logger.info("Block #%d added to the chain (%d transactions)", block.index, len(block.transactions))
+            self._notify('block', block)
+            self.prune()
 
         else:
-            print(block.index > self.last_block.index)
-            print(block.previous_hash == self.last_block.hash())
-            # print(block.proof)
+            logger.warning("Invalid block #%d: index follows %s, previous hash matches %s, proof %s",
+                           block.index, block.index == self.last_block.index + 1,
+                           block.previous_hash == self.last_block.hash(), block.proof)
             raise InvalidBlock
 
     def __str__(self):
@@ -187,35 +671,56 @@ class Blockchain(object):
                 string+= '\n' + str(trans)
         return string
 
-    def validity(self):
+    def validity(self, archive=True):
         """
         Check the validity of the chain.
         - The first block must be the genesis block
         - Each block must be valid
         - Each block must point to the previous one
         - A transaction can only be in one block
+        The pruned blocks are read from the archive, and must have the hash of their header. With archive=False, the
+        pruned part of the chain is trusted up to the checkpoint (the last pruned block, which was checked when it was
+        added): only the links between the headers are checked, and the transactions of the full blocks must not be in
+        the pruned ones.
+        :param archive: read the pruned blocks from the archive
         :return: True if the chain is valid, False otherwise
         """
         if self.chain[0].index != 0:
             return False
 
+        archived = self.archive.blocks() if archive and self.first_full else iter(())
+
+        # Hashes of the transactions of the previous blocks
+        previous_transactions_hashes = {transaction.hash() for transaction in self.chain[0].transactions}
+        # With archive=False, the hashes of the pruned blocks are looked up in self.archived (not copied)
+        pruned_transactions_hashes = self.archived if not archive else ()
+
         for i in range(1, len(self.chain)):
             current_block = self.chain[i]
             previous_block = self.chain[i - 1]
 
-            if not current_block.validity():
+            if current_block.previous_hash != previous_block.hash():
                 return False
 
-            if current_block.previous_hash != previous_block.hash():
+            if i < self.first_full:
+                if not archive:
+                    continue
+                body = next(archived, None)
+                while body is not None and body.index < i:
+                    # The genesis block is archived too
+                    body = next(archived, None)
+                if body is None or body.hash() != current_block.hash():
+                    return False
+                current_block = body
+
+            if not current_block.validity():
                 return False
 
             transactions_hashes = [transaction.hash() for transaction in current_block.transactions]
-            for j in range(i - 1, -1, -1):
-                previous_block = self.chain[j]
-                previous_transactions_hashes = [transaction.hash() for transaction in previous_block.transactions]
-                for transaction_hash in transactions_hashes:
-                    if transaction_hash in previous_transactions_hashes:
-                        return False
+            for transaction_hash in transactions_hashes:
+                if transaction_hash in previous_transactions_hashes or transaction_hash in pruned_transactions_hashes:
+                    return False
+                previous_transactions_hashes.add(transaction_hash)
 
         return True
 
@@ -228,23 +733,39 @@ class Blockchain(object):
 
     def merge(self, other):
         """
-        Modify the blockchain if other is longer and valid.
+        Modify the blockchain if other is longer and valid. The mempool keeps the transactions which are not in the new
+        chain.
         :param other:
         :return: True if the other chain is longer and valid, False otherwise
         """
         if other.validity() and len(self) < len(other):
-            self.chain = other.chain[:]
-            
-            for block in other.chain:
-                for transaction in block.transactions:
-                    if transaction not in self.mempool:
-                        self.mempool.append(transaction)
-
+            self.replace(other.chain)
+            # The transactions of the mempool included in the new chain are no longer pending
+            self.remove_many_from_mempool([transaction for transaction in self.mempool
+                                           if transaction.hash() in self.locations])
             return True
 
         else:
             return False
 
+    def replace(self, chain):
+        """
+        Replace the chain without checking it (see merge, or a replica following its primary) and rebuild the indexes
+        :param chain: list of full blocks, from the genesis
+        """
+        self.chain = chain[:]
+        self.time_index = TimeIndex(self.chain)
+        self._index_chain()
+        if self.archive is not None:
+            self.archive.clear()
+            self.first_full = 0
+            self.snapshot = {}
+            self.archived.clear()
+            self.checkpoint = None
+
+        self._notify('merge', self)
+        self.prune()
+
     def log(self):
         print(self)
         Transaction.log(self.mempool)
@@ -0,0 +1,412 @@
+"""
+Python client of the node API (host_node).
+
+NodeClient keeps a pool of HTTP connections to the node (requests.Session), applies a timeout to every request and
+retries with an exponential backoff after a connection error or a 429/502/503/504 response (the Retry-After header is
+honoured). The requests which change the state of the node (submissions, /mine) are not idempotent: they are only
+retried when the node did not receive them (connection refused) or refused them before handling them (429, 503), so
+that an admitted transaction is never submitted twice. submit_batch sends the transactions by chunks of
+config.client_batch_size to /transactions/batch, which admits a whole chunk in a single request.
+
+The responses of /chain, /balance and /past_transactions are kept with their ETag: the next identical request is
+conditional (If-None-Match) and the node answers 304 without a body as long as no block was added.
+
+AsyncNodeClient offers the same methods as coroutines, for asyncio programs. The requests are run by a NodeClient in a
+pool of threads.
+
+Transactions are built and signed locally with a Signer (see transaction.py):
+
+    signer = Signer(sk)
+    client = NodeClient("http://127.0.0.1:5000")
+    results = client.submit_batch([signer.transaction(f"Transfer {i}", '+1', dest) for i in range(1000)])
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import config
+
+retry_statuses = (429, 502, 503, 504)
+refused_statuses = (429, 503)  # Answered by the node before handling the request (rate limit, backpressure)
+
+
+class NodeError(Exception):
+    def __init__(self, status, message):
+        """
+        :param status: HTTP status of the response (None if the node could not be reached)
+        :param message: body of the response, or the connection error
+        """
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+def not_sent(error):
+    """
+    :param error: a requests.ConnectionError
+    :return: True if the request did not reach the node (the connection could not be established)
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def payload(transaction):
+    """
+    :return: the json payload of a signed transaction, as expected by /transactions/new
+    """
+    return dict(transaction.data, signature=transaction.signature)
+
+
+class NodeClient(object):
+    def __init__(self, url=config.node_url, timeout=config.client_timeout, retries=config.client_retries,
+                 backoff=config.client_backoff, pool_size=config.client_pool_size):
+        """
+        :param url: url of the node, e.g. "http://127.0.0.1:5000"
+        :param timeout: timeout of each request (seconds)
+        :param retries: number of retries of a request
+        :param backoff: time before the first retry (seconds), doubled at each retry
+        :param pool_size: number of connections kept open to the node
+        """
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.etags = OrderedDict()  # (method, path, payload) -> (ETag, data), at most config.client_cache_size
+        self.etags_lock = threading.Lock()  # The client can be used by many threads (e.g. AsyncNodeClient)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _delay(self, attempt, response=None):
+        """
+        :return: the time to wait before the retry number attempt (seconds)
+        """
+        if response is not None:
+            try:
+                return float(response.headers['Retry-After'])
+            except (KeyError, ValueError):
+                pass
+        return self.backoff * 2 ** attempt
+
+    def request(self, method, path, expected=(200,), idempotent=None, **kwargs):
+        """
+        Send a request to the node, with retries
+        :param method: 'GET' or 'POST'
+        :param path: e.g. '/chain'
+        :param expected: the HTTP statuses of a successful response
+        :param idempotent: whether the request can be sent again after a timeout or a 502/504 (None: only the GETs).
+                           A request which is not idempotent is only retried if it did not reach the node or was
+                           refused with a 429 or a 503.
+        :param kwargs: passed to requests (json, params...)
+        :raise NodeError if the node cannot be reached or answers with an unexpected status
+        :return: the response
+        """
+        if idempotent is None:
+            idempotent = method == 'GET'
+        statuses = retry_statuses if idempotent else refused_statuses
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = self.session.request(method, self.url + path, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last or not (idempotent or isinstance(e, requests.ConnectionError) and not_sent(e)):
+                    raise NodeError(None, str(e))
+                time.sleep(self._delay(attempt))
+                continue
+
+            if response.status_code in statuses and not last:
+                time.sleep(self._delay(attempt, response))
+                continue
+            if response.status_code not in expected:
+                raise NodeError(response.status_code, response.text)
+            return response
+
+    def conditional(self, method, path, payload=None):
+        """
+        Send a request with the ETag of the previous identical request, and reuse its data if the node answers 304
+        :return: the json data of the response
+        """
+        key = (method, path, json.dumps(payload, sort_keys=True))
+        with self.etags_lock:
+            cached = self.etags.get(key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+        response = self.request(method, path, expected=(200, 304), idempotent=True, json=payload, headers=headers)
+        if response.status_code == 304 and cached:
+            with self.etags_lock:
+                if key in self.etags:
+                    self.etags.move_to_end(key)
+            return cached[1]
+
+        data = response.json()
+        etag = response.headers.get('ETag')
+        if etag:
+            with self.etags_lock:
+                self.etags[key] = (etag, data)
+                self.etags.move_to_end(key)
+                if len(self.etags) > config.client_cache_size:
+                    self.etags.popitem(last=False)
+        return data
+
+    def chain(self):
+        """
+        :return: dict with the chain
+        """
+        return self.conditional('GET', '/chain')
+
+    def balance(self, hash):
+        """
+        :param hash: hash of a verifying key
+        :return: the balance (int)
+        """
+        return self.conditional('POST', '/balance', {'hash': hash})['balance']
+
+    def balances(self, hashes=None):
+        """
+        :param hashes: list of hashes of verifying keys, or None for every account of the chain
+        :return: dict hash -> balance
+        """
+        return self.request('POST', '/balances', idempotent=True,
+                            json={'hashes': 'all' if hashes is None else list(hashes)}).json()['balances']
+
+    def history(self, hash):
+        """
+        :param hash: hash of a verifying key
+        :return: the transaction history (see Blockchain.get_transaction_history)
+        """
+        return self.conditional('POST', '/past_transactions', {'hash': hash})['histo']
+
+    def blocks(self, start, limit=config.replica_batch_blocks):
+        """
+        :param start: index of the first block
+        :param limit: maximum number of blocks
+        :return: dict with the height of the chain and the full blocks from start (see archive.block_to_dict)
+        """
+        return self.request('GET', '/blocks', params={'from': start, 'limit': limit}).json()
+
+    def transactions_between(self, start, end):
+        """
+        :param start: date (str, see utils.time_format)
+        :param end: date (str)
+        :return: the transactions of the chain dated between start and end
+        """
+        return self.request('GET', '/transactions/range', params={'start': start, 'end': end}).json()
+
+    def status(self, transaction_hash):
+        """
+        :param transaction_hash: see Transaction.hash
+        :return: dict with the status of the transaction ('confirmed', 'pending' or 'unknown')
+        """
+        response = self.request('GET', f'/transactions/{transaction_hash}', expected=(200, 404))
+        return response.json()
+
+    def top_holders(self, n=config.analytics_top):
+        """
+        :return: the n companies with the highest balances, as a list of dict {'account', 'balance'}
+        """
+        return self.request('GET', '/analytics/top', params={'n': n}).json()['holders']
+
+    def period(self, period, account=None):
+        """
+        :param period: e.g. '2024-Q3' (see analytics.period_of)
+        :param account: only the flows of this company
+        :return: dict with the credits issued, burned and transferred during the period, and the flows between companies
+        """
+        params = {'account': account} if account else {}
+        return self.request('GET', f'/analytics/periods/{period}', params=params).json()
+
+    def report(self, group_by=None, **filters):
+        """
+        :param group_by: 'author', 'dest', 'block', 'day', 'month' or 'year'
+        :param filters: account, author, dest, start, end (dates as str), min_value, max_value, first_block, last_block
+        :return: dict with the number and the sum of the values of the matching transactions, and the groups
+        """
+        params = dict(filters, group_by=group_by) if group_by else filters
+        return self.request('GET', '/reports', params=params).json()
+
+    def submit(self, transaction):
+        """
+        Submit a signed transaction
+        :return: True if the transaction was added to the mempool, False if it was rejected
+        """
+        try:
+            self.request('POST', '/transactions/new', expected=(201,), json=payload(transaction))
+        except NodeError as e:
+            if e.status == 400:
+                return False
+            raise
+        return True
+
+    def submit_batch(self, transactions, batch_size=config.client_batch_size):
+        """
+        Submit signed transactions, by chunks of batch_size transactions per request
+        :param transactions: iterable of signed transactions
+        :return: a list of dict {'accepted': bool, 'reason': reason of the rejection or None}, in order
+        """
+        results = []
+        chunk = []
+        for transaction in transactions:
+            chunk.append(payload(transaction))
+            if len(chunk) == batch_size:
+                results.extend(self._submit_chunk(chunk))
+                chunk = []
+        if chunk:
+            results.extend(self._submit_chunk(chunk))
+        return results
+
+    def _submit_chunk(self, chunk):
+        return self.request('POST', '/transactions/batch', json={'transactions': chunk}).json()['results']
+
+    def mine(self):
+        """
+        Seal a block with the transactions of the mempool
+        :return: the new block (dict), or None if the mempool is empty
+        """
+        response = self.request('GET', '/mine', expected=(200, 250), idempotent=False)
+        return response.json() if response.status_code == 200 else None
+
+    def events(self, accounts=None):
+        """
+        Subscribe to the events of the node (/events). The connection stays open: the iteration blocks until the next
+        event. It ends when the node drops the subscription ('dropped' is the last event). The node sends a heartbeat
+        every config.sse_heartbeat seconds, so a stream silent for 3 heartbeats is considered lost (the node may have
+        disappeared without closing the connection) and raises a requests.ConnectionError.
+        :param accounts: iterable of account hashes whose balance deltas are wanted
+        :return: a generator of (event, data): ('height', index) first, then ('block', header), ('balance', delta),
+                 ('reset', height) and ('dropped', {})
+        """
+        params = {'accounts': ','.join(accounts)} if accounts else {}
+        response = self.session.get(self.url + '/events', params=params, stream=True,
+                                    timeout=(self.timeout, 3 * config.sse_heartbeat))
+        if response.status_code != 200:
+            raise NodeError(response.status_code, response.text)
+        with response:
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event: '):
+                    event = line[len('event: '):]
+                elif line.startswith('data: ') and event is not None:
+                    yield event, json.loads(line[len('data: '):])
+                    event = None
+
+    def validate(self):
+        """
+        :return: True if the chain of the node is valid
+        """
+        return self.request('GET', '/chain/validate').json()['valid']
+
+
+class AsyncNodeClient(object):
+    def __init__(self, url=config.node_url, workers=config.client_pool_size, **kwargs):
+        """
+        Same as NodeClient, with coroutines. Up to workers requests are sent concurrently.
+        :param kwargs: passed to NodeClient
+        """
+        self.client = NodeClient(url, pool_size=workers, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(function, *args))
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+    async def chain(self):
+        return await self._run(self.client.chain)
+
+    async def balance(self, hash):
+        return await self._run(self.client.balance, hash)
+
+    async def balances(self, hashes=None):
+        return await self._run(self.client.balances, hashes)
+
+    async def history(self, hash):
+        return await self._run(self.client.history, hash)
+
+    async def transactions_between(self, start, end):
+        return await self._run(self.client.transactions_between, start, end)
+
+    async def status(self, transaction_hash):
+        return await self._run(self.client.status, transaction_hash)
+
+    async def top_holders(self, n=config.analytics_top):
+        return await self._run(self.client.top_holders, n)
+
+    async def period(self, period, account=None):
+        return await self._run(self.client.period, period, account)
+
+    async def report(self, group_by=None, **filters):
+        return await self._run(partial(self.client.report, group_by, **filters))
+
+    async def submit(self, transaction):
+        return await self._run(self.client.submit, transaction)
+
+    async def submit_batch(self, transactions, batch_size=config.client_batch_size):
+        """
+        Same as NodeClient.submit_batch, the chunks are sent concurrently
+        """
+        transactions = list(transactions)
+        chunks = [[payload(t) for t in transactions[i:i + batch_size]]
+                  for i in range(0, len(transactions), batch_size)]
+        results = await asyncio.gather(*(self._run(self.client._submit_chunk, chunk) for chunk in chunks))
+        return [result for chunk in results for result in chunk]
+
+    async def mine(self):
+        return await self._run(self.client.mine)
+
+    async def validate(self):
+        return await self._run(self.client.validate)
+
+
+def test():
+    """
+    Submit transactions to a node running on 127.0.0.1:5000
+    """
+    from transaction import Signer
+    signer = Signer(config.sk_restored)
+    with NodeClient("http://127.0.0.1:5000") as client:
+        transactions = [signer.transaction(f"Client test {i}", '+1', signer.author[::-1]) for i in range(250)]
+        start = time.time()
+        results = client.submit_batch(transactions)
+        print(f"{sum(r['accepted'] for r in results)} / {len(results)} accepted in {time.time() - start:.3f} s")
+        print(client.mine())
+        print(client.balance(signer.author[::-1]))
+
+    async def run():
+        async with AsyncNodeClient("http://127.0.0.1:5000") as client:
+            transactions = [signer.transaction(f"Async test {i}", '+1', signer.author[::-1]) for i in range(250)]
+            results = await client.submit_batch(transactions)
+            print(f"{sum(r['accepted'] for r in results)} / {len(results)} accepted")
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,215 @@
+"""
+This module contains the class TransactionStore, a columnar copy of the transactions of the chain for the reporting
+queries (served by the node on /reports when config.columnar_store is set; requires NumPy).
+
+Each field is a NumPy array grown by doubling: block index, position in the block, date (microseconds, see
+utils.str_to_us), signed value, author and dest. The hashes of the authors and dests are dictionary-encoded: the
+columns hold int32 ids and the hashes are stored once. A transaction takes 36 bytes instead of a Transaction object and
+its strings. The store is a blockchain listener, so it is appended when a block is added and rebuilt after a merge.
+
+A scan filters the rows with vectorized comparisons (account, author, dest, date range, value range, block range) and a
+group-by aggregates the selected rows by author, dest, block, day, month or year, with np.add.at.
+"""
+
+import numpy as np
+
+group_keys = ('author', 'dest', 'block', 'day', 'month', 'year')
+
+
+class Column(object):
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        """
+        :param values: list of values
+        """
+        end = self.size + len(values)
+        if end > len(self.data):
+            data = np.zeros(max(end, 2 * len(self.data)), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:end] = values
+        self.size = end
+
+    def view(self):
+        return self.data[:self.size]
+
+    def nbytes(self):
+        return self.data.nbytes
+
+
+class TransactionStore(object):
+    def __init__(self, chain=()):
+        """
+        :param chain: the blocks already in the chain
+        """
+        self.reset(chain)
+
+    def reset(self, chain=()):
+        self.ids = {}  # account -> id
+        self.accounts = []  # id -> account
+        self.block = Column(np.int64)
+        self.position = Column(np.int32)
+        self.date = Column(np.int64)
+        self.value = Column(np.int64)
+        self.author = Column(np.int32)
+        self.dest = Column(np.int32)
+        for block in chain:
+            self.add_block(block)
+
+    def listener(self, event, data):
+        """
+        Blockchain listener: append the new blocks, rebuild after a merge
+        """
+        if event == 'block':
+            self.add_block(data)
+        elif event == 'merge':
+            self.reset(data.chain)
+
+    def _encode(self, account):
+        i = self.ids.get(account)
+        if i is None:
+            i = self.ids[account] = len(self.accounts)
+            self.accounts.append(account)
+        return i
+
+    def add_block(self, block):
+        transactions = block.transactions
+        self.block.extend([block.index] * len(transactions))
+        self.position.extend(range(len(transactions)))
+        self.date.extend([t.timestamp_us for t in transactions])
+        self.value.extend([int(t.value) for t in transactions])
+        self.author.extend([self._encode(t.author) for t in transactions])
+        self.dest.extend([self._encode(t.dest) for t in transactions])
+
+    def __len__(self):
+        return self.value.size
+
+    def nbytes(self):
+        """
+        :return: memory used by the columns (bytes, without the dictionary of the accounts)
+        """
+        return sum(column.nbytes() for column in (self.block, self.position, self.date, self.value, self.author,
+                                                  self.dest))
+
+    def _id(self, account):
+        # -1 matches no row
+        return self.ids.get(account, -1)
+
+    def scan(self, account=None, author=None, dest=None, start=None, end=None, min_value=None, max_value=None,
+             first_block=None, last_block=None):
+        """
+        Select the transactions matching all the given filters
+        :param account: hash of an account, author or dest of the transactions
+        :param author: hash of the author
+        :param dest: hash of the dest
+        :param start: date (int, microseconds since the epoch, see utils.str_to_us), included
+        :param end: date (int), excluded
+        :param min_value: int, included (the values are signed)
+        :param max_value: int, included
+        :param first_block: index of a block, included
+        :param last_block: index of a block, included
+        :return: boolean array, True for the selected rows
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if account is not None:
+            i = self._id(account)
+            mask &= (self.author.view() == i) | (self.dest.view() == i)
+        if author is not None:
+            mask &= self.author.view() == self._id(author)
+        if dest is not None:
+            mask &= self.dest.view() == self._id(dest)
+        if start is not None:
+            mask &= self.date.view() >= start
+        if end is not None:
+            mask &= self.date.view() < end
+        if min_value is not None:
+            mask &= self.value.view() >= min_value
+        if max_value is not None:
+            mask &= self.value.view() <= max_value
+        if first_block is not None:
+            mask &= self.block.view() >= first_block
+        if last_block is not None:
+            mask &= self.block.view() <= last_block
+        return mask
+
+    def locations(self, mask):
+        """
+        :param mask: result of scan
+        :return: the locations (block index, position) of the selected transactions, in the order of the chain
+        """
+        return list(zip(self.block.view()[mask].tolist(), self.position.view()[mask].tolist()))
+
+    def _labels(self, key, mask):
+        """
+        :return: the group of each selected row (array), and a function converting a group to its label
+        """
+        if key in ('author', 'dest'):
+            return getattr(self, key).view()[mask], lambda i: self.accounts[i]
+        if key == 'block':
+            return self.block.view()[mask], int
+        unit = {'day': 'D', 'month': 'M', 'year': 'Y'}[key]
+        dates = self.date.view()[mask].astype('datetime64[us]').astype(f'datetime64[{unit}]')
+        return dates.astype(np.int64), lambda d: str(np.datetime64(int(d), unit))
+
+    def group_by(self, key, mask=None):
+        """
+        :param key: one of group_keys
+        :param mask: result of scan (None: every transaction)
+        :raise ValueError if the key is unknown
+        :return: dict label -> {'count', 'sum', 'min', 'max'} of the values of the selected transactions
+        """
+        if key not in group_keys:
+            raise ValueError(f"Unknown group key {key}, expected one of {group_keys}")
+        if mask is None:
+            mask = np.ones(len(self), dtype=bool)
+        groups, label = self._labels(key, mask)
+        values = self.value.view()[mask]
+        keys, inverse = np.unique(groups, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        sums = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(sums, inverse, values)
+        minimums = np.full(len(keys), np.iinfo(np.int64).max)
+        np.minimum.at(minimums, inverse, values)
+        maximums = np.full(len(keys), np.iinfo(np.int64).min)
+        np.maximum.at(maximums, inverse, values)
+        return {label(k): {'count': int(c), 'sum': int(s), 'min': int(lo), 'max': int(hi)}
+                for k, c, s, lo, hi in zip(keys.tolist(), counts, sums, minimums, maximums)}
+
+
+def test():
+    import time
+    import utils
+    from benchmark import Fixture
+    fixture = Fixture(100000)
+    blockchain = fixture.blockchain
+
+    start = time.perf_counter()
+    store = TransactionStore(blockchain.chain)
+    print(f"{len(store)} transactions stored in {time.perf_counter() - start:.3f} s, {store.nbytes() / 1e6:.1f} MB")
+
+    account = fixture.accounts[3]
+    start = time.perf_counter()
+    mask = store.scan(account=account, min_value=5)
+    locations = store.locations(mask)
+    print(f"Scan: {len(locations)} transactions in {(time.perf_counter() - start) * 1000:.2f} ms")
+    expected = [(block.index, position) for block in blockchain.chain
+                for position, t in enumerate(block.transactions)
+                if account in (t.author, t.dest) and int(t.value) >= 5]
+    assert locations == expected
+
+    start = time.perf_counter()
+    groups = store.group_by('dest', store.scan(start=utils.str_to_us("2024-01-01 00:00:30.000000")))
+    print(f"Group by dest: {len(groups)} groups in {(time.perf_counter() - start) * 1000:.2f} ms")
+    print(store.group_by('day'))
+
+    blockchain.add_listener(store.listener)
+    t = fixture.signed_transfers(1)[0]
+    blockchain.extend_chain(blockchain.last_block.next([t]))
+    assert store.locations(store.scan(first_block=blockchain.last_block.index)) == [(blockchain.last_block.index, 0)]
+
+
+if __name__ == '__main__':
+    test()
@@ -6,6 +6,9 @@ blockdepth = 2
 blocksize = 2 ** blockdepth - 1  # Number of messages in a block
 
 default_difficulty = 3
+proof_of_work = False  # If True, blocks must carry a valid proof of work to be accepted
+mining_workers = None  # Number of processes used to mine (None: one per CPU)
+mining_chunk = 50000  # Number of nonces tried by a worker before checking the other workers
 
 # the list of public keys ash for admins
 import ecdsa
@@ -20,4 +23,81 @@ hash = hash_str(sk_restored)
 
 admin_list = [hash] 
 
-show_mempool = True
\ No newline at end of file
+# Signatures (see signatures.py)
+signature_backend = "openssl"  # "openssl" (native, cryptography package) or "ecdsa" (pure Python)
+key_type = "nist192p"  # Curve of the new keys: "nist192p" or "ed25519"
+
+# Client (see client.py)
+node_url = "http://138.195.53.65:5000"
+client_timeout = 10  # Seconds
+client_retries = 3  # Number of retries after a connection error or a 429/502/503/504 response
+client_backoff = 0.2  # Seconds before the first retry, doubled at each retry
+client_pool_size = 10  # Number of connections kept open to the node
+client_batch_size = 100  # Number of transactions per request of submit_batch
+client_cache_size = 1024  # Number of responses kept with their ETag for conditional requests
+
+# Batch signing (see batch_sign.py)
+batch_sign_chunk = 500  # Number of rows signed by a process at once
+
+# Interface (see interface.py and background.py)
+gui_workers = 4  # Number of threads running the network calls of the interface
+gui_poll_interval = 50  # Milliseconds between two checks of the results of the network calls
+gui_history_rows = 20  # Number of rows of the history table
+
+# Wallet (see keystore.py)
+keystore_path = "wallet.keystore"
+wallet_key_name = "default"  # Name of the key used by the interface
+
+show_mempool = True
+
+log_level = "INFO"  # Logging level of the node (DEBUG logs every request)
+
+# Response cache of /chain, /balance and /past_transactions (see response_cache.py)
+response_cache_size = 1024  # Number of responses kept
+
+# Push subscriptions on /events (see events.py)
+subscriber_queue_size = 1000  # Events queued per subscriber before it is dropped as too slow
+sse_heartbeat = 15  # Seconds between two heartbeats of an idle event stream
+
+# Analytics (see analytics.py)
+analytics_period = "quarter"  # Periods of the issuance, burn and flow aggregates: "month", "quarter" or "year"
+analytics_top = 10  # Default number of holders returned by /analytics/top
+columnar_store = False  # Keep a columnar copy of the transactions for /reports (see columnar.py, requires NumPy)
+
+# Pruning (see archive.py)
+prune_keep = None  # Number of recent blocks whose transactions stay in memory (None: no pruning)
+archive_path = "chain.archive"  # File of the transactions of the pruned blocks
+
+# Read replica (see replica.py)
+replica_of = None  # Url of the primary node followed by this node (None: this node is a primary)
+replica_batch_blocks = 100  # Number of blocks fetched from the primary per request
+
+# Profiling (see profiling.py)
+slow_request_threshold = 0.5  # Requests slower than this number of seconds are logged
+slow_request_log_size = 100  # Number of slow requests kept by the node
+profile_interval = 0.005  # Seconds between two samples of the profiler
+profile_max_seconds = 60  # Longest profile an admin can request
+admin_request_max_age = 60  # Seconds during which a signed admin request is accepted
+
+reject_cache_size = 10000  # Number of rejected transactions remembered by the admission pipeline
+
+# Mempool limits (see Blockchain.add_to_mempool)
+mempool_max_transactions = 100000  # Above, the oldest transactions of the authors with the most transactions are evicted
+mempool_max_bytes = 64 * 2 ** 20  # Same, for the size of the transactions (see blockchain.mempool_size)
+mempool_ttl = 24 * 3600  # Seconds after its date during which a transaction can be admitted and stays in the mempool
+mempool_author_quota = 1000  # Transactions of an author in the mempool (the admins have no quota)
+
+# Rate limiting of the admissions (see rate_limit.py)
+rate_limit = True  # False: no rate limiting nor backpressure (e.g. load tests)
+rate_limit_author = 10  # Transactions per second per author (the admins are not limited)
+rate_limit_author_burst = 50
+rate_limit_client = 100  # Transactions per second per client address
+rate_limit_client_burst = 200  # Must not be smaller than client_batch_size
+rate_limit_keys = 100000  # Token buckets kept per limiter (least recently used first out)
+admission_max_waiting = 32  # Admission requests waiting for the blockchain lock before the node answers 503
+backpressure_retry_after = 1  # Seconds, Retry-After of the 503 answers
+
+# Background block production (see block_producer.py)
+auto_mine = True
+max_block_latency = 5.0  # Maximum number of seconds a transaction waits in the mempool before a block is sealed
+producer_samples = 1000  # Number of time-to-inclusion samples kept for the percentiles
\ No newline at end of file
@@ -9,17 +9,43 @@ To encrypt data, use encrypt(data, key). The key must be a base64 encoded string
 
 The data are binary. To convert a string to a binary string, use encode(). To convert a binary string to a string, use
 decode().
+
+Large data (e.g. a ledger export) can be encrypted as a stream with encrypt_stream(src, dst, key) and
+decrypt_stream(src, dst, key), or from file to file with encrypt_file and decrypt_file. The stream is cut in chunks of
+fixed size, each one authenticated (AES-GCM), so that the memory used does not depend on the size of the data. The
+format is:
+    - a header: magic (4 bytes), version (1 byte), chunk size (4 bytes), nonce prefix (8 random bytes)
+    - the chunks: final flag (1 byte), length of the encrypted chunk (4 bytes), encrypted chunk
+The nonce of a chunk is the nonce prefix followed by the index of the chunk. The header (including the chunk size), the
+index and the final flag are authenticated with the chunk, so that reordered, truncated or extended streams are
+detected. The chunk size is at most max_chunk_size, so that a forged header cannot make the reader allocate a huge
+chunk.
 """
 
 import os
 import base64
+import struct
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 default_salt = b'\xb1\xc7\xbb\x04K\xd4\n~uA\xbe\xa4\x1a\xaeV\xe3'
 
+stream_magic = b'ECSE'
+stream_version = 1
+default_chunk_size = 64 * 1024
+max_chunk_size = 16 * 1024 * 1024
+_header = struct.Struct('>4sBI8s')
+_chunk_header = struct.Struct('>?I')
+
+
+class InvalidStream(Exception):
+    pass
+
 
 def generate_salt():
     """
@@ -69,6 +95,145 @@ def decrypt(data, key):
     return data
 
 
+def _stream_cipher(key):
+    """
+    AES-GCM cipher of the streams encrypted with a key. The AES key is derived from the key with HKDF, so that the
+    same key is not used by both Fernet and AES-GCM. It is derived once per stream and not cached.
+    :param key: a base64 encoded key
+    :return: AESGCM
+    """
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'encrypt_data stream',
+                backend=default_backend())
+    return AESGCM(hkdf.derive(base64.urlsafe_b64decode(key)))
+
+
+def _read_full(src, n):
+    """
+    Read n bytes, or less at the end of the stream only (pipes, sockets and raw files may return short reads)
+    :return: binary string
+    """
+    data = src.read(n)
+    if len(data) in (0, n):
+        return data
+    parts = [data]
+    size = len(data)
+    while size < n:
+        data = src.read(n - size)
+        if not data:
+            break
+        parts.append(data)
+        size += len(data)
+    return b''.join(parts)
+
+
+def _read_exactly(src, n):
+    data = _read_full(src, n)
+    if len(data) != n:
+        raise InvalidStream("Truncated stream")
+    return data
+
+
+def encrypt_stream(src, dst, key, chunk_size=default_chunk_size):
+    """
+    Encrypt a stream with a key, chunk by chunk
+    :param src: a binary file object to read
+    :param dst: a binary file object to write
+    :param key: a base64 encoded key
+    :param chunk_size: size of the chunks (bytes, at most max_chunk_size)
+    :return: number of bytes read
+    """
+    if not 0 < chunk_size <= max_chunk_size:
+        raise ValueError(f"The chunk size must be in [1, {max_chunk_size}]")
+    cipher = _stream_cipher(key)
+    header = _header.pack(stream_magic, stream_version, chunk_size, os.urandom(8))
+    prefix = header[-8:]
+    dst.write(header)
+
+    size = 0
+    index = 0
+    chunk = _read_full(src, chunk_size)
+    while True:
+        # A chunk shorter than chunk_size is the last one
+        following = _read_full(src, chunk_size) if len(chunk) == chunk_size else b''
+        final = not following
+        aad = header + struct.pack('>I?', index, final)
+        encrypted = cipher.encrypt(prefix + struct.pack('>I', index), chunk, aad)
+        dst.write(_chunk_header.pack(final, len(encrypted)))
+        dst.write(encrypted)
+
+        size += len(chunk)
+        index += 1
+        if final:
+            return size
+        chunk = following
+
+
+def decrypt_stream(src, dst, key):
+    """
+    Decrypt a stream encrypted with encrypt_stream
+    :param src: a binary file object to read
+    :param dst: a binary file object to write
+    :param key: a base64 encoded key
+    :raise InvalidStream if the stream is not valid (wrong key, modified, truncated...). The chunks written in dst before
+           the error must be discarded.
+    :return: number of bytes written
+    """
+    cipher = _stream_cipher(key)
+    header = _read_exactly(src, _header.size)
+    magic, version, chunk_size, prefix = _header.unpack(header)
+    if magic != stream_magic or version != stream_version:
+        raise InvalidStream("Not an encrypted stream")
+    if not 0 < chunk_size <= max_chunk_size:
+        raise InvalidStream("Invalid chunk size")
+
+    size = 0
+    index = 0
+    final = False
+    while not final:
+        final, length = _chunk_header.unpack(_read_exactly(src, _chunk_header.size))
+        if length > chunk_size + 16:
+            raise InvalidStream("Invalid chunk length")
+        aad = header + struct.pack('>I?', index, final)
+        try:
+            chunk = cipher.decrypt(prefix + struct.pack('>I', index), _read_exactly(src, length), aad)
+        except InvalidTag:
+            raise InvalidStream(f"Invalid chunk {index}")
+        dst.write(chunk)
+        size += len(chunk)
+        index += 1
+
+    if src.read(1):
+        raise InvalidStream("Data after the final chunk")
+    return size
+
+
+def encrypt_file(src_path, dst_path, key, chunk_size=default_chunk_size):
+    """
+    Encrypt a file into another file (see encrypt_stream)
+    :return: number of bytes read
+    """
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        return encrypt_stream(src, dst, key, chunk_size)
+
+
+def decrypt_file(src_path, dst_path, key):
+    """
+    Decrypt a file encrypted with encrypt_file. The output file is only created if the whole file is valid.
+    :raise InvalidStream if the file is not valid
+    :return: number of bytes written
+    """
+    tmp_path = dst_path + '.tmp'
+    try:
+        with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            size = decrypt_stream(src, dst, key)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, dst_path)
+    return size
+
+
 def test():
     key = generate_private_key("password")
     data = "A plain message"
@@ -79,5 +244,34 @@ def test():
     print(f"Decrypted data : {data.decode()}")
 
 
+def test_stream():
+    import io
+    key = generate_private_key("password")
+    data = os.urandom(1000000)
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(data), encrypted, key, chunk_size=4096)
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(encrypted.getvalue()), decrypted, key)
+    print(f"Stream decrypted : {decrypted.getvalue() == data}")
+
+    class Pipe(io.BytesIO):
+        # Short reads, as from a pipe or a socket
+        def read(self, n=-1):
+            return super().read(min(n, 1000) if n >= 0 else n)
+
+    piped = io.BytesIO()
+    encrypt_stream(Pipe(data), piped, key, chunk_size=4096)
+    decrypted = io.BytesIO()
+    decrypt_stream(Pipe(piped.getvalue()), decrypted, key)
+    print(f"Stream with short reads decrypted : {decrypted.getvalue() == data}")
+
+    truncated = encrypted.getvalue()[:-5000]
+    try:
+        decrypt_stream(io.BytesIO(truncated), io.BytesIO(), key)
+    except InvalidStream as e:
+        print(f"Truncated stream detected : {e}")
+
+
 if __name__ == "__main__":
     test()
+    test_stream()
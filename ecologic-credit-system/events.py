@@ -0,0 +1,184 @@
+"""
+This module contains the class Broadcaster, which pushes the changes of the blockchain to subscribers (served by the
+node as Server-Sent Events on /events):
+
+- 'height': the index of the last block when the subscription starts (first event)
+- 'block': the header of each block added to the chain (index, hash, previous hash, timestamp, number of transactions)
+- 'balance': the balance delta of each watched account in the block, for the subscribers watching accounts
+- 'reset': the chain was replaced by a longer one (merge), the subscriber must reload its state
+
+The broadcaster is a blockchain listener: it is called with the blockchain lock held, so publishing only puts the event
+in the queue of each subscriber. The queues are bounded (config.subscriber_queue_size): a subscriber whose queue is full
+is too slow and is dropped, it receives a last 'dropped' event and can reconnect.
+"""
+
+import json
+import logging
+import queue
+import threading
+from collections import defaultdict
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    def __init__(self, accounts=None, size=config.subscriber_queue_size):
+        """
+        :param accounts: set of account hashes whose balance deltas are pushed (None or empty: blocks only)
+        :param size: size of the queue
+        """
+        self.accounts = set(accounts or ())
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = False
+
+    def get(self, timeout):
+        """
+        :param timeout: seconds
+        :return: the next (event, data), or None after timeout seconds without event
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def block_deltas(block):
+    """
+    Balance deltas of the accounts in a block. The transactions are not deduplicated against the chain: the blocks
+    repeating a transaction already in the chain are rejected by Blockchain.extend_chain, so the deltas of the blocks
+    add up to Blockchain.get_balance.
+    :return: dict account -> delta
+    """
+    deltas = defaultdict(int)
+    for transaction in block.transactions:
+        value = int(transaction.value)
+        if transaction.author == transaction.dest:
+            deltas[transaction.author] += value
+        else:
+            deltas[transaction.author] -= value
+            deltas[transaction.dest] += value
+    return deltas
+
+
+def block_header(block):
+    return {
+        'index': block.index,
+        'hash': block.hash(),
+        'previous_hash': block.previous_hash,
+        'timestamp': block.timestamp,
+        'transactions': len(block.transactions),
+    }
+
+
+class Broadcaster(object):
+    def __init__(self):
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, accounts=None, height=None):
+        """
+        Must be called with the blockchain lock held, so that no block is missed or published twice
+        :param accounts: iterable of account hashes whose balance deltas are pushed
+        :param height: index of the last block, sent as the first event
+        :return: a Subscription
+        """
+        subscription = Subscription(accounts)
+        if height is not None:
+            subscription.queue.put_nowait(('height', {'index': height}))
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def _put(self, subscription, event, data):
+        try:
+            subscription.queue.put_nowait((event, data))
+        except queue.Full:
+            subscription.dropped = True
+            self.subscriptions.discard(subscription)
+            self.dropped += 1
+            logger.warning("Slow subscriber dropped (%d events queued)", subscription.queue.qsize())
+
+    def listener(self, event, data):
+        """
+        Blockchain listener: publish the blocks, the balance deltas and the merges
+        """
+        with self.lock:
+            if not self.subscriptions:
+                return
+            if event == 'block':
+                header = block_header(data)
+                deltas = None
+                for subscription in list(self.subscriptions):
+                    self._put(subscription, 'block', header)
+                    if subscription.accounts and not subscription.dropped:
+                        if deltas is None:
+                            deltas = block_deltas(data)
+                        for account in subscription.accounts.intersection(deltas):
+                            self._put(subscription, 'balance',
+                                      {'block': data.index, 'account': account, 'delta': deltas[account]})
+                self.published += 1
+            elif event == 'merge':
+                for subscription in list(self.subscriptions):
+                    self._put(subscription, 'reset', {'height': data.last_block.index})
+
+    def stream(self, subscription, heartbeat=config.sse_heartbeat):
+        """
+        Generate the Server-Sent Events of a subscription, with a comment every heartbeat seconds to keep the
+        connection open. The subscription is removed when the client disconnects.
+        :return: a generator of str
+        """
+        try:
+            while True:
+                if subscription.dropped and subscription.queue.empty():
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+                item = subscription.get(heartbeat)
+                if item is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                event, data = item
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self.lock:
+            return {'subscribers': len(self.subscriptions), 'blocks_published': self.published,
+                    'dropped': self.dropped}
+
+
+def test():
+    from blockchain import Blockchain
+    from transaction import Transaction
+    blockchain = Blockchain()
+    broadcaster = Broadcaster()
+    blockchain.add_listener(broadcaster.listener)
+
+    dest = config.admin_list[0][::-1]
+    watcher = broadcaster.subscribe([dest])
+    slow = Subscription(size=1)
+    broadcaster.subscriptions.add(slow)
+
+    for i in range(3):
+        t = Transaction(f"Grant {i}", '+10', dest)
+        t.sign(config.sk_restored)
+        blockchain.add_transaction(t)
+        blockchain.extend_chain(blockchain.new_block())
+
+    while True:
+        item = watcher.get(0)
+        if item is None:
+            break
+        print(item)
+    print("slow dropped:", slow.dropped, broadcaster.stats())
+
+
+if __name__ == '__main__':
+    test()
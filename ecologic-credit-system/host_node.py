@@ -1,8 +1,27 @@
 from blockchain import *
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from contextlib import contextmanager
+from functools import wraps
+import argparse
+from itertools import islice
+import json
+import logging
+import math
 import socket
-from transaction import Transaction
+import threading
+from transaction import Transaction, InvalidValue, InvalidDestination
+from block_producer import BlockProducer
+import metrics
+import profiling
 import utils
+from response_cache import ResponseCache
+from events import Broadcaster
+from analytics import Analytics
+from archive import block_to_dict
+from replica import Replica
+from rate_limit import RateLimiter, AdmissionQueue
+
+logger = logging.getLogger(__name__)
 
 # Instantiate our Node
 app = Flask(__name__)
@@ -10,94 +29,604 @@ app = Flask(__name__)
 # Instantiate the Blockchain
 blockchain = Blockchain()
 
+# The blockchain is shared between the request handlers and the block producer
+lock = threading.RLock()
+producer = BlockProducer(blockchain, lock)
+
+metrics.Gauge('ecs_mempool_size', "Number of transactions in the mempool").set_function(lambda: len(blockchain.mempool))
+metrics.Gauge('ecs_mempool_bytes', "Size of the transactions of the mempool").set_function(lambda: blockchain.mempool_bytes)
+metrics.Gauge('ecs_chain_height', "Index of the last block of the chain").set_function(lambda: blockchain.last_block.index)
+
+slow_requests = profiling.SlowRequestLog()
+
+# Rate limiting of the admissions, by client address and by author, and backpressure (see rate_limit.py)
+client_limiter = RateLimiter(config.rate_limit_client, config.rate_limit_client_burst)
+author_limiter = RateLimiter(config.rate_limit_author, config.rate_limit_author_burst)
+admission_queue = AdmissionQueue()
+throttled_requests = metrics.Counter('ecs_throttled_requests_total', "Admission requests answered with a 429 or a 503",
+                                     ['reason'])
+
+responses = ResponseCache()
+blockchain.add_listener(responses.listener)
+
+broadcaster = Broadcaster()
+blockchain.add_listener(broadcaster.listener)
+
+if config.prune_keep is not None:
+    from archive import Archive
+    blockchain.enable_pruning(config.prune_keep, Archive(config.archive_path))
+
+analytics = Analytics(blockchain.chain)
+blockchain.add_listener(analytics.listener)
+
+store = None
+if config.columnar_store:
+    from columnar import TransactionStore
+    store = TransactionStore(blockchain.chain)
+    blockchain.add_listener(store.listener)
+
+# The primary followed by this node, if it is a read replica (see replica.py and start_replica)
+replica = None
+
+
+@contextmanager
+def locked():
+    """
+    Hold the blockchain lock, recording the time spent waiting for it as a stage of the request
+    """
+    with profiling.stage('lock wait'):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+@app.before_request
+def start_request_timer():
+    profiling.start_request()
+
+
+@app.after_request
+def log_slow_request(response):
+    timer = profiling.end_request()
+    if timer is not None:
+        slow_requests.add(request.endpoint, request.method, request.path, request.content_length or 0, timer)
+    if replica is not None:
+        blocks, _ = replica.lag()
+        if blocks is not None:  # Omitted until the height of the primary is known
+            response.headers['X-Replica-Lag'] = str(blocks)
+    return response
+
+
+def write(view):
+    """
+    Decorator of the endpoints which modify the blockchain: a read replica rejects them with a 403
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if replica is not None:
+            return jsonify({'message': "Read-only replica, send the writes to the primary",
+                            'primary': replica.primary}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def cached_response(params, compute, mempool=False):
+    """
+    Response of a read endpoint, cached until the chain changes (see response_cache). A request whose If-None-Match
+    matches the current ETag gets a 304.
+    :param params: the parameters of the request (str)
+    :param compute: function without parameters returning the response (dict), called with the lock held
+    :param mempool: True if the response depends on the mempool
+    """
+    with locked():
+        key = (request.endpoint, params, blockchain.last_block.hash(), blockchain.mempool_version if mempool else None)
+        etag = ResponseCache.etag(key)
+        if request.if_none_match.contains(etag):
+            responses.not_modified += 1
+            response = Response(status=304)
+        else:
+            response = Response(responses.get(key, lambda: json.dumps(compute())), mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
 @app.route('/chain', methods=['GET'])
 def full_chain():
     """
     Retrieve the entire blockchain
     """
-    response = {
-        # 'chain': [block.__dict__ for block in blockchain.chain],
-        # 'length': len(blockchain.chain),
-        'blockchain': str(blockchain)
-    }
-    return jsonify(response), 200
-    # return response, 200
+    def compute():
+        with profiling.stage('serialize chain'):
+            chain = str(blockchain)
+        return {
+            # 'chain': [block.__dict__ for block in blockchain.chain],
+            # 'length': len(blockchain.chain),
+            'blockchain': chain
+        }
+    return cached_response('', compute, mempool=config.show_mempool)
     
 @app.route('/balance', methods=['POST'])
 def view_balance():
     data = request.get_json()
     hash = data['hash']
-    print(hash)
-    bal = blockchain.get_balance(hash)
-    return jsonify({'balance':bal}), 200
+    logger.debug("Balance of %s", hash)
+
+    def compute():
+        with profiling.stage('get_balance'):
+            return {'balance': blockchain.get_balance(hash), 'height': blockchain.last_block.index}
+    return cached_response(hash, compute)
+
+@app.route('/balances', methods=['POST'])
+def view_balances():
+    """
+    Balances of many accounts ({'hashes': [...]}) or of every account of the chain ({'hashes': 'all'}), computed in
+    one pass over the chain. The response {'balances': {hash: balance}} is streamed.
+    """
+    data = request.get_json()
+    hashes = data.get('hashes') if isinstance(data, dict) else None
+    if hashes != 'all' and not (isinstance(hashes, list) and all(isinstance(h, str) for h in hashes)):
+        return "Missing hashes (a list of hashes or 'all')", 400
+
+    with locked(), profiling.stage('get_balances'):
+        balances = blockchain.get_balances(None if hashes == 'all' else hashes)
+
+    def generate():
+        yield '{"balances": {'
+        items = list(balances.items())
+        for i in range(0, len(items), 1000):
+            yield (', ' if i else '') + ', '.join(f'{json.dumps(h)}: {b}' for h, b in items[i:i + 1000])
+        yield '}}'
+    return Response(generate(), mimetype='application/json'), 200
     
 
 @app.route('/past_transactions', methods=['POST'])
 def view_past_transactions():
     data = request.get_json()
     hash = data['hash']
-    print(hash)
-    histo = blockchain.get_transaction_history(hash)
-    return jsonify({'histo':histo}), 200
+    logger.debug("History of %s", hash)
+
+    def compute():
+        with profiling.stage('get_transaction_history'):
+            return {'histo': blockchain.get_transaction_history(hash), 'height': blockchain.last_block.index}
+    return cached_response(hash, compute)
+
+def retry_later(reason, wait, status=429):
+    """
+    A 429 (rate limit) or 503 (backpressure) response, with the number of seconds to wait in Retry-After
+    :param reason: 'client', 'author' or 'backpressure'
+    :param wait: seconds
+    """
+    throttled_requests.inc(reason=reason)
+    response = jsonify({'message': 'Too many requests' if status == 429 else 'Node overloaded', 'reason': reason,
+                        'retry_after': wait})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def throttle_client(n):
+    """
+    Take n tokens from the bucket of the client address
+    :return: a response if the client must retry later, else None
+    """
+    if not config.rate_limit:
+        return None
+    wait = client_limiter.take(request.remote_addr, n)
+    if wait == float('inf'):
+        return f'More than {client_limiter.burst} transactions in a request', 413
+    if wait:
+        return retry_later('client', wait)
+    return None
+
+
+def throttle_author(transaction):
+    """
+    Check the bucket of the author of transaction without taking a token: the author is not verified yet (see
+    charge_author)
+    :return: the time to wait before the author of transaction can submit it (seconds, 0 for the admins)
+    """
+    if not config.rate_limit or transaction.author in config.admin_list:
+        return 0.0
+    return author_limiter.peek(transaction.author)
+
+
+def charge_author(transaction):
+    """
+    Take a token from the bucket of the author of an admitted transaction (its signature was verified)
+    """
+    if config.rate_limit and transaction.author not in config.admin_list:
+        author_limiter.charge(transaction.author)
+
+
+def transaction_from_values(values):
+    """
+    Create a transaction from the POST'ed data
+    :return: the transaction, or None if the data are incomplete or invalid
+    """
+    # Check that the required fields are in the POST'ed data
+    required = ['message', 'value', 'dest','date','author','vk','signature']
+    if not isinstance(values, dict) or not all(k in values for k in required):
+        return None
+
+    try:
+        return Transaction(
+            message = values['message'],
+            value = values['value'],
+            dest = values['dest'],
+            date = values['date'],
+            author = values['author'],
+            vk = values['vk'],
+            signature = values['signature']
+        )
+    except (InvalidValue, InvalidDestination, TypeError):
+        return None
 
 @app.route('/transactions/new', methods=['POST'])
+@write
 def new_transaction():
     """
     Create a new transaction to add to the mempool
     """
+    if config.rate_limit and not admission_queue.enter():
+        return retry_later('backpressure', config.backpressure_retry_after, 503)
+    try:
+        return add_new_transaction()
+    finally:
+        if config.rate_limit:
+            admission_queue.leave()
+
+def add_new_transaction():
+    """
+    Body of /transactions/new, once the request has a place in the admission queue
+    """
+    throttled = throttle_client(1)
+    if throttled is not None:
+        return throttled
+
     values = request.get_json()
 
     # Check that the required fields are in the POST'ed data
     required = ['message', 'value', 'dest','date','author','vk','signature']
     if not all(k in values for k in required):
         return 'Missing values', 400
-    
-    print(values)
-    
+
     # Create a new Transaction
-    transaction = Transaction(
-        message = values['message'],
-        value = values['value'],
-        dest = values['dest'],
-        date = values['date'],
-        author = values['author'],
-        vk = values['vk'],
-        signature = values['signature']
-    )
-    print(transaction)
+    transaction = transaction_from_values(values)
+    if transaction is None:
+        return 'Invalid transaction', 400
+    wait = throttle_author(transaction)
+    if wait:
+        return retry_later('author', wait)
+    logger.debug("New transaction %s", transaction.message)
+
     # Add transaction to the mempool
-    if blockchain.add_transaction(transaction):
+    with locked():
+        added = blockchain.add_transaction(transaction)
+        if added:
+            producer.notify(transaction)
+            charge_author(transaction)
+
+    if added:
         response = {'message': f'Transaction will be added to the mempool'}
         return jsonify(response), 201
     else:
         return 'Invalid transaction', 400
 
+@app.route('/transactions/batch', methods=['POST'])
+@write
+def new_transactions():
+    """
+    Add a list of transactions to the mempool ({'transactions': [...]}). Each transaction is accepted or rejected
+    independently, the response gives the result of each one, in order. The transactions of an author over its rate
+    limit are rejected with the reason 'rate limited'.
+    """
+    if config.rate_limit and not admission_queue.enter():
+        return retry_later('backpressure', config.backpressure_retry_after, 503)
+    try:
+        return add_new_transactions()
+    finally:
+        if config.rate_limit:
+            admission_queue.leave()
+
+def add_new_transactions():
+    """
+    Body of /transactions/batch, once the request has a place in the admission queue
+    """
+    values = request.get_json()
+    if not isinstance(values, dict) or not isinstance(values.get('transactions'), list):
+        return 'Missing transactions', 400
+
+    # The number of transactions is only known once the body is parsed
+    throttled = throttle_client(len(values['transactions']))
+    if throttled is not None:
+        return throttled
+
+    transactions = [transaction_from_values(v) for v in values['transactions']]
+    results = []
+    with locked():
+        for transaction in transactions:
+            if transaction is None:
+                results.append({'accepted': False, 'reason': 'malformed'})
+                continue
+            if throttle_author(transaction):
+                results.append({'accepted': False, 'reason': 'rate limited'})
+                continue
+            reason = blockchain.admit(transaction)
+            if reason is None:
+                producer.notify(transaction)
+                charge_author(transaction)
+            results.append({'accepted': reason is None, 'reason': reason})
+
+    return jsonify({'results': results}), 200
+
+@app.route('/transactions/range', methods=['GET'])
+def transactions_in_range():
+    """
+    Retrieve the transactions of the chain whose date is in [start, end[
+    (query parameters in format "%Y-%m-%d %H:%M:%S.%f", the time part is optional)
+    """
+    try:
+        start = utils.query_to_us(request.args['start'])
+        end = utils.query_to_us(request.args['end'])
+    except (KeyError, ValueError):
+        return 'Missing or invalid start/end dates', 400
+
+    with locked(), profiling.stage('get_transactions_between'):
+        transactions = blockchain.get_transactions_between(start, end)
+    response = {'transactions': [dict(t.data, signature=t.signature) for t in transactions]}
+    return jsonify(response), 200
+
+@app.route('/transactions/<transaction_hash>', methods=['GET'])
+def transaction_status(transaction_hash):
+    """
+    Status of a transaction: confirmed (block, position, confirmations) or pending (in the mempool)
+    """
+    with locked():
+        status = blockchain.transaction_status(transaction_hash)
+    if status is None:
+        return jsonify({'hash': transaction_hash, 'status': 'unknown'}), 404
+    return jsonify(dict(status, hash=transaction_hash)), 200
+
 @app.route('/mine', methods=['GET'])
+@write
 def mine():
     """
     Mine a new block by taking transactions from the mempool
     """
-    if len(blockchain.mempool) == 0:
-        return 'No transactions to mine', 250
-
-    # Create a new block from transactions in the mempool
-    new_block = blockchain.new_block()
-
-    # Add the new block to the chain if it is valid
+    # Create a new block from transactions in the mempool and add it to the chain if it is valid
     try:
-        blockchain.extend_chain(new_block)
+        with profiling.stage('seal'):
+            new_block = producer.seal()
     except InvalidBlock:
         return 'Invalid block', 450
 
+    if new_block is None:
+        return 'No transactions to mine', 250
+
     response = {
         'message': "New Block Forged",
         'index': new_block.index,
-        'transactions': [trans.__dict__ for trans in new_block.transactions],
+        'transactions': [dict(trans.data, signature=trans.signature) for trans in new_block.transactions],
         'previous_hash': new_block.previous_hash,
     }
     return jsonify(response), 200
 
+@app.route('/blocks', methods=['GET'])
+def blocks():
+    """
+    The full blocks of the chain from ?from=index, at most ?limit=config.replica_batch_blocks (followed by the replicas)
+    """
+    try:
+        start = int(request.args.get('from', 0))
+        limit = min(int(request.args.get('limit', config.replica_batch_blocks)), config.replica_batch_blocks)
+    except ValueError:
+        return 'Invalid from or limit', 400
+    if start < 0 or limit <= 0:
+        return 'Invalid from or limit', 400
+
+    with locked(), profiling.stage('blocks'):
+        if start >= blockchain.first_full:
+            selected = blockchain.chain[start:start + limit]
+        else:
+            # Pruned blocks, read from the archive
+            selected = islice((block for block in blockchain.blocks() if block.index >= start), limit)
+        response = {'height': blockchain.last_block.index, 'blocks': [block_to_dict(block) for block in selected]}
+    return jsonify(response), 200
+
+@app.route('/replica/status', methods=['GET'])
+def replica_status():
+    """
+    The primary followed by this replica and the lag behind it (404 on a primary)
+    """
+    if replica is None:
+        return 'Not a replica', 404
+    return jsonify(replica.status()), 200
+
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    Server-Sent Events: the current height, then the headers of the new blocks and the balance deltas of the accounts
+    given as ?accounts=hash1,hash2 (see events.py)
+    """
+    accounts = [a for a in request.args.get('accounts', '').split(',') if a]
+    with locked():
+        subscription = broadcaster.subscribe(accounts, blockchain.last_block.index)
+    return Response(broadcaster.stream(subscription), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/events/stats', methods=['GET'])
+def events_stats():
+    return jsonify(broadcaster.stats()), 200
+
+@app.route('/analytics', methods=['GET'])
+def analytics_summary():
+    """
+    Height, total supply, number of companies and periods of the analytics (see analytics.py)
+    """
+    with locked():
+        return jsonify(analytics.summary()), 200
+
+@app.route('/analytics/top', methods=['GET'])
+def analytics_top():
+    """
+    The companies with the highest balances (?n=10)
+    """
+    try:
+        n = int(request.args.get('n', config.analytics_top))
+    except ValueError:
+        return 'Invalid n', 400
+    with locked():
+        response = {'height': analytics.height,
+                    'holders': [{'account': a, 'balance': b} for a, b in analytics.top_holders(n)]}
+    return jsonify(response), 200
+
+@app.route('/analytics/periods/<period>', methods=['GET'])
+def analytics_period(period):
+    """
+    Credits issued, burned and transferred during a period (e.g. 2024-Q3), with the flows between companies
+    (?account=hash: only the flows of a company)
+    """
+    account = request.args.get('account')
+    with locked():
+        response = dict(analytics.period(period), height=analytics.height,
+                        flows=[{'author': a, 'dest': d, 'value': v}
+                               for a, d, v in analytics.period_flows(period, account)])
+    return jsonify(response), 200
+
+@app.route('/reports', methods=['GET'])
+def reports():
+    """
+    Number and sum of the values of the transactions matching the filters of the query string (account, author, dest,
+    start, end, min_value, max_value, first_block, last_block), grouped by ?group_by=author|dest|block|day|month|year.
+    Served from the columnar store (see columnar.py), if config.columnar_store is set.
+    """
+    if store is None:
+        return 'Reports are disabled (config.columnar_store)', 404
+
+    args = request.args
+    try:
+        filters = {name: args[name] for name in ('account', 'author', 'dest') if name in args}
+        filters.update({name: utils.query_to_us(args[name]) for name in ('start', 'end') if name in args})
+        filters.update({name: int(args[name]) for name in ('min_value', 'max_value', 'first_block', 'last_block')
+                        if name in args})
+    except ValueError:
+        return 'Invalid filter', 400
+
+    with locked(), profiling.stage('report'):
+        mask = store.scan(**filters)
+        response = {'height': blockchain.last_block.index, 'count': int(mask.sum()),
+                    'sum': int(store.value.view()[mask].sum())}
+        if 'group_by' in args:
+            try:
+                response['groups'] = store.group_by(args['group_by'], mask)
+            except ValueError as e:
+                return str(e), 400
+    return jsonify(response), 200
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Statistics of the response cache
+    """
+    return jsonify(responses.stats()), 200
+
+@app.route('/producer/stats', methods=['GET'])
+def producer_stats():
+    """
+    Block production metrics (time-to-inclusion in seconds)
+    """
+    return jsonify(producer.stats()), 200
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """
+    Timing of the admission stages and rejections by reason
+    """
+    with locked():
+        stats = blockchain.admission_stats()
+    return jsonify(stats), 200
+
+@app.route('/ratelimit/stats', methods=['GET'])
+def rate_limit_stats():
+    """
+    Token buckets of the clients and of the authors, and depth of the admission queue
+    """
+    return jsonify({'enabled': config.rate_limit, 'clients': client_limiter.stats(),
+                    'authors': author_limiter.stats(), 'admission_queue': admission_queue.stats()}), 200
+
+@app.route('/mempool/stats', methods=['GET'])
+def mempool_stats():
+    """
+    Size and limits of the mempool, evicted and expired transactions
+    """
+    with locked():
+        stats = blockchain.mempool_stats()
+    return jsonify(stats), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Metrics in the Prometheus text format
+    """
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """
+    Run the sampling profiler for a number of seconds and return the collapsed stacks (flamegraph format).
+    Admin only: the payload must be built with utils.sign_admin_request(sk, 'profile', seconds=N).
+    """
+    values = request.get_json()
+    if not utils.verify_admin_request(values, 'profile', config.admin_list, config.admin_request_max_age):
+        return 'Forbidden', 403
+
+    try:
+        seconds = min(float(values.get('seconds', 10)), config.profile_max_seconds)
+        stacks = profiling.sample_stacks(seconds)
+    except (TypeError, ValueError):
+        return 'Invalid duration', 400
+    except profiling.ProfilerBusy:
+        return 'A profile is already running', 409
+
+    return Response(stacks, mimetype='text/plain')
+
+@app.route('/admin/slow_requests', methods=['POST'])
+def admin_slow_requests():
+    """
+    The requests slower than config.slow_request_threshold, with their timing breakdown.
+    Admin only: the payload must be built with utils.sign_admin_request(sk, 'slow_requests').
+    """
+    values = request.get_json()
+    if not utils.verify_admin_request(values, 'slow_requests', config.admin_list, config.admin_request_max_age):
+        return 'Forbidden', 403
+
+    return jsonify({'threshold': slow_requests.threshold, 'requests': slow_requests.list()}), 200
+
+@app.route('/admin/audit', methods=['POST'])
+def admin_audit():
+    """
+    Recompute every balance from the genesis (audit.py, requires NumPy) and compare it with the balances maintained
+    incrementally by the analytics. Admin only: utils.sign_admin_request(sk, 'audit').
+    """
+    values = request.get_json()
+    if not utils.verify_admin_request(values, 'audit', config.admin_list, config.admin_request_max_age):
+        return 'Forbidden', 403
+
+    import audit
+    with locked():
+        chain = list(blockchain.blocks())
+        height = analytics.height
+        cached = dict(analytics.balances)
+    # The blocks of the chain are never modified: the columns are built without the lock
+    with profiling.stage('audit'):
+        columns = audit.Columns(chain)
+        mismatches = audit.audit(columns, cached, height)
+    return jsonify({'height': height, 'transactions': len(columns), 'accounts': len(cached),
+                    'mismatches': mismatches}), 200
+
 @app.route('/nodes/register', methods=['POST'])
+@write
 def register_nodes():
     """
     Register new nodes in the network
@@ -118,6 +647,7 @@ def register_nodes():
     return jsonify(response), 201
 
 @app.route('/nodes/resolve', methods=['GET'])
+@write
 def consensus():
     """
     Consensus algorithm to resolve conflicts
@@ -142,7 +672,8 @@ def validate_chain():
     """
     Validate the entire blockchain
     """
-    is_valid = blockchain.validity()
+    with locked(), profiling.stage('validity'):
+        is_valid = blockchain.validity()
     response = {
         'valid': is_valid,
         'message': 'The blockchain is valid' if is_valid else 'The blockchain is not valid'
@@ -150,6 +681,7 @@ def validate_chain():
     return jsonify(response), 200
 
 @app.route('/chain/merge', methods=['POST'])
+@write
 def merge_chain():
     """
     Merge with another blockchain if it is longer and valid
@@ -165,14 +697,36 @@ def merge_chain():
     other_chain.chain = [Block(**block_data) for block_data in values['chain']]
 
     # Attempt to merge the blockchains
-    if blockchain.merge(other_chain):
+    with locked(), profiling.stage('merge'):
+        merged = blockchain.merge(other_chain)
+
+    if merged:
         response = {'message': 'Blockchain merged successfully'}
     else:
         response = {'message': 'Merge unsuccessful. The provided chain is not longer or not valid.'}
     
     return jsonify(response), 200
 
+def start_replica(primary):
+    """
+    Make this node a read replica of primary (url): it follows the chain of the primary and rejects the writes
+    """
+    global replica
+    replica = Replica(blockchain, lock, primary).start()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a node")
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--replica-of', default=config.replica_of, metavar='URL',
+                        help="follow the primary node at URL and only serve the read endpoints")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=config.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     # Get the local IP address to bind the Flask server
     host_ip = socket.gethostbyname(socket.gethostname())
-    app.run(host=host_ip, port=5000)
+    if args.replica_of:
+        start_replica(args.replica_of)
+    elif config.auto_mine:
+        producer.start()
+    app.run(host=host_ip, port=args.port)
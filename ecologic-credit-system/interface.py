@@ -1,16 +1,18 @@
 import tkinter as tk
-from tkinter import messagebox
-import requests
+from tkinter import messagebox, simpledialog, ttk
 import json
 import socket
 import re
-import utils
-from ecdsa import SigningKey
-from transaction import Transaction
-import binascii
+from transaction import Signer, InvalidDestination
+import config
+from client import NodeClient, NodeError
+from keystore import Keystore, WrongPassword
+from background import Worker, LedgerCache
 
-global hostip
-hostip = 'http://138.195.53.65:5000'
+# The network calls run in the worker threads, their results are handled in the Tk main thread (see background.py)
+client = NodeClient(config.node_url)
+worker = Worker()
+ledger = LedgerCache(client)
 
 def get_local_address():
     # Get the local IP address of the machine
@@ -19,110 +21,180 @@ def get_local_address():
     return local_ip
 
 
+def in_background(button, function, on_done, title):
+    """
+    Run function in a worker thread, with the button disabled until on_done(result) is called in the main thread.
+    Errors are shown in a message box.
+    """
+    button.config(state='disabled')
+
+    def done(result):
+        button.config(state='normal')
+        on_done(result)
+
+    def failed(e):
+        button.config(state='normal')
+        if isinstance(e, NodeError):
+            messagebox.showerror(title, f"The node answered {e.status}.")
+        else:
+            messagebox.showerror("Error", str(e))
+
+    worker.submit(function, done, failed)
+
+
+class HistoryTable(tk.Toplevel):
+    """
+    Window showing a history in a table. Only the visible rows are inserted in the Treeview, the scrollbar moves a
+    window over the rows, so that long histories open instantly.
+    """
+    columns = ["Date", "Message", "Auteur", "Destinataire", "Valeur", "Effet sur la Balance"]
+
+    def __init__(self, master, title, rows, visible=config.gui_history_rows):
+        super().__init__(master)
+        self.title(title)
+        self.rows = rows
+        self.visible = visible
+        self.offset = 0
+
+        self.tree = ttk.Treeview(self, columns=self.columns, show='headings', height=visible)
+        for column in self.columns:
+            self.tree.heading(column, text=column)
+            self.tree.column(column, width=170 if column in ("Date", "Message") else 100)
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.scroll)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll('scroll', -event.delta // 120, 'units'))
+        self.tree.bind('<Button-4>', lambda event: self.scroll('scroll', -1, 'units'))
+        self.tree.bind('<Button-5>', lambda event: self.scroll('scroll', 1, 'units'))
+        self.render()
+
+    def scroll(self, action, amount, unit=None):
+        """
+        Command of the scrollbar: ('moveto', fraction) or ('scroll', n, 'units' or 'pages')
+        """
+        last = max(0, len(self.rows) - self.visible)
+        if action == 'moveto':
+            offset = int(float(amount) * len(self.rows))
+        else:
+            offset = self.offset + int(amount) * (self.visible if unit == 'pages' else 1)
+        self.offset = min(max(offset, 0), last)
+        self.render()
+
+    def render(self):
+        self.tree.delete(*self.tree.get_children())
+        for row in self.rows[self.offset:self.offset + self.visible]:
+            self.tree.insert('', 'end', values=row)
+        if self.rows:
+            self.scrollbar.set(self.offset / len(self.rows), (self.offset + self.visible) / len(self.rows))
+        else:
+            self.scrollbar.set(0, 1)
+
+
 def mine_block():
-    try:
-        response = requests.get(hostip + '/mine')
-        if response.status_code == 200:
-            messagebox.showinfo("Mine Block", "Block mined successfully!\n" + json.dumps(response.json(), indent=4))
+    def done(block):
+        if block is not None:
+            messagebox.showinfo("Mine Block", "Block mined successfully!\n" + json.dumps(block, indent=4))
         else:
             messagebox.showerror("Mine Block", "Failed to mine block.")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+
+    in_background(mine_button, client.mine, done, "Mine Block")
 
 
 def new_transaction():
+    sender = get_local_address()
+    destinataire = destinataire_entry.get()
+    message = message_entry.get()
+    value = value_entry.get()
+
+    # Validate the value for compulsory +/- sign
+    val_pattern = r"^[-+][0-9]+$"
+    if not re.match(val_pattern, value):
+        messagebox.showerror("Input Error", "Value must start with '+' for credits gained or '-' for credits lost.")
+        return
+
     try:
-        sender = get_local_address()
-        destinataire = destinataire_entry.get()
-        message = message_entry.get()
-        value = value_entry.get()
-        
-        # Validate the value for compulsory +/- sign
-        val_pattern = r"^[-+][0-9]+$"
-        if not re.match(val_pattern, value):
-            messagebox.showerror("Input Error", "Value must start with '+' for credits gained or '-' for credits lost.")
-            return
-        
-        t = Transaction(message, value, destinataire)
-        t.sign(sk)
-
-        # Transaction data
-        data = {
-            "message": t.message,
-            "value": t.value,
-            "dest": t.dest,
-            "date": t.date,
-            "author": t.author,
-            "vk": t.vk,
-            "signature": t.signature 
-        }
-
-        # Send transaction to the backend
-        response = requests.post(hostip + '/transactions/new', json=data)
-        if response.status_code == 201:
-            messagebox.showinfo("New Transaction", response.json()["message"])
+        t = signer.transaction(message, value, destinataire or None)
+    except InvalidDestination:
+        messagebox.showerror("Input Error", "The destination must be the hash of a verifying key.")
+        return
+
+    def done(accepted):
+        if accepted:
+            messagebox.showinfo("New Transaction", "Transaction will be added to the mempool")
         else:
             messagebox.showerror("New Transaction", "Failed to create transaction.")
-    except ValueError:
-        messagebox.showerror("Input Error", "Value must be a valid integer starting with '+' or '-'.")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+
+    # Send transaction to the backend
+    in_background(transaction_button, lambda: client.submit(t), done, "New Transaction")
 
 
 def view_chain():
-    try:
-        response = requests.get(hostip + '/chain')
-        if response.status_code == 200:
-            chain_data = json.dumps(response.json(), indent=4)
-            messagebox.showinfo("Blockchain", chain_data)
-            # messagebox.showinfo("Blockchain", response)
-        else:
-            messagebox.showerror("View Chain", "Failed to retrieve blockchain.")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+    def done(chain):
+        messagebox.showinfo("Blockchain", json.dumps(chain, indent=4))
+
+    in_background(view_chain_button, client.chain, done, "View Chain")
 
 
 def view_balance():
     hash = target_entry.get()
-    try:
-        response = requests.post(hostip + '/balance', json={'hash': hash})
-        if response.status_code == 200:
-            messagebox.showinfo("Balance", f"Target's balance is {response.json()["balance"]} credits")
-        else:
-            messagebox.showerror("Balance", "Failed to get balance.")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+
+    def done(balance):
+        messagebox.showinfo("Balance", f"Target's balance is {balance} credits")
+
+    in_background(balance_button, lambda: ledger.balance(hash), done, "Balance")
 
 
 def view_past_transactions():
     hash = target_entry.get()
-    try:
-        response = requests.post(hostip + '/past_transactions', json={'hash': hash})
-        if response.status_code == 200:
-            history = response.json()["histo"]
-            colonnes = ["Date", "Message", "Auteur", "Destinataire", "Valeur", "Effet sur la Balance"]
 
-            tableau = " | ".join(colonnes) + "\n"  
-            tableau += "-" * 80 + "\n" 
+    def done(history):
+        HistoryTable(root, f"Transaction History of {hash[:12]}...", history)
 
-            for ligne in history:
-                tableau += " | ".join(ligne) + "\n"  
+    in_background(past_transactions_button, lambda: ledger.history(hash), done, "Transaction History")
 
-            messagebox.showinfo("Transaction History", tableau)
-        else:
-            messagebox.showerror("Balance", "Failed to get balance.")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
 
+def load_signing_key():
+    """
+    Unlock the wallet (config.keystore_path) and return the key config.wallet_key_name. The key is created the first
+    time. The password is asked until it is correct.
+    """
+    keystore = Keystore()
+    while True:
+        password = simpledialog.askstring("Wallet", "Wallet password:", show='*', parent=root)
+        if password is None:
+            root.destroy()
+            raise SystemExit
+        try:
+            keystore.unlock(password)
+            break
+        except WrongPassword:
+            messagebox.showerror("Wallet", "Wrong password.")
+
+    if config.wallet_key_name not in keystore:
+        keystore.generate(config.wallet_key_name)
+        keystore.save()
+    return keystore.get_key(config.wallet_key_name)
 
-sk = SigningKey.generate()
-print(binascii.hexlify(sk.to_string()).decode('utf-8'))
-print(utils.hash_str(sk))
 
 # Setup Tkinter window
 root = tk.Tk()
 root.title("Ecological Credit System")
 
+sk = load_signing_key()
+signer = Signer(sk)
+
+# Keep the balance and the history of the wallet up to date from the events of the node
+ledger.watch(signer.author)
+ledger.follow()
+worker.schedule(root)
+
+# Wallet address (read-only, can be copied to receive credits)
+tk.Label(root, text="Wallet Address:").pack(pady=5)
+wallet_entry = tk.Entry(root, width=66)
+wallet_entry.insert(0, signer.author)
+wallet_entry.config(state='readonly')
+wallet_entry.pack()
+
 # Mine Block Button
 mine_button = tk.Button(root, text="Mine Block", command=mine_block)
 mine_button.pack(pady=10)
@@ -172,3 +244,5 @@ past_transactions_button.pack(pady=10)
 
 # Start Tkinter loop
 root.mainloop()
+ledger.stop()
+worker.shutdown()
@@ -0,0 +1,219 @@
+"""
+This module contains the class Keystore. A keystore is a single file holding many signing keys, each one encrypted with
+a key derived from the password of the keystore (see encrypt_data).
+
+The key derivation (PBKDF2, 100k iterations) is done once, when the keystore is unlocked. The keystore then keeps the
+Fernet object and the decrypted signing keys in memory until it is locked again, so that a signer can sign thousands of
+transactions without deriving the key again.
+
+The file is a json dictionary:
+    - salt: the salt of the key derivation (hexadecimal)
+    - check: a token encrypting a constant, used to detect a wrong password
+    - keys: name -> token encrypting the PEM of the signing key
+
+Usage:
+    python keystore.py list
+    python keystore.py generate NAME [nist192p|ed25519]   # default: config.key_type
+    python keystore.py import NAME HEX      # a NIST192p key as hexadecimal (see config.sk_string)
+"""
+
+import binascii
+import json
+import os
+import sys
+from getpass import getpass
+from cryptography.fernet import Fernet, InvalidToken
+from ecdsa import SigningKey
+import config
+import encrypt_data
+import signatures
+import utils
+
+check_value = b"ecologic-credit-system keystore"
+
+
+class KeystoreLocked(Exception):
+    pass
+
+
+class WrongPassword(Exception):
+    pass
+
+
+class UnknownKey(Exception):
+    pass
+
+
+class Keystore(object):
+    def __init__(self, path=config.keystore_path):
+        """
+        Open the keystore stored in path (the file is created on the first save). The keystore is locked.
+        :param path: str
+        """
+        self.path = path
+        self.fernet = None
+        self.signing_keys = {}  # name -> SigningKey, filled when the keys are used
+
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.salt = bytes.fromhex(data['salt'])
+            self.check = data['check'].encode()
+            self.tokens = data['keys']
+        else:
+            self.salt = encrypt_data.generate_salt()
+            self.check = None
+            self.tokens = {}
+
+    @property
+    def locked(self):
+        return self.fernet is None
+
+    def unlock(self, password):
+        """
+        Derive the key of the keystore from the password. For a new keystore, the password is set.
+        :param password: str
+        :raise WrongPassword if the password does not match the keystore
+        """
+        # The Fernet object is only kept by the keystore, so that lock() really forgets the derived key
+        fernet = Fernet(encrypt_data.generate_private_key(password, self.salt))
+        if self.check is None:
+            self.check = fernet.encrypt(check_value)
+        else:
+            try:
+                if fernet.decrypt(self.check) != check_value:
+                    raise WrongPassword()
+            except InvalidToken:
+                raise WrongPassword()
+        self.fernet = fernet
+
+    def lock(self):
+        """
+        Forget the derived key and the decrypted signing keys
+        """
+        self.fernet = None
+        self.signing_keys = {}
+
+    def _fernet(self):
+        if self.fernet is None:
+            raise KeystoreLocked()
+        return self.fernet
+
+    def names(self):
+        """
+        :return: the names of the keys, sorted
+        """
+        return sorted(self.tokens)
+
+    def __contains__(self, name):
+        return name in self.tokens
+
+    def add_key(self, name, sk):
+        """
+        Add (or replace) a signing key. The keystore must be unlocked. Call save to write the file.
+        :param name: str
+        :param sk: a signing key
+        """
+        self.tokens[name] = self._fernet().encrypt(signatures.to_pem(sk)).decode()
+        self.signing_keys[name] = sk
+
+    def generate(self, name, kind=None):
+        """
+        Generate a new signing key and add it to the keystore
+        :param name: str
+        :param kind: 'nist192p' or 'ed25519' (None: config.key_type)
+        :return: the signing key
+        """
+        sk = signatures.generate(kind)
+        self.add_key(name, sk)
+        return sk
+
+    def get_key(self, name):
+        """
+        Return a signing key. It is decrypted once per session.
+        :param name: str
+        :raise UnknownKey, KeystoreLocked
+        :return: the signing key
+        """
+        if name not in self.signing_keys:
+            if name not in self.tokens:
+                raise UnknownKey(name)
+            pem = self._fernet().decrypt(self.tokens[name].encode())
+            self.signing_keys[name] = SigningKey.from_pem(pem)
+        return self.signing_keys[name]
+
+    def remove_key(self, name):
+        self.tokens.pop(name, None)
+        self.signing_keys.pop(name, None)
+
+    def save(self):
+        """
+        Write the keystore to its file (atomically). The keystore must have been unlocked once.
+        """
+        if self.check is None:
+            raise KeystoreLocked()
+        data = {'salt': self.salt.hex(), 'check': self.check.decode(), 'keys': self.tokens}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def open_keystore(password, path=config.keystore_path):
+    """
+    Open and unlock a keystore
+    :return: the keystore
+    """
+    keystore = Keystore(path)
+    keystore.unlock(password)
+    return keystore
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('list', 'generate', 'import'):
+        print(__doc__)
+        sys.exit(1)
+
+    keystore = open_keystore(getpass("Keystore password: "))
+    command = sys.argv[1]
+
+    if command == 'generate':
+        keystore.generate(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        keystore.save()
+    elif command == 'import':
+        keystore.add_key(sys.argv[2], SigningKey.from_string(binascii.unhexlify(sys.argv[3].encode('utf-8'))))
+        keystore.save()
+
+    for name in keystore.names():
+        print(name, utils.hash_str(keystore.get_key(name)))
+
+
+def test():
+    import tempfile
+    import time
+    path = os.path.join(tempfile.mkdtemp(), 'test.keystore')
+
+    keystore = open_keystore("password", path)
+    for i in range(3):
+        keystore.generate(f"key {i}")
+    keystore.save()
+
+    start = time.time()
+    keystore = open_keystore("password", path)
+    print(f"Unlocked in {time.time() - start:.3f} s")
+
+    start = time.time()
+    from transaction import Transaction
+    for i in range(100):
+        t = Transaction(f"Message {i}", '-1')
+        t.sign(keystore.get_key(f"key {i % 3}"))
+    print(f"100 transactions signed in {time.time() - start:.3f} s")
+
+    try:
+        open_keystore("wrong", path)
+    except WrongPassword:
+        print("Wrong password detected")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Load generator for the node (host_node). It drives /transactions/new, /balance, /past_transactions and /mine with a
+configurable mix of requests and number of concurrent clients, then reports the latency percentiles of each endpoint
+and the throughput.
+
+The node is either the Flask app of host_node run in-process (default, through the Flask test client) or a node
+listening on a url (--url http://127.0.0.1:5000).
+
+Before the run, the company accounts are funded by admin grants, then pools of valid and invalid transactions are
+signed in advance so that signing does not weigh on the measures. Invalid transactions are rejected for various
+reasons: bad signature, self credit, insufficient balance, malformed value.
+
+Usage:
+    python loadgen.py --requests 5000 --concurrency 8 --mix new=70,balance=15,history=10,mine=5
+    python loadgen.py --url http://127.0.0.1:5000 --keys 200 --invalid 0.3
+"""
+
+import argparse
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict
+from rich.console import Console
+from rich.table import Table
+import config
+import utils
+from benchmark import make_keys
+from transaction import Transaction
+
+endpoints = {
+    'new': ('POST', '/transactions/new'),
+    'balance': ('POST', '/balance'),
+    'history': ('POST', '/past_transactions'),
+    'mine': ('GET', '/mine'),
+}
+
+
+class InProcessClient(object):
+    """
+    Client calling the Flask app of host_node directly (one test client per thread)
+    """
+    def __init__(self):
+        import host_node
+        self.app = host_node.app
+        self.local = threading.local()
+
+    def request(self, method, path, payload=None):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        if method == 'GET':
+            return self.local.client.get(path).status_code
+        return self.local.client.post(path, json=payload).status_code
+
+
+class HttpClient(object):
+    """
+    Client calling a node on a url (one HTTP session per thread)
+    """
+    def __init__(self, url):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, payload=None):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        if method == 'GET':
+            return self.local.session.get(self.url + path).status_code
+        return self.local.session.post(self.url + path, json=payload).status_code
+
+
+def payload(transaction):
+    """
+    :return: the json payload of /transactions/new for a transaction
+    """
+    return dict(transaction.data, signature=transaction.signature)
+
+
+def fund(client, accounts, amount=1000000):
+    """
+    Give credits to every account with admin grants, and mine until the mempool is empty
+    """
+    for account in accounts:
+        t = Transaction("Load test grant", f"+{amount}", account)
+        t.sign(config.sk_restored)
+        client.request('POST', '/transactions/new', payload(t))
+    while client.request('GET', '/mine') == 200:
+        pass
+
+
+def make_pools(keys, accounts, size, invalid_ratio, rng):
+    """
+    Sign the transactions submitted during the run
+    :return: (valid payloads, invalid payloads)
+    """
+    valid, invalid = [], []
+    for i in range(size):
+        k, d = rng.sample(range(len(keys)), 2)
+        if rng.random() >= invalid_ratio:
+            t = Transaction(f"Load test {i}", f"+{rng.randint(1, 10)}", accounts[d])
+            t.sign(keys[k])
+            valid.append(payload(t))
+            continue
+
+        kind = i % 4
+        if kind == 0:
+            # Bad signature
+            t = Transaction(f"Load test {i}", '+1', accounts[d])
+            t.sign(keys[k])
+            p = payload(t)
+            p['signature'] = p['signature'][::-1]
+        elif kind == 1:
+            # A company cannot give itself credit
+            t = Transaction(f"Load test {i}", '+10')
+            t.sign(keys[k])
+            p = payload(t)
+        elif kind == 2:
+            # Insufficient balance
+            t = Transaction(f"Load test {i}", '+1000000000', accounts[d])
+            t.sign(keys[k])
+            p = payload(t)
+        else:
+            # Malformed value
+            t = Transaction(f"Load test {i}", '+1', accounts[d])
+            t.sign(keys[k])
+            p = payload(t)
+            p['value'] = '10'
+        invalid.append(p)
+    return valid, invalid
+
+
+def parse_mix(mix):
+    """
+    :param mix: str like "new=70,balance=15,history=10,mine=5"
+    :return: dict {operation: weight}
+    """
+    weights = {}
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        if name not in endpoints:
+            raise ValueError(f"Unknown operation {name}, expected one of {', '.join(endpoints)}")
+        weights[name] = float(weight)
+    return weights
+
+
+def run(client, operations, transactions, accounts, concurrency):
+    """
+    Send the requests with concurrency threads
+    :param operations: list of operation names, in order
+    :param transactions: iterator over the transaction payloads
+    :return: (dict {operation: [(latency, status)]}, duration in seconds)
+    """
+    results = defaultdict(list)
+    queue = iter(operations)
+    lock = threading.Lock()
+
+    def worker():
+        rng = random.Random()
+        while True:
+            with lock:
+                operation = next(queue, None)
+                if operation == 'new':
+                    data = next(transactions)
+            if operation is None:
+                return
+            if operation in ('balance', 'history'):
+                data = {'hash': rng.choice(accounts)}
+            elif operation == 'mine':
+                data = None
+
+            method, path = endpoints[operation]
+            start = time.perf_counter()
+            status = client.request(method, path, data)
+            latency = time.perf_counter() - start
+            with lock:
+                results[operation].append((latency, status))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def log(results, duration):
+    """
+    Print a nice table of the results
+    """
+    table = Table(title=f"Load test ({duration:.2f} s)")
+    table.add_column("Endpoint", justify="left", style="cyan")
+    table.add_column("Requests", justify="right")
+    table.add_column("Status", justify="left", style="magenta")
+    table.add_column("p50", justify="right", style="green")
+    table.add_column("p99", justify="right", style="green")
+    table.add_column("Requests/s", justify="right")
+
+    for operation, measures in sorted(results.items()):
+        latencies = sorted(latency for latency, _ in measures)
+        statuses = defaultdict(int)
+        for _, status in measures:
+            statuses[status] += 1
+        table.add_row(endpoints[operation][1], str(len(measures)),
+                      ", ".join(f"{status}: {n}" for status, n in sorted(statuses.items())),
+                      f"{utils.percentile(latencies, 50) * 1000:.2f} ms",
+                      f"{utils.percentile(latencies, 99) * 1000:.2f} ms",
+                      f"{len(measures) / duration:.1f}")
+
+    Console().print(table)
+
+    total = sum(len(measures) for measures in results.values())
+    accepted = sum(1 for _, status in results.get('new', []) if status == 201)
+    print(f"{total / duration:.1f} requests/s, {accepted / duration:.1f} accepted transactions/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the node")
+    parser.add_argument('--url', help="url of the node (default: the Flask app of host_node, in-process)")
+    parser.add_argument('--requests', type=int, default=2000, help="total number of requests")
+    parser.add_argument('--concurrency', type=int, default=8, help="number of concurrent clients")
+    parser.add_argument('--mix', default="new=70,balance=15,history=10,mine=5",
+                        help="weights of the operations among new, balance, history and mine")
+    parser.add_argument('--keys', type=int, default=50, help="number of company keys")
+    parser.add_argument('--invalid', type=float, default=0.2, help="ratio of invalid transactions")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate-limit', action='store_true',
+                        help="keep the rate limiting of the in-process node (all the requests come from one address)")
+    args = parser.parse_args()
+    if not args.url:
+        config.rate_limit = args.rate_limit
+
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+    operations = rng.choices(list(weights), list(weights.values()), k=args.requests)
+    nb_transactions = operations.count('new')
+
+    client = HttpClient(args.url) if args.url else InProcessClient()
+    console = Console()
+
+    with console.status(f"Funding {args.keys} accounts"):
+        keys = make_keys(args.keys, args.seed)
+        accounts = [utils.hash_str(sk) for sk in keys]
+        fund(client, accounts)
+
+    with console.status(f"Signing {nb_transactions} transactions"):
+        valid, invalid = make_pools(keys, accounts, nb_transactions, args.invalid, rng)
+        pool = valid + invalid
+        rng.shuffle(pool)
+
+    with console.status(f"Sending {args.requests} requests"):
+        results, duration = run(client, operations, itertools.cycle(pool), accounts, args.concurrency)
+
+    log(results, duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+This module contains minimal Prometheus-style metrics: counters, gauges and histograms, with optional labels, and a
+registry which renders them in the Prometheus text format (served by the node on /metrics).
+
+Metrics are created once, at module level, and registered in the default registry:
+
+    verifications = metrics.Histogram('ecs_signature_verify_seconds', "Time to verify a signature")
+    with verifications.time():
+        ...
+
+Updating a metric takes a lock and a few additions, so it can be done on hot paths.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+default_buckets = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text format (str)
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _labels(names, values, extra=()):
+    """
+    Format labels as {name="value",...}
+    """
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=registry):
+        """
+        :param name: name of the metric
+        :param documentation: help text
+        :param labelnames: names of the labels, the values are given when the metric is updated
+        :param registry: the registry in which the metric is registered (None: not registered)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function):
+        """
+        Compute the value (without labels) when the metrics are rendered
+        :param function: a callable without parameters
+        """
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            return [f"{self.name} {self.function()}"]
+        with self.lock:
+            return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, buckets=default_buckets, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [counts per bucket (+Inf last), sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts, _ = self.values[key]
+            counts[i] += 1
+            self.values[key][1] += value
+
+    def time(self, **labels):
+        """
+        Context manager observing the time spent in its block
+        """
+        return _Timer(self, labels)
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulated = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulated += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {cumulated}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulated}")
+        return lines
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def test():
+    requests = Counter('test_requests_total', "Requests", ['status'])
+    latency = Histogram('test_latency_seconds', "Latency", buckets=(0.001, 0.01))
+    size = Gauge('test_size', "Size")
+    requests.inc(status=200)
+    requests.inc(status=200)
+    requests.inc(status=400)
+    with latency.time():
+        time.sleep(0.002)
+    latency.observe(0.0005)
+    size.set_function(lambda: 42)
+    print(registry.render())
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,186 @@
+"""
+This module contains the profiling tools of the node:
+
+- sample_stacks(seconds) is a sampling profiler. It periodically records the stack of every thread and returns the
+  stacks in the collapsed format of flamegraph.pl / speedscope ("frame;frame;frame count" per line). It only runs when
+  called, so it costs nothing otherwise.
+- SlowRequestLog records the requests slower than a threshold, with a per-stage timing breakdown. The stages of the
+  current request are recorded with stage(name) (context manager) or record(name, seconds). Outside of a request,
+  recording a stage is a single thread-local lookup.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+import config
+import utils
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_profiling = threading.Lock()  # Only one sampling profile at a time
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def sample_stacks(seconds, interval=config.profile_interval):
+    """
+    Sample the stacks of all the threads (except the current one) during a number of seconds.
+    :param seconds: duration of the profile
+    :param interval: time between two samples (seconds)
+    :raise ProfilerBusy if a profile is already running
+    :return: the collapsed stacks, one "frame;frame;...;frame count" per line, root frame first (str)
+    """
+    if not _profiling.acquire(blocking=False):
+        raise ProfilerBusy()
+
+    try:
+        stacks = Counter()
+        current = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        end = time.monotonic() + seconds
+
+        while time.monotonic() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident == current:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_name(frame))
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(interval)
+
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    finally:
+        _profiling.release()
+
+
+class RequestTimer(object):
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []  # (name, seconds)
+
+
+def start_request():
+    """
+    Start recording the stages of the request handled by the current thread
+    :return: a RequestTimer
+    """
+    _local.timer = RequestTimer()
+    return _local.timer
+
+
+def end_request():
+    """
+    Stop recording the stages of the current request
+    :return: the RequestTimer of the request, or None
+    """
+    timer = getattr(_local, 'timer', None)
+    _local.timer = None
+    return timer
+
+
+def record(name, seconds):
+    """
+    Record the duration of a stage of the current request (nothing is done outside of a request)
+    """
+    timer = getattr(_local, 'timer', None)
+    if timer is not None:
+        timer.stages.append((name, seconds))
+
+
+class stage(object):
+    """
+    Context manager recording the time spent in its block as a stage of the current request
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class SlowRequestLog(object):
+    def __init__(self, threshold=config.slow_request_threshold, size=config.slow_request_log_size):
+        """
+        :param threshold: requests slower than threshold seconds are recorded
+        :param size: number of slow requests kept
+        """
+        self.threshold = threshold
+        self.entries = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, handler, method, path, payload_size, timer):
+        """
+        Record the request if it is slow
+        :param handler: name of the handler of the request
+        :param payload_size: size of the body of the request (bytes)
+        :param timer: the RequestTimer of the request
+        :return: True if the request was slow
+        """
+        duration = time.perf_counter() - timer.start
+        if duration < self.threshold:
+            return False
+
+        entry = {
+            'date': utils.get_time(),
+            'handler': handler,
+            'method': method,
+            'path': path,
+            'payload_size': payload_size,
+            'duration': duration,
+            'stages': [{'name': name, 'duration': seconds} for name, seconds in timer.stages],
+        }
+        with self.lock:
+            self.entries.append(entry)
+        logger.warning("Slow request %s %s (%s, %d bytes): %.3f s [%s]", method, path, handler, payload_size,
+                       duration, ", ".join(f"{name} {seconds:.3f} s" for name, seconds in timer.stages))
+        return True
+
+    def list(self):
+        """
+        :return: the recorded slow requests, most recent last
+        """
+        with self.lock:
+            return list(self.entries)
+
+
+def test():
+    def busy():
+        end = time.monotonic() + 1
+        while time.monotonic() < end:
+            sum(i * i for i in range(1000))
+
+    thread = threading.Thread(target=busy, name="busy")
+    thread.start()
+    print(sample_stacks(0.5))
+    thread.join()
+
+    slow_log = SlowRequestLog(threshold=0.01)
+    timer = start_request()
+    with stage('sleep'):
+        time.sleep(0.02)
+    end_request()
+    slow_log.add('test', 'GET', '/test', 0, timer)
+    print(slow_log.list())
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,178 @@
+"""
+Rate limiting of the admissions of the node (/transactions/new and /transactions/batch), checked before the signature
+verification and the balance scan:
+
+- RateLimiter: one token bucket per key (the address of the client, or the hash of the author of the transactions).
+  A bucket holds at most burst tokens and is refilled with rate tokens per second; each transaction takes a token. When
+  the bucket is empty, the node answers 429 with a Retry-After header (the time until enough tokens are back). The
+  buckets are created on demand and the least recently used ones are forgotten beyond config.rate_limit_keys.
+  The author of a transaction is only known once its signature is verified: the bucket of an author is checked with
+  peek before the admission, and charged only when the transaction is admitted, so that anyone cannot drain the bucket
+  of a company with transactions claiming its hash.
+- AdmissionQueue: the number of admission requests waiting for the blockchain lock. Beyond config.admission_max_waiting,
+  the node answers 503 with a Retry-After header instead of queueing more work (backpressure).
+
+NodeClient (see client.py) retries after a 429 or a 503, waiting for Retry-After.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+import config
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, n, now):
+        """
+        :param n: number of tokens
+        :param now: time (seconds, monotonic)
+        :return: 0 if the tokens are available, else the time to wait before they are (seconds, inf if n > burst)
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if n <= self.tokens:
+            return 0.0
+        if n > self.burst:
+            return float('inf')
+        return (n - self.tokens) / self.rate
+
+    def take(self, n, now):
+        """
+        Same as wait, and take the tokens if they are available
+        """
+        wait = self.wait(n, now)
+        if not wait:
+            self.tokens -= n
+        return wait
+
+
+class RateLimiter(object):
+    def __init__(self, rate, burst, size=config.rate_limit_keys):
+        """
+        :param rate: tokens added per second to each bucket
+        :param burst: size of the buckets
+        :param size: maximum number of buckets kept
+        """
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self.buckets = OrderedDict()  # key -> TokenBucket
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+
+    def _bucket(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def take(self, key, n=1):
+        """
+        :param key: e.g. the address of the client or the hash of an author
+        :param n: number of transactions
+        :return: 0 if the transactions are allowed, else the time to wait before retrying (seconds)
+        """
+        now = time.monotonic()
+        with self.lock:
+            wait = self._bucket(key, now).take(n, now)
+            if wait:
+                self.throttled += n
+            else:
+                self.allowed += n
+            return wait
+
+    def peek(self, key, n=1):
+        """
+        Same as take, without taking the tokens (see charge)
+        """
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            wait = bucket.wait(n, now) if bucket is not None else (0.0 if n <= self.burst else float('inf'))
+            if wait:
+                self.throttled += n
+            return wait
+
+    def charge(self, key, n=1):
+        """
+        Take n tokens, even if they are not all available (the bucket then refills from a negative level)
+        """
+        now = time.monotonic()
+        with self.lock:
+            bucket = self._bucket(key, now)
+            bucket.wait(n, now)
+            bucket.tokens -= n
+            self.allowed += n
+
+    def stats(self):
+        with self.lock:
+            return {'rate': self.rate, 'burst': self.burst, 'keys': len(self.buckets), 'allowed': self.allowed,
+                    'throttled': self.throttled}
+
+
+class AdmissionQueue(object):
+    def __init__(self, limit=config.admission_max_waiting):
+        """
+        :param limit: maximum number of admission requests in progress
+        """
+        self.limit = limit
+        self.depth = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def enter(self):
+        """
+        :return: True if the request can wait for the admission, False if the queue is full (then leave must not be
+                 called)
+        """
+        with self.lock:
+            if self.depth >= self.limit:
+                self.rejected += 1
+                return False
+            self.depth += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.depth -= 1
+
+    def stats(self):
+        with self.lock:
+            return {'depth': self.depth, 'limit': self.limit, 'rejected': self.rejected}
+
+
+def test():
+    limiter = RateLimiter(rate=10, burst=5)
+    waits = [limiter.take('client') for _ in range(7)]
+    assert waits[:5] == [0.0] * 5 and 0 < waits[5] <= 0.1, waits
+    assert limiter.take('other') == 0.0
+    assert limiter.take('client', 100) == float('inf')
+    time.sleep(0.2)
+    assert limiter.take('client', 2) == 0.0
+
+    # peek does not take tokens, charge does
+    assert limiter.peek('author', 5) == 0.0 and limiter.peek('author', 5) == 0.0
+    limiter.charge('author', 5)
+    assert limiter.peek('author') > 0
+    print(waits, limiter.stats())
+
+    queue = AdmissionQueue(limit=2)
+    assert queue.enter() and queue.enter() and not queue.enter()
+    queue.leave()
+    assert queue.enter()
+    print(queue.stats())
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,164 @@
+"""
+This module contains the class Replica: a node started with --replica-of URL (or config.replica_of) follows the chain of
+a primary node and only serves the read endpoints. It rejects the writes (transactions, mining, merges) and reports how
+far behind the primary it is (/replica/status, and the X-Replica-Lag header of every response once the height of the
+primary is known).
+
+The replica subscribes to the events of the primary (/events, see events.py). Each new block announced by the primary
+is fetched with /blocks?from= and added with Blockchain.extend_chain, so the replica maintains its own indexes (balances
+from its listeners, histories, locations, time index). When the primary replaces its chain (a 'reset' event), or when a
+fetched block does not follow the local chain, the whole chain is fetched again and replaces the local one if it is
+valid.
+"""
+
+import logging
+import threading
+import time
+import config
+from archive import block_from_dict
+from block import InvalidBlock
+from blockchain import Blockchain
+from client import NodeClient, NodeError
+
+logger = logging.getLogger(__name__)
+
+
+class Replica(object):
+    def __init__(self, blockchain, lock, primary=config.replica_of):
+        """
+        :param blockchain: the blockchain of the replica
+        :param lock: the lock of the blockchain
+        :param primary: url of the primary node
+        """
+        self.blockchain = blockchain
+        self.lock = lock
+        self.primary = primary
+        self.client = NodeClient(primary)
+        self.primary_height = None  # Last height announced by the primary
+        self.behind_since = None  # Time at which the primary announced a block not applied yet
+        self.last_sync = None
+        self.resyncs = 0
+        self.running = False
+
+    def _announce(self, height):
+        self.primary_height = height
+        if self.behind_since is None and height > self.blockchain.last_block.index:
+            self.behind_since = time.time()
+
+    def sync(self):
+        """
+        Fetch and add the blocks of the primary until the replica has its height
+        """
+        while True:
+            with self.lock:
+                start = self.blockchain.last_block.index + 1
+            data = self.client.blocks(start)
+            self._announce(data['height'])
+            blocks = [block_from_dict(block) for block in data['blocks']]
+            with self.lock:
+                try:
+                    for block in blocks:
+                        self.blockchain.extend_chain(block)
+                except InvalidBlock:
+                    logger.warning("Block #%d of the primary does not follow the local chain", block.index)
+                    break
+                height = self.blockchain.last_block.index
+            if not blocks or height >= data['height']:
+                self._synced(height)
+                return
+        self.resync()
+
+    def _synced(self, height):
+        self.last_sync = time.time()
+        if height >= self.primary_height:
+            self.behind_since = None
+
+    def resync(self):
+        """
+        Fetch the whole chain of the primary and replace the local chain, if the fetched chain is valid (otherwise the
+        local chain is kept, and fetched again at the next reset or mismatch)
+        """
+        chain = []
+        height = 0
+        while len(chain) <= height:
+            data = self.client.blocks(len(chain))
+            height = data['height']
+            if not data['blocks']:
+                break
+            chain.extend(block_from_dict(block) for block in data['blocks'])
+        # Checked outside of the lock: the replica keeps serving its current chain meanwhile
+        candidate = Blockchain()
+        candidate.chain = chain
+        if not chain or not candidate.validity():
+            logger.warning("Chain of the primary (%d blocks) is not valid, the local chain is kept", len(chain))
+            return
+        with self.lock:
+            self.blockchain.replace(chain)
+        self.resyncs += 1
+        self.primary_height = height
+        self._synced(len(chain) - 1)
+        logger.info("Chain of the primary fetched again (%d blocks)", len(chain))
+
+    def start(self):
+        """
+        Follow the primary in a daemon thread
+        """
+        self.running = True
+        threading.Thread(target=self._follow, name="replica", daemon=True).start()
+        return self
+
+    def _follow(self):
+        while self.running:
+            try:
+                self.sync()
+                for event, data in self.client.events():
+                    if event in ('height', 'block'):
+                        self._announce(data['index'])
+                        self.sync()
+                    elif event == 'reset':
+                        self.resync()
+                    if not self.running:
+                        break
+            except (NodeError, OSError) as e:
+                logger.warning("Primary %s unreachable: %s", self.primary, e)
+            except Exception:
+                logger.exception("Replication failed")
+            if self.running:
+                threading.Event().wait(config.client_backoff)
+
+    def stop(self):
+        self.running = False
+
+    def lag(self):
+        """
+        :return: the number of blocks of the primary not applied yet, and for how long the replica is behind (seconds)
+        """
+        height = self.blockchain.last_block.index
+        blocks = max(0, self.primary_height - height) if self.primary_height is not None else None
+        seconds = time.time() - self.behind_since if self.behind_since is not None and blocks else 0.0
+        return blocks, seconds
+
+    def status(self):
+        blocks, seconds = self.lag()
+        return {
+            'primary': self.primary,
+            'height': self.blockchain.last_block.index,
+            'primary_height': self.primary_height,
+            'lag_blocks': blocks,
+            'lag_seconds': seconds,
+            'last_sync': self.last_sync,
+            'resyncs': self.resyncs,
+        }
+
+
+def test():
+    """
+    Follow a primary node running on 127.0.0.1:5000
+    """
+    replica = Replica(Blockchain(), threading.RLock(), "http://127.0.0.1:5000")
+    replica.sync()
+    print(replica.status())
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,96 @@
+"""
+This module contains the class ResponseCache, a cache of the serialized responses of the read endpoints of the node
+(/chain, /balance, /past_transactions).
+
+A response is keyed by (endpoint, parameters, hash of the last block), plus the version of the mempool for the
+responses which show the mempool. The ETag of a response is derived from its key, so a conditional request
+(If-None-Match) is answered with a 304 without computing nor even looking up the response. The cache is cleared when a
+block is added or the chain is replaced (see Blockchain.add_listener): entries keyed on an older tip can never be hit
+again.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+import config
+
+
+class ResponseCache(object):
+    def __init__(self, size=config.response_cache_size):
+        """
+        :param size: maximum number of responses kept (least recently used first out)
+        """
+        self.size = size
+        self.entries = OrderedDict()  # key -> body
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def etag(key):
+        """
+        :param key: tuple of str / int
+        :return: the ETag of the response of a key (str, without quotes)
+        """
+        return hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+
+    def get(self, key, compute):
+        """
+        :param key: tuple (endpoint, parameters, hash of the last block, ...)
+        :param compute: function without parameters returning the body of the response (str), called on a miss
+        :return: the body
+        """
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+
+        body = compute()
+        with self.lock:
+            self.entries[key] = body
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return body
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def listener(self, event, data):
+        """
+        Blockchain listener: clear the cache when the chain changes
+        """
+        if event in ('block', 'merge'):
+            self.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'not_modified': self.not_modified}
+
+
+def test():
+    cache = ResponseCache(size=2)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return '{"balance": 0}'
+
+    for _ in range(3):
+        cache.get(('/balance', 'a', 'tip'), compute)
+    cache.get(('/balance', 'b', 'tip'), compute)
+    cache.get(('/balance', 'c', 'tip'), compute)
+    cache.get(('/balance', 'a', 'tip'), compute)
+    assert len(calls) == 4, calls
+    cache.listener('block', None)
+    assert cache.stats()['size'] == 0
+    print(cache.stats(), ResponseCache.etag(('/balance', 'a', 'tip')))
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,208 @@
+"""
+Signature backends. Transactions (and admin requests) are signed and verified through the backend selected by
+config.signature_backend:
+
+- "ecdsa": the pure Python ecdsa package.
+- "openssl": the native ECDSA and Ed25519 of the cryptography package. It produces and accepts exactly the same
+  signatures as the ecdsa package: ECDSA with SHA-1 and the raw r || s encoding (the defaults of ecdsa), and plain
+  Ed25519. The parsed verifying keys are cached, since most transactions come from a few authors.
+
+Signing keys are always ecdsa SigningKey objects, whatever the backend, so that the keystore and the rest of the code do
+not depend on the backend. New keys can be NIST192p (the curve of the existing keys) or Ed25519, see generate.
+"""
+
+import logging
+from functools import lru_cache
+import ecdsa
+from ecdsa import SigningKey, VerifyingKey, BadSignatureError
+import config
+
+try:
+    from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+    from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature, decode_dss_signature
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key, load_der_private_key
+    has_cryptography = True
+except ImportError:
+    has_cryptography = False
+
+logger = logging.getLogger(__name__)
+
+curves = {'nist192p': ecdsa.NIST192p, 'ed25519': ecdsa.Ed25519}
+
+
+class UnknownBackend(Exception):
+    pass
+
+
+def generate(kind=None):
+    """
+    Generate a new signing key
+    :param kind: 'nist192p' or 'ed25519' (None: config.key_type)
+    :return: a SigningKey
+    """
+    return SigningKey.generate(curve=curves[kind or config.key_type])
+
+
+def _format(sk):
+    # Ed25519 keys only exist in PKCS#8, OpenSSL does not read the PKCS#8 of ecdsa for the other curves
+    return 'pkcs8' if sk.curve is ecdsa.Ed25519 else 'ssleay'
+
+
+def to_pem(sk):
+    """
+    :return: the PEM of a signing key, readable by SigningKey.from_pem
+    """
+    return sk.to_pem(format=_format(sk))
+
+
+@lru_cache(maxsize=4096)
+def _ecdsa_key(vk):
+    return VerifyingKey.from_pem(bytes.fromhex(vk))
+
+
+class EcdsaBackend(object):
+    name = 'ecdsa'
+
+    def signer(self, sk):
+        """
+        :param sk: a SigningKey
+        :return: a function signing a message (bytes) and returning the signature (bytes)
+        """
+        return sk.sign
+
+    def verify(self, vk, signature, message):
+        """
+        :param vk: the verifying key (PEM, hexadecimal)
+        :param signature: hexadecimal
+        :param message: bytes
+        :raise ValueError, MalformedPointError... if the key or the signature is malformed
+        :return: True or False
+        """
+        try:
+            return _ecdsa_key(vk).verify(bytes.fromhex(signature), message)
+        except BadSignatureError:
+            return False
+
+
+@lru_cache(maxsize=4096)
+def _openssl_key(vk):
+    """
+    :return: (public key, size of r and s in bytes) or None if OpenSSL does not support the key
+    """
+    try:
+        key = load_pem_public_key(bytes.fromhex(vk))
+    except UnsupportedAlgorithm:
+        return None
+    if isinstance(key, ec.EllipticCurvePublicKey):
+        return key, (key.curve.key_size + 7) // 8
+    if isinstance(key, ed25519.Ed25519PublicKey):
+        return key, None
+    return None
+
+
+class OpenSSLBackend(object):
+    name = 'openssl'
+
+    def __init__(self):
+        self.fallback = EcdsaBackend()
+
+    def signer(self, sk):
+        try:
+            private = load_der_private_key(sk.to_der(format=_format(sk)), None)
+        except UnsupportedAlgorithm:
+            return self.fallback.signer(sk)
+
+        if isinstance(private, ed25519.Ed25519PrivateKey):
+            return private.sign
+
+        algorithm = ec.ECDSA(getattr(hashes, sk.default_hashfunc().name.upper())())
+        size = sk.curve.baselen
+
+        def sign(message):
+            r, s = decode_dss_signature(private.sign(message, algorithm))
+            return r.to_bytes(size, 'big') + s.to_bytes(size, 'big')
+        return sign
+
+    def verify(self, vk, signature, message):
+        key = _openssl_key(vk)
+        if key is None:
+            return self.fallback.verify(vk, signature, message)
+
+        public, size = key
+        signature = bytes.fromhex(signature)
+        try:
+            if size is None:
+                public.verify(signature, message)
+            else:
+                if len(signature) != 2 * size:
+                    return False
+                r, s = int.from_bytes(signature[:size], 'big'), int.from_bytes(signature[size:], 'big')
+                public.verify(encode_dss_signature(r, s), message, ec.ECDSA(hashes.SHA1()))
+            return True
+        except InvalidSignature:
+            return False
+
+
+def get_backend(name):
+    """
+    :param name: 'ecdsa' or 'openssl'
+    :raise UnknownBackend
+    :return: a backend
+    """
+    if name == 'ecdsa':
+        return EcdsaBackend()
+    if name == 'openssl':
+        if has_cryptography:
+            return OpenSSLBackend()
+        logger.warning("cryptography is not installed, the ecdsa signature backend is used")
+        return EcdsaBackend()
+    raise UnknownBackend(name)
+
+
+_backend = None
+
+
+def backend():
+    """
+    :return: the backend selected by config.signature_backend
+    """
+    global _backend
+    if _backend is None:
+        _backend = get_backend(config.signature_backend)
+    return _backend
+
+
+def signer(sk):
+    return backend().signer(sk)
+
+
+def verify(vk, signature, message):
+    return backend().verify(vk, signature, message)
+
+
+def test():
+    import time
+    message = b"ecologic-credit-system"
+    backends = [EcdsaBackend(), OpenSSLBackend()]
+    for kind in curves:
+        sk = generate(kind)
+        vk = sk.verifying_key.to_pem().hex()
+        for signing in backends:
+            signature = signing.signer(sk)(message).hex()
+            for verifying in backends:
+                assert verifying.verify(vk, signature, message)
+                assert not verifying.verify(vk, signature, message + b"!")
+            print(kind, signing.name, "signature verified by", ", ".join(b.name for b in backends))
+
+        signature = sk.sign(message).hex()
+        for verifying in backends:
+            start = time.perf_counter()
+            for _ in range(100):
+                verifying.verify(vk, signature, message)
+            print(f"{kind} {verifying.name}: {(time.perf_counter() - start) * 10:.3f} ms per verification")
+
+
+if __name__ == '__main__':
+    test()
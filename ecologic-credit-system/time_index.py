@@ -0,0 +1,85 @@
+"""
+This module contains the class TimeIndex. A time index keeps the timestamps (integers, see utils.str_to_us) of the
+blocks and of the transactions of a chain in sorted lists, so that a query on a time range is a binary search followed
+by a range scan instead of a scan of the whole chain.
+
+Transactions are referenced by their location in the chain: (block index, position in the block).
+"""
+
+from bisect import bisect_left, bisect_right
+
+
+class TimeIndex(object):
+    def __init__(self, chain=()):
+        """
+        :param chain: the blocks to index, in order
+        """
+        self.block_times = []  # sorted timestamps of the blocks
+        self.block_indexes = []  # block index, in the order of block_times
+        self.tx_times = []  # sorted timestamps of the transactions
+        self.tx_locations = []  # (block index, position), in the order of tx_times
+
+        for block in chain:
+            self.add_block(block)
+
+    @staticmethod
+    def _insert(times, values, time, value):
+        """
+        Insert (time, value) in the parallel lists, keeping times sorted. Dates are mostly increasing so the common case
+        is an append.
+        """
+        if not times or times[-1] <= time:
+            times.append(time)
+            values.append(value)
+        else:
+            i = bisect_right(times, time)
+            times.insert(i, time)
+            values.insert(i, value)
+
+    def add_block(self, block):
+        """
+        Index a block and its transactions. Must be called when the block is added to the chain.
+        :param block: a block
+        """
+        self._insert(self.block_times, self.block_indexes, block.timestamp_us, block.index)
+        for position, transaction in enumerate(block.transactions):
+            self._insert(self.tx_times, self.tx_locations, transaction.timestamp_us, (block.index, position))
+
+    @staticmethod
+    def _remove(times, values, time, value):
+        i = bisect_left(times, time)
+        while values[i] != value:
+            i += 1
+        del times[i]
+        del values[i]
+
+    def remove_block(self, block):
+        """
+        Remove the transactions of a block from the index (see Blockchain.prune). The block itself stays indexed.
+        :param block: an indexed block
+        """
+        for position, transaction in enumerate(block.transactions):
+            self._remove(self.tx_times, self.tx_locations, transaction.timestamp_us, (block.index, position))
+
+    def blocks_between(self, start, end):
+        """
+        :param start: int, microseconds since the epoch
+        :param end: int, microseconds since the epoch (excluded)
+        :return: the indexes of the blocks whose timestamp is in [start, end[, sorted by timestamp
+        """
+        return self.block_indexes[bisect_left(self.block_times, start):bisect_left(self.block_times, end)]
+
+    def transactions_between(self, start, end):
+        """
+        :param start: int, microseconds since the epoch
+        :param end: int, microseconds since the epoch (excluded)
+        :return: the locations (block index, position) of the transactions whose date is in [start, end[, sorted by
+                 date
+        """
+        return self.tx_locations[bisect_left(self.tx_times, start):bisect_left(self.tx_times, end)]
+
+    def __len__(self):
+        """
+        Number of indexed transactions
+        """
+        return len(self.tx_times)
@@ -18,12 +18,18 @@ The hash of the transaction is the hash of the dictionary (keys are sorted).
 import utils
 import json
 import hashlib
-from ecdsa import VerifyingKey, BadSignatureError
+import signatures
 from rich.console import Console
 from rich.table import Table
 
 import re
 
+val_pattern = re.compile(r"^[-+][0-9]+$")
+dest_pattern = re.compile(r"^[0-9a-f]{64}$")
+
+cached_signers = 64
+_signers = {}  # id of a signing key -> its Signer (the Signer keeps the key alive, so the id is not reused)
+
 
 class IncompleteTransaction(Exception):
     pass
@@ -46,14 +52,14 @@ class Transaction(object):
         Author is the hash of the verifying key (or None if vk is not specified).
 
         :param message: str
-        :param date: str in format "%Y-%m-%d %H:%M:%S.%f" see (module "utils")
+        :param date: str in format "%Y-%m-%d %H:%M:%S.%f" see (module "utils"). The string is the canonical form used
+                     for hashing, its integer form is available with timestamp_us
         :param signature: str
         :param vk: str
         """
         self.message = message
         
-        val_pattern = r"^[-+][0-9]+$"
-        if re.match(val_pattern, value):
+        if val_pattern.match(value):
             self.value = value
         else:
             raise InvalidValue
@@ -62,6 +68,7 @@ class Transaction(object):
             self.date = date
         else:
             self.date = utils.get_time()
+        self._timestamp = None
         
         self.signature = signature
         self.vk = vk
@@ -72,8 +79,7 @@ class Transaction(object):
             self.author = author
 
         if dest:
-            dest_pattern = r"^[0-9a-f]{64}$"
-            if re.match(dest_pattern, dest):
+            if dest_pattern.match(dest):
                 self.dest = dest
             else:
                 raise InvalidDestination
@@ -104,32 +110,19 @@ class Transaction(object):
     def sign(self, sk):
         """
         Sign a transaction with a signing key. Set both attributes "signature" and "vk"
-        :param sk: A signing key (private)
+        The Signer of the last keys used is kept, so the verifying key is not encoded again for every transaction.
+        :param sk: A signing key (private) or a Signer
         """
-        self.vk = sk.verifying_key.to_pem().hex()
-
-        self.author = hashlib.sha256(self.vk.encode()).hexdigest()
-
-        #* manage the case where dest is None
-        if not self.dest:
-            self.dest = self.author
-
-        self.signature = sk.sign(self.json_dumps().encode()).hex()
+        if not isinstance(sk, Signer):
+            sk = Signer.of(sk)
+        sk.sign(self)
 
     def verify(self):
         """
-        Verify the signature of the transaction and the author.
+        Verify the signature of the transaction and the author, with the backend of config.signature_backend.
         :return: True or False
         """
-        VK = VerifyingKey.from_pem(bytes.fromhex(str(self.vk)))
-
-        binary_signature = bytes.fromhex(str(self.signature))
-
-        try:
-            VK.verify(binary_signature, self.json_dumps().encode())
-            return True  
-        except BadSignatureError:
-            return False  
+        return signatures.verify(str(self.vk), str(self.signature), self.json_dumps().encode())
     
     def __str__(self):
         """
@@ -144,23 +137,24 @@ class Transaction(object):
         Author:             {self.author}
         Signature:          {self.signature}"""
 
+    @property
+    def timestamp_us(self):
+        """
+        The date of the transaction in microseconds since the epoch. It is computed once from the date string.
+        :raise ValueError if the date is not valid
+        :return: int
+        """
+        if self._timestamp is None or self._timestamp[0] is not self.date:
+            self._timestamp = (self.date, utils.str_to_us(self.date))
+        return self._timestamp[1]
+
     def __lt__(self, other):
         """
-        Compare two transactions. The comparison is based on the hash of the transaction if it is defined else, the date.
+        Compare two transactions. The comparison is based on the date.
         :param other: a transaction 
         :return: True or False
         """
-        try: 
-            item1 = hashlib.sha256(self).digest()
-            item2 = hashlib.sha256(other).digest()
-
-            return item1 < item2
-        
-        except:
-            item1 = utils.str_to_time(self.date)
-            item2 = utils.str_to_time(other.date)
-
-            return item1 < item2
+        return self.timestamp_us < other.timestamp_us
 
     def hash(self):
         """
@@ -199,6 +193,62 @@ class Transaction(object):
         console.print(table)
 
 
+class Signer(object):
+    def __init__(self, sk):
+        """
+        Sign transactions with a signing key. The verifying key (PEM, hexadecimal) and its hash (the author) are
+        computed once.
+        :param sk: A signing key (private)
+        """
+        self.sk = sk
+        self._sign = signatures.signer(sk)
+        self.vk = sk.verifying_key.to_pem().hex()
+        self.author = hashlib.sha256(self.vk.encode()).hexdigest()
+        self.backend = signatures.backend()
+
+    @classmethod
+    def of(cls, sk):
+        """
+        Signer of a signing key, reused while the key is among the last cached_signers keys used (keys are not
+        hashable: they are looked up by identity) and the signature backend does not change.
+        :param sk: A signing key (private)
+        :return: a Signer
+        """
+        signer = _signers.get(id(sk))
+        if signer is None or signer.sk is not sk or signer.backend is not signatures.backend():
+            if len(_signers) >= cached_signers:
+                del _signers[next(iter(_signers))]
+            signer = _signers[id(sk)] = cls(sk)
+        return signer
+
+    def sign(self, transaction):
+        """
+        Sign a transaction. Set the attributes "vk", "author", "signature" and "dest" if it is None.
+        :param transaction: a transaction
+        :return: the transaction
+        """
+        transaction.vk = self.vk
+        transaction.author = self.author
+
+        #* manage the case where dest is None
+        if not transaction.dest:
+            transaction.dest = self.author
+
+        transaction.signature = self._sign(transaction.json_dumps().encode()).hex()
+        return transaction
+
+    def transaction(self, message, value, dest=None, date=None):
+        """
+        Create and sign a transaction
+        :param message: str
+        :param value: str, e.g. "+10" or "-10"
+        :param dest: hash of the destination (None for a transaction with oneself)
+        :param date: str (None for the current time)
+        :return: the signed transaction
+        """
+        return self.sign(Transaction(message, value, dest, date))
+
+
 def test0():
     print('-------------------test0-------------------')
     from ecdsa import SigningKey, NIST384p
@@ -1,14 +1,21 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import ecdsa
 from ecdsa import SigningKey
 import hashlib
+import json
+import re
+
+time_format = "%Y-%m-%d %H:%M:%S.%f"
+time_pattern = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}\.[0-9]{6}")
+epoch = datetime(1970, 1, 1)
+one_us = timedelta(microseconds=1)
 
 def get_time():
     """
     Return a string representing the current time in format "%Y-%m-%d %H:%M:%S.%f"
     :return: str
     """
-    return str(datetime.now())
+    return datetime.now().strftime(time_format)
 
 
 def str_to_time(s):
@@ -17,7 +24,53 @@ def str_to_time(s):
     :param s: str
     :return:
     """
-    return datetime.strptime(s, "%Y-%m-%d %H:%M:%S.%f")
+    return datetime.strptime(s, time_format)
+
+
+def str_to_us(s):
+    """
+    Convert a string in format "%Y-%m-%d %H:%M:%S.%f" into an integer number of microseconds since the epoch.
+    Much faster than str_to_time (no strptime). The dates are local and naive, as the ones produced by get_time.
+    Only this exact format is accepted (as by str_to_time), so that a date has a single spelling.
+    :param s: str
+    :raise ValueError if the string is not a valid date
+    :return: int
+    """
+    if len(s) != 26 or not time_pattern.fullmatch(s):
+        raise ValueError(f"Date {s!r} does not match format {time_format!r}")
+    return (datetime.fromisoformat(s) - epoch) // one_us
+
+
+def query_to_us(s):
+    """
+    Convert a date given as a query bound (e.g. /transactions/range) into microseconds since the epoch. Unlike
+    str_to_us, the time part is optional ("2024-07-01"), since such a date is never signed nor stored.
+    :param s: str
+    :raise ValueError if the string is not a valid date
+    :return: int
+    """
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo is not None:
+        raise ValueError(f"Unexpected timezone in {s}")
+    return (dt - epoch) // one_us
+
+
+def us_to_str(us):
+    """
+    Convert an integer number of microseconds since the epoch into a string in format "%Y-%m-%d %H:%M:%S.%f"
+    :param us: int
+    :return: str
+    """
+    return (epoch + us * one_us).strftime(time_format)
+
+
+def now_us():
+    """
+    Return the current time as an integer number of microseconds since the epoch (see str_to_us)
+    :return: int
+    """
+    return (datetime.now() - epoch) // one_us
+
 
 def hash_str(sk):
     vk = sk.verifying_key.to_pem().hex()
@@ -28,4 +81,51 @@ def inv_sign(string):
     if string[0] == '+':
         return '-' + string[1:]
     elif string[0] == '-':
-        return '+' + string[1:]
\ No newline at end of file
+        return '+' + string[1:]
+
+def percentile(values, q):
+    """
+    Return the q-th percentile of a sorted list of values (nearest rank).
+    :param values: a sorted, non empty list
+    :param q: float in [0, 100]
+    :return: an element of values
+    """
+    return values[int(round(q / 100 * (len(values) - 1)))]
+
+
+def sign_admin_request(sk, action, **params):
+    """
+    Build the payload of an admin request (e.g. /admin/profile): the parameters, the action and the date, signed
+    like a transaction.
+    :param sk: the signing key of an admin
+    :param action: name of the action (str)
+    :return: dict
+    """
+    import signatures
+    values = dict(params, action=action, date=get_time(), vk=sk.verifying_key.to_pem().hex())
+    values['signature'] = signatures.signer(sk)(json.dumps(values, sort_keys=True).encode()).hex()
+    return values
+
+
+def verify_admin_request(values, action, admin_list, max_age):
+    """
+    Check the payload of an admin request: the author is an admin, the action matches, the request is recent (at most
+    max_age seconds old) and the signature is valid.
+    :param values: dict built by sign_admin_request
+    :param action: expected action
+    :param admin_list: hashes of the verifying keys of the admins
+    :param max_age: seconds
+    :return: True or False
+    """
+    import signatures
+    try:
+        values = dict(values)
+        signature = values.pop('signature')
+        vk = values['vk']
+        if values['action'] != action or hashlib.sha256(vk.encode()).hexdigest() not in admin_list:
+            return False
+        if abs(now_us() - str_to_us(values['date'])) > max_age * 1000000:
+            return False
+        return signatures.verify(vk, signature, json.dumps(values, sort_keys=True).encode())
+    except (KeyError, TypeError, ValueError, ecdsa.errors.MalformedPointError):
+        return False